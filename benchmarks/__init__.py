@@ -0,0 +1,4 @@
+"""
+Benchmarks for streamstats_access.  Run individual benchmarks as modules from the repository root, e.g.
+``python -m benchmarks.bench_export``.
+"""
@@ -0,0 +1,116 @@
+"""
+Batch benchmark
+
+Runs process_batch end to end against the mock StreamStats server (benchmarks.mock_server) at several input
+sizes, then exports the finished points again with export_data.  Each run happens in a fresh process so its
+peak memory can be reported, and the mock server runs in a process of its own so serving requests does not
+compete with the client for the GIL.
+
+Reports throughput, peak resident memory, requests served by the mock and export time per size.
+
+Usage:
+    python -m benchmarks.bench_batch [n_points ...] [--concurrency 8] [--latency-scale 0.1] [--error-rate 0.01]
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import resource
+import sys
+import tempfile
+import time
+import urllib.request
+import warnings
+import geopandas as gpd
+from shapely.geometry import Point as ShapelyPoint
+import streamstats_access as ssa
+from streamstats_access.utils import export_data
+from benchmarks.mock_server import add_arguments, override_config, serve, server_kwargs
+
+
+def make_input(path, n, seed=0):
+    """
+    Writes n random points inside Vermont to a GeoPackage.
+    """
+    rng = random.Random(seed)
+    points = [ShapelyPoint(rng.uniform(-73.3, -71.6), rng.uniform(42.8, 44.9)) for _ in range(n)]
+    gpd.GeoDataFrame({'UID': range(n)}, geometry=points, crs=4326).to_file(path)
+
+
+def run_case(base_url, n, kwargs, results):
+    """
+    Runs one batch against the mock server and puts its measurements on results.  Runs in a child process.
+    """
+    # Keep the per-point log lines and the output layers' missing-CRS warnings out of the benchmark output
+    logging.basicConfig(level=logging.WARNING)
+    warnings.filterwarnings('ignore', message="'crs' was not provided")
+    with tempfile.TemporaryDirectory() as tmp, override_config(base_url):
+        in_path = os.path.join(tmp, 'in.gpkg')
+        make_input(in_path, n)
+        finished = []
+
+        def collect(event, data):
+            if event == 'point' and not data['failed']:
+                finished.append(data['point'])
+
+        start = time.perf_counter()
+        ssa.process_batch(in_path, os.path.join(tmp, 'out.gpkg'), 'VT', 'UID', hooks=[collect], **kwargs)
+        elapsed = time.perf_counter() - start
+
+        out_q = queue.Queue()
+        for pt in finished:
+            out_q.put_nowait(pt)
+        start = time.perf_counter()
+        export_data(os.path.join(tmp, 'export.gpkg'), out_q)
+        export = time.perf_counter() - start
+
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    results.put({'elapsed': elapsed, 'finished': len(finished), 'peak': peak, 'export': export})
+
+
+def served(base_url):
+    """
+    Returns the mock server's response counts.
+    """
+    with urllib.request.urlopen(base_url + '/stats') as response:
+        return json.load(response)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sizes', nargs='*', type=int, default=[100, 1000, 10000])
+    parser.add_argument('--concurrency', type=int, default=8, help='delineation workers per server')
+    parser.add_argument('--local-estimates', action='store_true')
+    add_arguments(parser)
+    parser.set_defaults(latency_scale=0.1)
+    args = parser.parse_args(argv)
+    kwargs = {'concurrency': args.concurrency, 'local_estimates': args.local_estimates, 'poll_schedule': (0.5, 1, 2)}
+
+    ctx = multiprocessing.get_context('spawn')
+    ready = ctx.Queue()
+    server = ctx.Process(target=serve, args=(0, ready), kwargs=server_kwargs(args), daemon=True)
+    server.start()
+    base_url = ready.get(timeout=60)
+    try:
+        for n in args.sizes:
+            before = sum(served(base_url).values())
+            results = ctx.Queue()
+            case = ctx.Process(target=run_case, args=(base_url, n, kwargs, results))
+            case.start()
+            r = results.get()
+            case.join()
+            requests = sum(served(base_url).values()) - before
+            print(f'{n:>7} points | {r["elapsed"]:8.1f}s | {60 * r["finished"] / r["elapsed"]:8.0f} points/min | '
+                  f'{r["finished"]:>7} finished | {requests:>7} requests | peak {r["peak"] / 2 ** 20:7.0f} MiB | '
+                  f'export {r["export"]:6.2f}s')
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
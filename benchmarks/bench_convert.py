@@ -0,0 +1,98 @@
+"""
+Conversion benchmark
+
+Runs the same batch against the mock StreamStats server (benchmarks.mock_server) with finished points converted to
+output rows in different places, and reports run time and how long the event loop was blocked (see
+monitor.LoopMonitor):
+
+- inline: on the event loop, as every batch used to be, so requests stall while a batch is converted;
+- thread: in the event loop's default thread pool (convert_workers=0), which still competes for the GIL;
+- processes: in worker processes (convert_workers=N).
+
+Large responses are decoded in worker processes too (--decode-workers), so that the stalls left are mostly those
+of the conversion.
+
+Usage:
+    python -m benchmarks.bench_convert [n_points] [--workers 2] [--decode-workers 2] [--concurrency 8]
+        [--flush-size 100] [--format gpkg] [--latency-scale 0.1]
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+import warnings
+from concurrent.futures import Executor, Future
+import streamstats_access as ssa
+from streamstats_access.monitor import LoopMonitor
+from benchmarks.bench_batch import make_input
+from benchmarks.mock_server import add_arguments, override_config, serve, server_kwargs
+
+
+class InlineExecutor(Executor):
+    """
+    Runs every call as soon as it is submitted, i.e. on the event loop.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+async def run_case(in_path, out_path, args, convert_workers):
+    monitor = LoopMonitor(interval=0.01, threshold=0.02)
+    task = asyncio.create_task(monitor.run())
+    start = time.perf_counter()
+    try:
+        await ssa.process_batch_async(in_path, out_path, 'VT', 'UID', concurrency=args.concurrency,
+                                      flush_size=args.flush_size, poll_schedule=(0.5, 1, 2),
+                                      decode_workers=args.decode_workers,
+                                      output_format=args.format, convert_workers=convert_workers)
+    finally:
+        task.cancel()
+    return time.perf_counter() - start, monitor.stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('n_points', nargs='?', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=2, help='conversion worker processes')
+    parser.add_argument('--decode-workers', type=int, default=2, help='response decoding worker processes')
+    parser.add_argument('--concurrency', type=int, default=8, help='delineation workers per server')
+    parser.add_argument('--flush-size', type=int, default=100)
+    parser.add_argument('--format', default='gpkg', choices=['gpkg', 'parquet', 'partitioned'])
+    add_arguments(parser)
+    parser.set_defaults(latency_scale=0.1)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    warnings.filterwarnings('ignore', message="'crs' was not provided")
+
+    ctx = multiprocessing.get_context('spawn')
+    ready = ctx.Queue()
+    server = ctx.Process(target=serve, args=(0, ready), kwargs=server_kwargs(args), daemon=True)
+    server.start()
+    base_url = ready.get(timeout=60)
+    cases = [('inline', InlineExecutor()), ('thread', 0), (f'{args.workers} processes', args.workers)]
+    try:
+        with tempfile.TemporaryDirectory() as tmp, override_config(base_url):
+            in_path = os.path.join(tmp, 'in.gpkg')
+            make_input(in_path, args.n_points)
+            for i, (name, convert_workers) in enumerate(cases):
+                out_path = os.path.join(tmp, f'out{i}' + ('.gpkg' if args.format == 'gpkg' else ''))
+                elapsed, stalls = asyncio.run(run_case(in_path, out_path, args, convert_workers))
+                print(f'{name:<12} | {elapsed:6.1f}s | {args.n_points / elapsed:6.1f} points/s | '
+                      f'loop blocked {stalls["total"]:5.2f}s in {stalls["stalls"]:4d} stalls, '
+                      f'longest {stalls["max"] * 1000:5.0f} ms')
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Decoding benchmark
+
+Parses synthetic watershed GeoJSON bodies the way Point delineation does (decode, then extract compact WKB
+features), with each decoder and with parsing on the event loop, in a worker thread or in a worker
+process, while a LoopMonitor measures how long the loop is blocked.  Decoders hold the GIL, so only a
+process pool takes the stall away entirely.
+
+Usage:
+    python -m benchmarks.bench_decode [n_vertices ...]
+"""
+
+import asyncio
+import functools
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from streamstats_access.api_client import APIClient
+from streamstats_access.decoding import orjson
+from streamstats_access.models import _parse_watershed
+from streamstats_access.monitor import LoopMonitor
+
+
+def make_body(n_vertices):
+    """
+    Builds a watershed response body with an n_vertices polygon.
+    """
+    ring = [[-73.0 + 1e-6 * k, 44.0 + 1e-6 * (k % 97)] for k in range(n_vertices)] + [[-73.0, 44.0]]
+    return json.dumps({'workspaceID': 'VT0', 'featurecollection': [
+        {'name': 'globalwatershedpoint', 'feature': {'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [-73.0, 44.0]}, 'properties': {'FID': 0}}]}},
+        {'name': 'globalwatershed', 'feature': {'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'geometry': {'type': 'Polygon', 'coordinates': [ring]}, 'properties': {'OBJECTID': 1}}]}}]}).encode()
+
+
+async def run(body, decoder, offload_bytes, executor=None, n_bodies=20, concurrency=4):
+    client = APIClient(decoder=decoder, offload_bytes=offload_bytes, executor=executor)
+    monitor = LoopMonitor(interval=0.005, threshold=0.01)
+    task = asyncio.create_task(monitor.run())
+    await asyncio.sleep(0.02)
+    start = time.perf_counter()
+    for _ in range(n_bodies // concurrency):
+        await asyncio.gather(*[client.decode(body, functools.partial(_parse_watershed)) for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    task.cancel()
+    return elapsed, monitor.stats
+
+
+def main(sizes):
+    decoders = ['json'] + (['orjson'] if orjson is not None else [])
+    processes = ProcessPoolExecutor(2)
+    for n in sizes:
+        body = make_body(n)
+        for decoder in decoders:
+            for mode, offload_bytes, executor in [('loop', 0, None), ('thread', 1, None), ('process', 1, processes)]:
+                elapsed, stats = asyncio.run(run(body, decoder, offload_bytes, executor))
+                print(f'{len(body) / 2 ** 20:6.2f} MiB | {decoder:>6} on {mode:<7} | {elapsed:6.3f}s | '
+                      f'longest stall {stats["max"] * 1000:7.1f} ms | {stats["stalls"]:>3} stalls')
+    processes.shutdown()
+
+
+if __name__ == '__main__':
+    main([int(a) for a in sys.argv[1:]] or [10000, 100000])
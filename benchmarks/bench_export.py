@@ -0,0 +1,123 @@
+"""
+Export benchmark
+
+Compares the columnar build_tables against the original per-point export (a frame per point built from
+the raw JSON responses with GeoDataFrame.from_features and pd.json_normalize, then pd.concat) and reports
+timings.  tests/test_utils.py checks that both produce the same layers and columns.
+
+Usage:
+    python -m benchmarks.bench_export [n_points ...]
+"""
+
+import sys
+import time
+import geopandas as gpd
+import pandas as pd
+from streamstats_access import Point
+from streamstats_access.utils import build_tables
+
+PARAMS = [('DRNAREA', 'Drainage Area', 'square miles'), ('ELEV', 'Mean Basin Elevation', 'feet'),
+          ('PRECIP', 'Mean Annual Precipitation', 'inches'), ('LC06STOR', 'Percent Storage', 'percent')]
+RETURN_PERIODS = [1.5, 2, 5, 10, 25, 50, 100, 200, 500]
+
+
+def make_point(i, n_vertices=200, keep_raw=False, api_client=None):
+    """
+    Builds a Point from synthetic API payloads shaped like the StreamStats/NSS responses.
+    """
+    x, y = -73.0 + i * 1e-4, 44.0
+    ring = [[x + 0.01 * (k % 7) / 7, y + 0.01 * k / n_vertices] for k in range(n_vertices)] + [[x, y]]
+    pt = Point('VT', x, y, '4326', i, 'UID', api_client=api_client, keep_raw=keep_raw)
+    pt._set_watershed({
+        'workspaceID': f'VT{i}',
+        'featurecollection': [
+            {'name': 'globalwatershedpoint', 'feature': {'type': 'FeatureCollection', 'features': [
+                {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [x, y]},
+                 'properties': {'FID': 0, 'Name': 'pt'}}]}},
+            {'name': 'globalwatershed', 'feature': {'type': 'FeatureCollection', 'features': [
+                {'type': 'Feature', 'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+                 'properties': {'OBJECTID': 1, 'WarningMsg': '', 'HUCID': '02010001', 'Edited': False,
+                                **{code: float(i) for code, _, _ in PARAMS}}}]}}]})
+    pt._set_basin_characteristics({'parameters': [
+        {'ID': k, 'name': name, 'description': name, 'code': code, 'unit': unit, 'value': float(i + k)}
+        for k, (code, name, unit) in enumerate(PARAMS)]})
+    pt._set_flow_statistics([{'regressionRegions': [{'results': [
+        {'id': k, 'name': f'{r} Year Peak Flood', 'code': f'PK{r}', 'value': 10.0 * r * (i + 1),
+         'unit': {'unit': 'cubic feet per second', 'abbr': 'ft^3/s'}, 'equivalentYears': 3.0,
+         'intervalBounds': {'lower': 5.0 * r, 'upper': 20.0 * r}, 'errors': []}
+        for k, r in enumerate(RETURN_PERIODS)]}]}])
+    return pt
+
+
+# The original Point.wshed_gdf/pt_gdf/characteristics_df/statistics_df, which built frames from the raw JSON
+
+def _wshed_gdf(pt):
+    gdf = gpd.GeoDataFrame.from_features(pt.wshed_json['featurecollection'][1]['feature']['features'])
+    gdf[pt.unique_id_label] = pt.id
+    return gdf.set_index(pt.unique_id_label)
+
+
+def _pt_gdf(pt):
+    gdf = gpd.GeoDataFrame.from_features(pt.wshed_json['featurecollection'][0]['feature']['features'])
+    gdf = gdf.drop(columns=['FID'])
+    gdf[pt.unique_id_label] = pt.id
+    return gdf.set_index(pt.unique_id_label)
+
+
+def _characteristics_df(pt):
+    df = pd.json_normalize(pt.basin_char_json['parameters'])
+    df = df.drop(columns=['name', 'ID'])
+    df = df.rename(columns={'description': 'StatName', 'code': 'StatLabel', 'value': 'Value', 'units': 'Units'})
+    df[pt.unique_id_label] = pt.id
+    return df.set_index(pt.unique_id_label)
+
+
+def _statistics_df(pt):
+    df = pd.json_normalize(pt.flow_stats[0]['regressionRegions'][0]['results'])
+    df = df.drop(columns=['id'])
+    rename_dict = {'name': 'StatName', 'code': 'StatLabel', 'value': 'Value', 'units': 'Units',
+                   'equivalentYears': 'Years', 'intervalBounds.lower': 'Pll', 'intervalBounds.upper': 'Plu'}
+    df = df.rename(columns=rename_dict)
+    df = df.drop(columns=[c for c in df.columns if c not in list(rename_dict.values())])
+    df[pt.unique_id_label] = pt.id
+    return df.set_index(pt.unique_id_label)
+
+
+def build_tables_per_point(points):
+    """
+    The original export path: one frame per point and layer, built from the raw JSON responses (so points need
+    keep_raw=True), combined with pd.concat.
+    """
+    keep_fields = set()
+    for i in points:
+        if i.basin_char_json is not None:
+            keep_fields.update([j['code'] for j in i.basin_char_json['parameters']])
+    keep_fields = list(keep_fields)
+    keep_fields.extend(['OBJECTID', 'WarningMsg', 'HUCID', 'Edited', 'geometry'])
+    wshed = gpd.GeoDataFrame(pd.concat([_wshed_gdf(i) for i in points], ignore_index=False))
+    return {
+        'globalwatershed': wshed[keep_fields],
+        'globalwatershedpoint': gpd.GeoDataFrame(pd.concat([_pt_gdf(i) for i in points], ignore_index=False)),
+        'characteristics': pd.concat([_characteristics_df(i) for i in points], ignore_index=False),
+        'statistics': pd.concat([_statistics_df(i) for i in points], ignore_index=False),
+    }
+
+
+def main(sizes):
+    for n in sizes:
+        points = [make_point(i, keep_raw=True) for i in range(n)]
+
+        start = time.perf_counter()
+        build_tables_per_point(points)
+        per_point = time.perf_counter() - start
+
+        start = time.perf_counter()
+        build_tables(points)
+        columnar = time.perf_counter() - start
+
+        print(f'{n:>7} points | per-point {per_point:8.3f}s | columnar {columnar:8.3f}s | '
+              f'speedup {per_point / columnar:5.1f}x')
+
+
+if __name__ == '__main__':
+    main([int(a) for a in sys.argv[1:]] or [1000, 5000])
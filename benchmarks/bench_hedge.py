@@ -0,0 +1,78 @@
+"""
+Hedging benchmark
+
+Runs the same batch against the mock StreamStats server (benchmarks.mock_server) with and without hedged
+requests, with a share of straggler requests that take many times their usual latency, and reports run time,
+the median and tail latency of each stage, the requests the mock served and how many basin characteristics
+requests went to a server that did not own their workspace (answered with 404).
+
+Usage:
+    python -m benchmarks.bench_hedge [n_points] [--concurrency 4] [--straggler-rate 0.03] [--latency-scale 0.2]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+import urllib.request
+import warnings
+import streamstats_access as ssa
+from benchmarks.bench_batch import make_input
+from benchmarks.mock_server import add_arguments, override_config, serve, server_kwargs
+
+CASES = [('no hedging', None), ('hedge at p95', True), ('hedge at p90', {'percentile': 90})]
+STAGES = ['delineation', 'regression_regions', 'scenarios', 'basin_characteristics', 'flow_statistics']
+
+
+def served(base_url):
+    with urllib.request.urlopen(base_url + '/stats') as response:
+        return json.load(response)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('n_points', nargs='?', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=4, help='delineation workers per server')
+    add_arguments(parser)
+    parser.set_defaults(latency_scale=0.2, straggler_rate=0.03)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    warnings.filterwarnings('ignore', message="'crs' was not provided")
+
+    ctx = multiprocessing.get_context('spawn')
+    ready = ctx.Queue()
+    server = ctx.Process(target=serve, args=(0, ready), kwargs=server_kwargs(args), daemon=True)
+    server.start()
+    base_url = ready.get(timeout=60)
+    try:
+        with tempfile.TemporaryDirectory() as tmp, override_config(base_url):
+            in_path = os.path.join(tmp, 'in.gpkg')
+            make_input(in_path, args.n_points)
+            for i, (name, hedge) in enumerate(CASES):
+                metrics = ssa.BatchMetrics()
+                before = served(base_url)
+                start = time.perf_counter()
+                asyncio.run(ssa.process_batch_async(in_path, os.path.join(tmp, f'out{i}.gpkg'), 'VT', 'UID',
+                                                    concurrency=args.concurrency, poll_schedule=(0.5, 1, 2),
+                                                    metrics=metrics, hedge=hedge))
+                elapsed = time.perf_counter() - start
+                after = served(base_url)
+                counts = {k: v - before.get(k, 0) for k, v in after.items()}
+                requests = sum(v for k, v in counts.items() if not k.endswith(('straggler', 'reset')))
+                misrouted = counts.get('basinCharacteristics 404', 0)
+                print(f'{name:<14} | {elapsed:6.1f}s | {requests} requests | {misrouted} misrouted')
+                for stage in STAGES:
+                    h = metrics.histograms.get(('ssa_stage_seconds', (('stage', stage),)))
+                    if h is not None:
+                        print(f'    {stage:<22} p50 {h.quantile(0.5):6.2f}s | p95 {h.quantile(0.95):6.2f}s | '
+                              f'p99 {h.quantile(0.99):6.2f}s')
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
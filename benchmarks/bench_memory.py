@@ -0,0 +1,44 @@
+"""
+Memory benchmark
+
+Measures the memory held per finished Point when raw API responses are kept (keep_raw=True, as every
+Point did before results were extracted into compact rows) and with the default compact representation,
+using the synthetic payloads from bench_export.
+
+Usage:
+    python -m benchmarks.bench_memory [n_points ...]
+"""
+
+import gc
+import sys
+import tracemalloc
+from streamstats_access import USGSEndpoints
+from benchmarks.bench_export import make_point
+
+
+def measure(n, keep_raw, api_client):
+    """
+    Builds n finished points and returns the bytes still allocated for them, and the peak while building.
+    """
+    gc.collect()
+    tracemalloc.start()
+    points = [make_point(i, keep_raw=keep_raw, api_client=api_client) for i in range(n)]
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del points
+    return current, peak
+
+
+def main(sizes):
+    api_client = USGSEndpoints()
+    for n in sizes:
+        raw, raw_peak = measure(n, True, api_client)
+        compact, compact_peak = measure(n, False, api_client)
+        print(f'{n:>7} points | raw {raw / n / 1024:7.1f} KiB/pt (peak {raw_peak / 2 ** 20:7.1f} MiB) | '
+              f'compact {compact / n / 1024:7.1f} KiB/pt (peak {compact_peak / 2 ** 20:7.1f} MiB) | '
+              f'{raw / compact:4.1f}x smaller')
+
+
+if __name__ == '__main__':
+    main([int(a) for a in sys.argv[1:]] or [1000, 10000])
@@ -0,0 +1,70 @@
+"""
+Payload benchmark
+
+Runs the same batch against the mock StreamStats server (benchmarks.mock_server) with each payload mode and reports
+the bytes received and sent per point (request and response bodies), the geometry bytes kept per point until
+export, the output size per point and the run time.
+
+Usage:
+    python -m benchmarks.bench_payload [n_points] [--concurrency 8] [--latency-scale 0]
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+import warnings
+import streamstats_access as ssa
+from benchmarks.bench_batch import make_input
+from benchmarks.mock_server import add_arguments, override_config, serve, server_kwargs
+
+MODES = [('full', None),
+         ('stats_only', {'stats_only': True}),
+         ('no parameters', {'include_parameters': False}),
+         ('precision 4', {'precision': 4}),
+         ('simplify 1e-4', {'simplify': 1e-4}),
+         ('all of the above', {'stats_only': True, 'include_parameters': False, 'precision': 4, 'simplify': 1e-4})]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('n_points', nargs='?', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=8, help='delineation workers per server')
+    add_arguments(parser)
+    parser.set_defaults(latency_scale=0.0)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    warnings.filterwarnings('ignore', message="'crs' was not provided")
+
+    ctx = multiprocessing.get_context('spawn')
+    ready = ctx.Queue()
+    server = ctx.Process(target=serve, args=(0, ready), kwargs=server_kwargs(args), daemon=True)
+    server.start()
+    base_url = ready.get(timeout=60)
+    try:
+        with tempfile.TemporaryDirectory() as tmp, override_config(base_url):
+            in_path = os.path.join(tmp, 'in.gpkg')
+            make_input(in_path, args.n_points)
+            for name, payload in MODES:
+                out_path = os.path.join(tmp, f'{name}.gpkg')
+                metrics = ssa.BatchMetrics()
+                start = time.perf_counter()
+                asyncio.run(ssa.process_batch_async(in_path, out_path, 'VT', 'UID', concurrency=args.concurrency,
+                                                    poll_schedule=(0.5, 1, 2), metrics=metrics, payload=payload))
+                elapsed = time.perf_counter() - start
+                points = metrics.total('ssa_points_total')
+                received, sent, kept = (metrics.total(counter) / points / 1024 for counter in
+                                        ['ssa_response_bytes_total', 'ssa_request_bytes_total',
+                                         'ssa_geometry_bytes_total'])
+                stored = os.path.getsize(out_path) / points / 1024
+                print(f'{name:<18} | received {received:6.1f} KiB | sent {sent:6.1f} KiB | kept {kept:6.1f} KiB | '
+                      f'output {stored:6.1f} KiB | {elapsed:5.1f}s  (per point, {points:.0f} points)')
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
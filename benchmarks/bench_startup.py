@@ -0,0 +1,97 @@
+"""
+Startup benchmark
+
+Measures what a short-lived or request-driven caller pays before and between single-point lookups:
+
+- import time of the package, in fresh interpreters, compared with also loading the batch functions (which load
+  pandas and geopandas, as every import of the package used to);
+- per-lookup time for sequential single-point queries against the mock StreamStats server
+  (benchmarks.mock_server), running each one with asyncio.run on a new client as synchronous callers used to,
+  compared with StreamStatsClient, which reuses one background loop and connection pool.  The mock server is
+  plain HTTP on localhost, so the TLS handshakes saved against the live services are not included.
+
+Usage:
+    python -m benchmarks.bench_startup [--repeat 5] [--lookups 50] [--latency-scale 0.1]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import statistics
+import subprocess
+import sys
+import time
+from streamstats_access import Point, StreamStatsClient, USGSEndpoints
+from streamstats_access.stages import STAGES
+from benchmarks.mock_server import add_arguments, override_config, serve, server_kwargs
+
+HEAVY = ('pandas', 'geopandas', 'pyarrow')
+
+IMPORTS = [('import streamstats_access', 'import streamstats_access'),
+           ('... + process_batch', 'import streamstats_access; streamstats_access.process_batch')]
+
+
+def time_import(statement, repeat):
+    """
+    Times a statement in fresh interpreters and lists the heavy modules it loaded.
+    """
+    script = (f'import sys, time; t = time.perf_counter(); {statement}; print(time.perf_counter() - t); '
+              f'print(",".join(m for m in {HEAVY!r} if m in sys.modules))')
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout
+        seconds, loaded = out.splitlines()
+        times.append(float(seconds))
+    return statistics.median(times), loaded or 'none'
+
+
+def lookups_asyncio_run(coords):
+    async def query(x, y):
+        async with USGSEndpoints() as client:
+            pt = Point('VT', x, y, '4326', api_client=client)
+            for _, run in STAGES:
+                await run(pt)
+            return pt
+
+    return [asyncio.run(query(x, y)) for x, y in coords]
+
+
+def lookups_client(coords):
+    with StreamStatsClient() as client:
+        return [client.query('VT', x, y) for x, y in coords]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreters per import measurement')
+    parser.add_argument('--lookups', type=int, default=50)
+    add_arguments(parser)
+    parser.set_defaults(latency_scale=0.1)
+    args = parser.parse_args(argv)
+
+    for name, statement in IMPORTS:
+        seconds, loaded = time_import(statement, args.repeat)
+        print(f'{name:<28} | {seconds * 1000:7.0f} ms | loads {loaded}')
+
+    if not args.lookups:
+        return
+    ctx = multiprocessing.get_context('spawn')
+    ready = ctx.Queue()
+    server = ctx.Process(target=serve, args=(0, ready), kwargs=server_kwargs(args), daemon=True)
+    server.start()
+    base_url = ready.get(timeout=60)
+    coords = [(-72.5 + i * 1e-3, 44.2) for i in range(args.lookups)]
+    try:
+        with override_config(base_url):
+            for name, run in [('asyncio.run per lookup', lookups_asyncio_run), ('StreamStatsClient', lookups_client)]:
+                start = time.perf_counter()
+                points = run(coords)
+                elapsed = time.perf_counter() - start
+                assert all(pt.statistics is not None for pt in points)
+                print(f'{name:<28} | {1000 * elapsed / len(coords):7.1f} ms per lookup | {len(points)} lookups')
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
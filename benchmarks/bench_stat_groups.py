@@ -0,0 +1,85 @@
+"""
+Statistic groups benchmark
+
+Computes flow statistics for several NSS statistic groups against the mock StreamStats server
+(benchmarks.mock_server), once with a separate run per group, as was needed before stat_groups, and once with every
+group in one run.  Reports run time, the requests the mock served per endpoint and the statistics rows written.
+
+Usage:
+    python -m benchmarks.bench_stat_groups [n_points] [--groups 2 4 5] [--concurrency 8] [--latency-scale 0.1]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+import urllib.request
+import warnings
+import streamstats_access as ssa
+from benchmarks.bench_batch import make_input
+from benchmarks.mock_server import add_arguments, override_config, serve, server_kwargs
+
+ENDPOINTS = ['watershed', 'regressionRegions', 'scenarios', 'basinCharacteristics', 'computeFlowStats']
+
+
+def served(base_url):
+    with urllib.request.urlopen(base_url + '/stats') as response:
+        return json.load(response)
+
+
+def statistics_rows(out_path):
+    con = sqlite3.connect(out_path)
+    try:
+        return con.execute('SELECT count(*) FROM statistics').fetchone()[0]
+    finally:
+        con.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('n_points', nargs='?', type=int, default=300)
+    parser.add_argument('--groups', nargs='+', default=['2', '4', '5'], help='statistic group IDs')
+    parser.add_argument('--concurrency', type=int, default=8, help='delineation workers per server')
+    add_arguments(parser)
+    parser.set_defaults(latency_scale=0.1)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    warnings.filterwarnings('ignore', message="'crs' was not provided")
+
+    ctx = multiprocessing.get_context('spawn')
+    ready = ctx.Queue()
+    server = ctx.Process(target=serve, args=(0, ready), kwargs=server_kwargs(args), daemon=True)
+    server.start()
+    base_url = ready.get(timeout=60)
+    cases = [('a run per group', [[group] for group in args.groups]), ('one run', [args.groups])]
+    try:
+        with tempfile.TemporaryDirectory() as tmp, override_config(base_url):
+            in_path = os.path.join(tmp, 'in.gpkg')
+            make_input(in_path, args.n_points)
+            for name, runs in cases:
+                before = served(base_url)
+                start = time.perf_counter()
+                rows = 0
+                for i, groups in enumerate(runs):
+                    out_path = os.path.join(tmp, f'{name}{i}.gpkg')
+                    asyncio.run(ssa.process_batch_async(in_path, out_path, 'VT', 'UID', concurrency=args.concurrency,
+                                                        poll_schedule=(0.5, 1, 2), stat_groups=groups))
+                    rows += statistics_rows(out_path)
+                elapsed = time.perf_counter() - start
+                after = served(base_url)
+                requests = {endpoint: sum(v - before.get(k, 0) for k, v in after.items()
+                                          if k.split()[0] == endpoint and k.split()[1] == '200')
+                            for endpoint in ENDPOINTS}
+                print(f'{name:<16} | {elapsed:6.1f}s | {rows} statistics rows | ' +
+                      ' | '.join(f'{endpoint} {n}' for endpoint, n in requests.items()))
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""
+Writer benchmark
+
+Writes the same synthetic batch (benchmarks.bench_export.make_point) in flushes through the previous GeoPackage
+path (write_tables below: a GDAL write per geometry layer plus a separate sqlite3 connection for the tables) and
+through each backend in streamstats_access.writers, then reads every output back.  Checks that the bulk
+GeoPackage holds the same layers as the previous path and that its spatial index covers every feature.
+
+Reports write time, read-back time and output size per backend.
+
+Usage:
+    python -m benchmarks.bench_writers [n_points ...] [--flush-size 100] [--vertices 200]
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+import warnings
+import geopandas as gpd
+import pandas as pd
+from streamstats_access.utils import build_tables
+from streamstats_access.writers import LAYERS, GEOMETRY_LAYERS, get_writer
+from benchmarks.bench_export import make_point
+
+
+def _table_columns(con, table):
+    return [r[1] for r in con.execute(f'PRAGMA table_info("{table}")')]
+
+
+def _existing_columns(out_path, table):
+    if not os.path.exists(out_path):
+        return None
+    con = sqlite3.connect(out_path)
+    try:
+        return _table_columns(con, table) or None
+    finally:
+        con.close()
+
+
+def write_tables(out_path, tables, append=False):
+    """
+    Writes output tables to a GeoPackage file, as batch runs did before writers.GeoPackageWriter.
+
+    Args:
+        out_path (str): The path to the output GeoPackage file.
+        tables (dict): Output layer names mapped to (Geo)DataFrames, as returned by build_tables.
+        append (bool, optional): Whether to append to existing layers rather than replace them.  Appended
+            rows are aligned to the columns of the existing layer. Defaults to False.
+
+    Returns:
+        None
+    """
+    for layer in ['globalwatershed', 'globalwatershedpoint']:
+        if layer not in tables:
+            continue
+        gdf = tables[layer]
+        columns = _existing_columns(out_path, layer) if append else None
+        if columns is not None:
+            columns = [c for c in columns if c in gdf.columns]
+            dropped = set(gdf.columns) - set(columns) - {'geometry'}
+            if dropped:
+                logging.warning(f'Dropping fields not in existing {layer} layer: {sorted(dropped)}')
+            gdf[columns + ['geometry']].to_file(out_path, layer=layer, driver='GPKG', mode='a')
+        else:
+            gdf.to_file(out_path, layer=layer, driver='GPKG')
+
+    # Tabular layers are written in a single transaction
+    if 'characteristics' not in tables and 'statistics' not in tables:
+        return
+    con = sqlite3.connect(out_path)
+    try:
+        with con:
+            for table in ['characteristics', 'statistics']:
+                if table not in tables:
+                    continue
+                df = tables[table]
+                columns = _table_columns(con, table) if append else []
+                if columns:
+                    df[[c for c in df.columns if c in columns]].to_sql(table, con, if_exists='append')
+                else:
+                    df.to_sql(table, con, if_exists='replace')
+    finally:
+        con.close()
+
+
+def write_legacy(path, batches):
+    written = set()
+    for batch in batches:
+        tables = build_tables(batch)
+        write_tables(path, {k: v for k, v in tables.items() if k not in written})
+        write_tables(path, {k: v for k, v in tables.items() if k in written}, append=True)
+        written.update(tables)
+
+
+def write_backend(output_format):
+    def write(path, batches):
+        with get_writer(path, output_format) as writer:
+            for batch in batches:
+                writer.write(batch)
+    return write
+
+
+def read_gpkg(path):
+    layers = {layer: gpd.read_file(path, layer=layer) for layer in GEOMETRY_LAYERS}
+    con = sqlite3.connect(path)
+    try:
+        for table in ['characteristics', 'statistics']:
+            layers[table] = pd.read_sql(f'SELECT * FROM "{table}"', con)
+    finally:
+        con.close()
+    return layers
+
+
+def read_parquet(path):
+    layers = {}
+    for layer in LAYERS:
+        target = os.path.join(path, layer)
+        target = target if os.path.isdir(target) else target + '.parquet'
+        layers[layer] = (gpd.read_parquet if layer in GEOMETRY_LAYERS else pd.read_parquet)(target)
+    return layers
+
+
+CASES = [('gpkg (write_tables)', 'out.gpkg', write_legacy, read_gpkg),
+         ('gpkg (bulk)', 'bulk.gpkg', write_backend('gpkg'), read_gpkg),
+         ('parquet', 'parquet', write_backend('parquet'), read_parquet),
+         ('partitioned', 'partitioned', write_backend('partitioned'), read_parquet)]
+
+
+def size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+
+def check(legacy, bulk, path):
+    for layer in LAYERS:
+        if layer in GEOMETRY_LAYERS:
+            # The bulk writer promotes polygons to multipolygons; compare the shapes, then the fields
+            assert legacy[layer].geometry.geom_equals(bulk[layer].geometry).all(), f'{layer}: geometries differ'
+            pd.testing.assert_frame_equal(legacy[layer].drop(columns='geometry'), bulk[layer].drop(columns='geometry'),
+                                          check_dtype=False)
+        else:
+            pd.testing.assert_frame_equal(legacy[layer], bulk[layer], check_dtype=False)
+    con = sqlite3.connect(path)
+    try:
+        for layer in GEOMETRY_LAYERS:
+            indexed = con.execute(f'SELECT count(*) FROM "rtree_{layer}_geom"').fetchone()[0]
+            assert indexed == len(bulk[layer]), f'{layer}: {indexed} of {len(bulk[layer])} features indexed'
+    finally:
+        con.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sizes', nargs='*', type=int, default=[1000, 10000])
+    parser.add_argument('--flush-size', type=int, default=100)
+    parser.add_argument('--vertices', type=int, default=200)
+    args = parser.parse_args(argv)
+    warnings.filterwarnings('ignore', message="'crs' was not provided")
+
+    for n in args.sizes:
+        points = [make_point(i, args.vertices) for i in range(n)]
+        batches = [points[i:i + args.flush_size] for i in range(0, n, args.flush_size)]
+        with tempfile.TemporaryDirectory() as tmp:
+            read = {}
+            for name, target, write, read_back in CASES:
+                path = os.path.join(tmp, target)
+                start = time.perf_counter()
+                write(path, batches)
+                elapsed = time.perf_counter() - start
+                start = time.perf_counter()
+                read[name] = read_back(path)
+                reading = time.perf_counter() - start
+                print(f'{n:>7} points | {name:<20} | write {elapsed:7.2f}s | read {reading:6.2f}s | '
+                      f'{size(path) / 2 ** 20:7.1f} MiB')
+            check(read['gpkg (write_tables)'], read['gpkg (bulk)'], os.path.join(tmp, 'bulk.gpkg'))
+
+
+if __name__ == '__main__':
+    main()
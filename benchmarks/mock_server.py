@@ -0,0 +1,353 @@
+"""
+Mock StreamStats server
+
+A local aiohttp stand-in for the StreamStats (watershed, parameters) and NSS (regressionregions, scenarios,
+estimate) endpoints, so throughput can be measured and tuned without touching the live USGS services.
+
+Responses are built from the payloads in benchmarks/payloads: the watershed is moved to the requested outlet,
+basin characteristics are filtered to the requested codes, and flow statistics are the recorded response for
+the recorded basin characteristics, which every delineation returns.  The bundled payloads are synthetic but
+shaped like the live responses; replace them with recorded responses to benchmark against real geometry sizes.
+
+Each endpoint waits for a latency drawn from its distribution, and a share of requests can be straggler
+requests that wait many times longer, or be answered with 503 or 429 (with Retry-After), or with incomplete basin
+characteristics that only fill in after a few polls.  Basin characteristics for a workspace delineated by one
+server are refused with 404 by the others, as by the live services.
+
+Usage:
+    python -m benchmarks.mock_server [--port 8765] [--error-rate 0.01] [--rate-limit-rate 0.01] ...
+"""
+
+import argparse
+import asyncio
+import contextlib
+import copy
+import itertools
+import json
+import os
+import random
+from aiohttp import web
+from streamstats_access.config import config
+
+PAYLOADS = os.path.join(os.path.dirname(__file__), 'payloads')
+
+# Latency distributions in seconds per endpoint, roughly the shape of the live services
+DEFAULT_LATENCY = {
+    'watershed': ('lognormal', 2.0, 0.6),
+    'basinCharacteristics': ('lognormal', 0.5, 0.5),
+    'regressionRegions': ('lognormal', 0.3, 0.4),
+    'scenarios': ('lognormal', 0.2, 0.3),
+    'computeFlowStats': ('lognormal', 0.2, 0.3),
+}
+
+
+def sample_latency(distribution, scale=1.0):
+    """
+    Draws a latency from a distribution.
+
+    Args:
+        distribution (float, tuple or callable): Seconds, ('uniform', low, high), ('lognormal', median, sigma),
+            ('exponential', mean) or a callable returning seconds.
+        scale (float, optional): Multiplier applied to the draw. Defaults to 1.0.
+
+    Returns:
+        float: Seconds to wait.
+    """
+    if callable(distribution):
+        return scale * distribution()
+    if isinstance(distribution, (int, float)):
+        return scale * distribution
+    kind, *args = distribution
+    if kind == 'uniform':
+        return scale * random.uniform(*args)
+    if kind == 'lognormal':
+        median, sigma = args
+        return scale * median * random.lognormvariate(0, sigma)
+    if kind == 'exponential':
+        return scale * random.expovariate(1 / args[0])
+    raise ValueError(f'Unknown latency distribution: {kind}')
+
+
+def _load(name, payload_dir):
+    with open(os.path.join(payload_dir, name)) as f:
+        return json.load(f)
+
+
+def _translate(coords, dx, dy):
+    if isinstance(coords[0], (int, float)):
+        return [coords[0] + dx, coords[1] + dy]
+    return [_translate(c, dx, dy) for c in coords]
+
+
+class MockStreamStats:
+    """
+    MockStreamStats serves the StreamStats and NSS endpoints from recorded payloads.
+
+    Attributes:
+        latency (dict): Latency distribution per endpoint name (see sample_latency).
+        latency_scale (float): Multiplier applied to every latency.
+        error_rate (float): Share of requests answered with 503.
+        rate_limit_rate (float): Share of requests answered with 429.
+        straggler_rate (float): Share of requests that wait straggler_factor times their latency.
+        straggler_factor (float): Multiplier applied to the latency of stragglers.
+        incomplete_rate (float): Share of workspaces whose basin characteristics are incomplete at first.
+        max_incomplete_polls (int): Most polls a workspace stays incomplete for.
+        stats (dict): Response counts keyed by endpoint name and status.
+        url (str): The base URL once started.
+    """
+
+    def __init__(self, payload_dir=PAYLOADS, latency=None, latency_scale=1.0, error_rate=0.0, rate_limit_rate=0.0,
+                 incomplete_rate=0.0, max_incomplete_polls=2, seed=None, straggler_rate=0.0, straggler_factor=20.0):
+        """
+        Initializes the server.
+
+        Args:
+            payload_dir (str, optional): Directory holding watershed.json, parameters.json, regressionregions.json,
+                scenarios.json and estimate.json. Defaults to benchmarks/payloads.
+            latency (dict, optional): Latency distributions overriding DEFAULT_LATENCY per endpoint. Defaults to None.
+            latency_scale (float, optional): Multiplier applied to every latency. Defaults to 1.0.
+            error_rate (float, optional): Share of requests answered with 503. Defaults to 0.0.
+            rate_limit_rate (float, optional): Share of requests answered with 429. Defaults to 0.0.
+            incomplete_rate (float, optional): Share of workspaces with incomplete basin characteristics at first.
+                Defaults to 0.0.
+            max_incomplete_polls (int, optional): Most polls a workspace stays incomplete for. Defaults to 2.
+            seed (int, optional): Seed for the random draws. Defaults to None.
+            straggler_rate (float, optional): Share of requests that wait straggler_factor times their latency.
+                Defaults to 0.0.
+            straggler_factor (float, optional): Multiplier applied to the latency of stragglers. Defaults to 20.0.
+        """
+        self.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.latency_scale = latency_scale
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.straggler_rate = straggler_rate
+        self.straggler_factor = straggler_factor
+        self.incomplete_rate = incomplete_rate
+        self.max_incomplete_polls = max_incomplete_polls
+        self.stats = {}
+        self.url = None
+        self._runner = None
+        self._workspaces = {}
+        self._owners = {}
+        self._ids = itertools.count()
+        if seed is not None:
+            random.seed(seed)
+
+        self._watershed = _load('watershed.json', payload_dir)
+        self._outlet = self._watershed['featurecollection'][0]['feature']['features'][0]['geometry']['coordinates']
+        self._parameters = _load('parameters.json', payload_dir)['parameters']
+        self._regions = _load('regressionregions.json', payload_dir)
+        self._scenarios = _load('scenarios.json', payload_dir)
+        self._estimate = _load('estimate.json', payload_dir)
+
+    def app(self):
+        """
+        Builds the aiohttp application.
+
+        Returns:
+            aiohttp.web.Application: The application.
+        """
+        app = web.Application(client_max_size=64 * 2 ** 20)
+        app.router.add_get('/{server}/streamstatsservices/watershed.geojson', self._endpoint('watershed', self.watershed))
+        app.router.add_get('/{server}/streamstatsservices/parameters.json',
+                           self._endpoint('basinCharacteristics', self.parameters))
+        app.router.add_post('/nssservices/regressionregions/bylocation',
+                            self._endpoint('regressionRegions', self.regression_regions))
+        app.router.add_get('/nssservices/scenarios', self._endpoint('scenarios', self.scenarios))
+        app.router.add_post('/nssservices/scenarios/estimate', self._endpoint('computeFlowStats', self.estimate))
+        app.router.add_get('/stats', self._stats)
+        return app
+
+    def _count(self, name, status):
+        key = f'{name} {status}'
+        self.stats[key] = self.stats.get(key, 0) + 1
+
+    def _endpoint(self, name, handler):
+        async def endpoint(request):
+            latency = sample_latency(self.latency[name], self.latency_scale)
+            if random.random() < self.straggler_rate:
+                self._count(name, 'straggler')
+                latency *= self.straggler_factor
+            await asyncio.sleep(latency)
+            r = random.random()
+            if r < self.error_rate:
+                self._count(name, 503)
+                return web.Response(status=503)
+            if r < self.error_rate + self.rate_limit_rate:
+                self._count(name, 429)
+                return web.Response(status=429, headers={'Retry-After': '1'})
+            try:
+                response = await handler(request)
+            except ConnectionResetError:
+                # The client gave up on the request, e.g. a hedged request that lost
+                self._count(name, 'reset')
+                return web.Response(status=499)
+            self._count(name, response.status)
+            return response
+        return endpoint
+
+    async def _stats(self, request):
+        return web.json_response(self.stats)
+
+    async def watershed(self, request):
+        x, y = float(request.query['xlocation']), float(request.query['ylocation'])
+        body = copy.deepcopy(self._watershed)
+        workspace_id = f'{request.query.get("rcode", "")}{next(self._ids):012d}'
+        body['workspaceID'] = workspace_id
+        dx, dy = x - self._outlet[0], y - self._outlet[1]
+        for layer in body['featurecollection']:
+            for feature in layer['feature']['features']:
+                feature['geometry']['coordinates'] = _translate(feature['geometry']['coordinates'], dx, dy)
+                feature.pop('bbox', None)
+        if request.query.get('includeparameters') == 'false':
+            # Without includeparameters the service computes no characteristics for the delineation
+            codes = {p['code'] for p in self._parameters}
+            body.pop('parameters', None)
+            for feature in body['featurecollection'][1]['feature']['features']:
+                feature['properties'] = {k: v for k, v in feature['properties'].items() if k not in codes}
+        if random.random() < self.incomplete_rate:
+            self._workspaces[workspace_id] = random.randint(1, self.max_incomplete_polls)
+        server = request.match_info['server']
+        self._owners[workspace_id] = server
+        return web.json_response(body, headers={'USGSWiM-HostName': server.upper()})
+
+    async def parameters(self, request):
+        codes = request.query.get('includeparameters', 'true')
+        workspace_id = request.query.get('workspaceID')
+        if self._owners.get(workspace_id, request.match_info['server']) != request.match_info['server']:
+            return web.Response(status=404, text=f'Workspace {workspace_id} not found')
+        parameters = [p for p in self._parameters if codes == 'true' or p['code'] in codes.split(',')]
+        if self._workspaces.get(workspace_id, 0) > 0:
+            # Still computing: only the first characteristic has a value yet
+            self._workspaces[workspace_id] -= 1
+            parameters = [p if i == 0 else {k: v for k, v in p.items() if k != 'value'} for i, p in enumerate(parameters)]
+        return web.json_response({'workspaceID': workspace_id, 'parameters': parameters})
+
+    async def regression_regions(self, request):
+        await request.read()
+        return web.json_response(self._regions)
+
+    async def scenarios(self, request):
+        scenarios = copy.deepcopy(self._scenarios)
+        scenarios[0]['statisticGroupID'] = int(request.query.get('statisticgroups', scenarios[0]['statisticGroupID']))
+        return web.json_response(scenarios)
+
+    async def estimate(self, request):
+        scenarios = await request.json()
+        # Every delineation has the recorded basin characteristics, so the recorded statistics are its answer
+        payload = copy.deepcopy(self._estimate)
+        payload[0]['statisticGroupID'] = scenarios[0].get('statisticGroupID', payload[0]['statisticGroupID'])
+        return web.json_response(payload)
+
+    async def start(self, host='127.0.0.1', port=0):
+        """
+        Starts serving.
+
+        Args:
+            host (str, optional): Interface to listen on. Defaults to '127.0.0.1'.
+            port (int, optional): Port to listen on; 0 picks a free one. Defaults to 0.
+
+        Returns:
+            str: The base URL.
+        """
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://{host}:{port}'
+        return self.url
+
+    async def close(self):
+        """
+        Stops serving.
+        """
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+@contextlib.contextmanager
+def override_config(base_url):
+    """
+    Points the service URLs in config.json at a mock server while the context is active.
+
+    Args:
+        base_url (str): The mock server's base URL, e.g. 'http://127.0.0.1:8765'.
+    """
+    saved = {section: dict(config[section]) for section in ('StreamStatsServiceURLS', 'NSSServiceURlS')}
+    config['StreamStatsServiceURLS'].update({
+        'watershed': base_url + '/{}/streamstatsservices/watershed.geojson',
+        'basinCharacteristics': base_url + '/{}/streamstatsservices/parameters.json',
+    })
+    config['NSSServiceURlS'].update({
+        'regressionRegions': base_url + '/nssservices/regressionregions/bylocation',
+        'scenarios': base_url + '/nssservices/scenarios',
+        'computeFlowStats': base_url + '/nssservices/scenarios/estimate',
+    })
+    try:
+        yield
+    finally:
+        for section, urls in saved.items():
+            config[section].clear()
+            config[section].update(urls)
+
+
+def serve(port, ready=None, **kwargs):
+    """
+    Runs a MockStreamStats server until the process is terminated, e.g. as a multiprocessing target.
+
+    Args:
+        port (int): Port to listen on; 0 picks a free one.
+        ready (multiprocessing.Queue, optional): Receives the base URL once the server is listening. Defaults to None.
+        **kwargs: Passed to MockStreamStats.
+    """
+    async def run():
+        server = MockStreamStats(**kwargs)
+        url = await server.start(port=port)
+        if ready is not None:
+            ready.put(url)
+        print(f'Serving mock StreamStats on {url}', flush=True)
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+def add_arguments(parser):
+    """
+    Adds the server options to an argparse parser.
+    """
+    parser.add_argument('--latency-scale', type=float, default=1.0, help='multiplier applied to every latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with 503')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='share of requests answered with 429')
+    parser.add_argument('--straggler-rate', type=float, default=0.0,
+                        help='share of requests that take --straggler-factor times longer')
+    parser.add_argument('--straggler-factor', type=float, default=20.0)
+    parser.add_argument('--incomplete-rate', type=float, default=0.0,
+                        help='share of workspaces with incomplete basin characteristics at first')
+    parser.add_argument('--payloads', default=PAYLOADS, help='directory of recorded payloads')
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def server_kwargs(args):
+    """
+    Converts parsed server options to MockStreamStats keyword arguments.
+    """
+    return {'payload_dir': args.payloads, 'latency_scale': args.latency_scale, 'error_rate': args.error_rate,
+            'rate_limit_rate': args.rate_limit_rate, 'incomplete_rate': args.incomplete_rate, 'seed': args.seed,
+            'straggler_rate': args.straggler_rate, 'straggler_factor': args.straggler_factor}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    serve(args.port, **server_kwargs(args))
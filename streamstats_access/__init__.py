@@ -7,15 +7,41 @@ Modules:
     batch_query: Contains functions for processing batch queries.
     endpoints: Contains classes and methods to interact with USGS API endpoints.
     models: Contains data models used in the package.
+    cache: Contains an optional persistent cache of API responses.
+    metrics: Contains the metrics and hooks collected during batch runs.
+    writers: Contains the GeoPackage and GeoParquet output writers.
+    client: Contains a synchronous client for single-point lookups.
 
 Exports:
     process_batch (function): Processes batch queries.
+    process_batch_async (function): Processes batch queries from within a running event loop.
+    iter_batch (function): Yields points from a batch as they finish.
     USGSEndpoints (class): Provides methods to interact with USGS API endpoints.
     Point (class): Represents a geographical point with associated USGS data.
+    ResponseCache (class): SQLite-backed cache of API responses.
+    BatchMetrics (class): Counters, gauges and latency histograms of a batch run.
+    StreamStatsClient (class): Synchronous single-point lookups on a reused background event loop.
+
+The batch functions are imported on first use, so that importing the package does not load pandas and geopandas
+until they are needed.
 """
 
-from .batch_query import process_batch
+import importlib
 from .endpoints import USGSEndpoints
 from .models import Point
+from .cache import ResponseCache
+from .metrics import BatchMetrics
+from .client import StreamStatsClient
+
+_LAZY = {'process_batch': 'batch_query', 'process_batch_async': 'batch_query', 'iter_batch': 'batch_query'}
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        value = getattr(importlib.import_module(f'.{_LAZY[name]}', __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
-__all__ = ['process_batch', 'USGSEndpoints', 'Point']
+__all__ = ['process_batch', 'process_batch_async', 'iter_batch', 'USGSEndpoints', 'Point', 'ResponseCache', 'BatchMetrics',
+           'StreamStatsClient']
@@ -1,25 +1,202 @@
 import aiohttp
+import asyncio
+from aiohttp import hdrs
+import time
+from yarl import URL
+from .config import config
+from .decoding import get_decoder
+from .limiter import AIMDLimiter
 
 class APIClient:
     """
     APIClient is a client for interacting with the USGS Streamstats API.
     Very simple get and post methods for low-level functionality.
 
+    A single aiohttp.ClientSession is created lazily on first use and reused for every
+    request, so connections are kept alive between calls.  Use the client as an async
+    context manager (or call close()) to release the connection pool.  A session belongs to the
+    event loop it was created on, so a client used from a new loop (e.g. a second asyncio.run)
+    discards the old session and creates another.
+
+    When adaptive is enabled, requests to each host pass through an AIMDLimiter that raises or lowers
+    the number of in-flight requests from observed latency and 429/5xx responses.
+
+    Response bodies are decoded with a pluggable decoder (orjson when installed).  Bodies of at least
+    `offload_bytes` are decoded in `executor` so that large watershed GeoJSON does not block the event loop
+    and stall every other in-flight request.  JSON decoders hold the GIL, so only a process pool fully
+    removes the stall; the default thread pool still lets the loop switch between requests while decoding.
+
     Attributes:
-        session (aiohttp.ClientSession): An instance of aiohttp ClientSession.
+        server_name (str): Default USGS server to send StreamStats requests to.
+        session (aiohttp.ClientSession): The shared aiohttp ClientSession.
+        timeout (aiohttp.ClientTimeout): Timeouts applied to every request made through the client.
+        adaptive (bool): Whether per-host adaptive concurrency limiting is enabled.
+        limiters (dict): AIMDLimiter instances keyed by host name.
+        decoder (callable): Decodes a response body (bytes) to JSON.
+        offload_bytes (int): Size in bytes from which bodies are decoded off the event loop.  0 never offloads.
+        executor (concurrent.futures.Executor): Executor used for offloaded decoding, or None for the loop's default.
+        trace_configs (list): aiohttp.TraceConfig instances attached to the session the client creates.
     """
 
-    def __init__(self, server_name='prodweba'):
+    def __init__(self, server_name='prodweba', session=None, adaptive=False, limiter_kwargs=None, timeout=None,
+                 decoder=None, offload_bytes=None, executor=None, trace_configs=None, **connector_kwargs):
         """
         Initializes the APIClient with the name of the server to be queried.
 
         Args:
             server_name (str): Which USGS server to send requests to (prodweba or prodwebb).
+            session (aiohttp.ClientSession, optional): An existing session to share. The client will not close a
+                session it did not create. Defaults to None.
+            adaptive (bool, optional): Whether to limit in-flight requests per host adaptively. Defaults to False.
+            limiter_kwargs (dict, optional): Keyword arguments passed to each AIMDLimiter. Defaults to None.
+            timeout (dict or aiohttp.ClientTimeout, optional): Request timeouts in seconds (total, connect,
+                sock_read). Dict values override the Timeouts section of config.json. Defaults to None.
+            decoder (str or callable, optional): JSON decoder name ('auto', 'orjson', 'json') or a callable taking
+                bytes. Defaults to the Decoding section of config.json.
+            offload_bytes (int, optional): Decode bodies at least this large in a worker thread.  0 always decodes
+                on the event loop. Defaults to the Decoding section of config.json.
+            executor (concurrent.futures.Executor, optional): Executor for offloaded decoding, e.g. a
+                ProcessPoolExecutor. Defaults to None (the event loop's default thread pool).
+            trace_configs (list, optional): aiohttp.TraceConfig instances attached to the session the client creates,
+                e.g. BatchMetrics.trace_config(). Defaults to None.
+            **connector_kwargs: Overrides for the aiohttp.TCPConnector settings in config.json (limit,
+                limit_per_host, ttl_dns_cache, keepalive_timeout).
         """
         self.server_name = server_name
+        self._session = session
+        self._owns_session = session is None
+        self._loop = None
+        self.connector_kwargs = dict(config['ClientSettings'])
+        self.connector_kwargs.update(connector_kwargs)
+        if not isinstance(timeout, aiohttp.ClientTimeout):
+            timeout = aiohttp.ClientTimeout(**{**config['Timeouts'], **(timeout or {})})
+        self.timeout = timeout
+        self.adaptive = adaptive
+        self.limiter_kwargs = limiter_kwargs or {}
+        self.limiters = {}
+        self.decoder = get_decoder(config['Decoding']['decoder'] if decoder is None else decoder)
+        self.offload_bytes = config['Decoding']['offload_bytes'] if offload_bytes is None else offload_bytes
+        self.executor = executor
+        self.trace_configs = list(trace_configs or [])
+
+    @property
+    def session(self):
+        """
+        Returns the shared session, creating it on first access or when the session the client created belongs to
+        another event loop.  Must be called from within a running event loop.
+
+        Returns:
+            aiohttp.ClientSession: The shared session.
+        """
+        loop = asyncio.get_running_loop()
+        if self._owns_session and self._session is not None and self._loop is not loop:
+            self.discard_session()
+        if self._session is None or (self._owns_session and self._session.closed):
+            connector = aiohttp.TCPConnector(**self.connector_kwargs)
+            self._session = aiohttp.ClientSession(connector=connector, trace_configs=self.trace_configs or None)
+            self._owns_session = True
+            self._loop = loop
+        return self._session
 
+    def discard_session(self):
+        """
+        Releases the session the client created without awaiting it, e.g. after the event loop it ran on has been
+        closed.  Its connections are closed on their own loop if that loop is still running, and are dropped
+        otherwise.  The next request creates a new session.
+        """
+        session, loop = self._session, self._loop
+        if not self._owns_session or session is None:
+            return
+        self._session = self._loop = None
+        if session.closed:
+            return
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+            return
+        connector = session.connector
+        session.detach()
+        if connector is not None:
+            # The loop is stopped, so there is nothing to await: the connections' transports went with it
+            connector._close()
 
-    async def get(self, url, params=None, headers=None):
+    async def close(self):
+        """
+        Closes the underlying session if it was created by this client.
+        """
+        if self._owns_session and self._loop is not asyncio.get_running_loop():
+            self.discard_session()
+        if self._owns_session and self._session is not None and not self._session.closed:
+            await self._session.close()
+        if self._owns_session:
+            self._session = self._loop = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _get_limiter(self, url):
+        if not self.adaptive:
+            return None
+        host = URL(url).host
+        if host not in self.limiters:
+            self.limiters[host] = AIMDLimiter(**self.limiter_kwargs)
+        return self.limiters[host]
+
+    async def _request(self, method, url, **kwargs):
+        limiter = self._get_limiter(url)
+        if limiter is None:
+            return await self._send(method, url, **kwargs)
+
+        await limiter.acquire()
+        start = time.monotonic()
+        overloaded = False
+        try:
+            return await self._send(method, url, **kwargs)
+        except aiohttp.ClientResponseError as e:
+            overloaded = e.status == 429 or e.status >= 500
+            raise
+        except asyncio.TimeoutError:
+            overloaded = True
+            raise
+        finally:
+            await limiter.release(time.monotonic() - start, overloaded, URL(url).path)
+
+    async def _send(self, method, url, raw=False, **kwargs):
+        async with self.session.request(method, url, timeout=self.timeout, **kwargs) as response:
+            response.raise_for_status()
+            body = await response.read()
+            if raw:
+                return body, response.headers
+            if 'json' not in response.headers.get(hdrs.CONTENT_TYPE, '').lower():
+                raise aiohttp.ContentTypeError(response.request_info, response.history, status=response.status,
+                                               message=f'Attempt to decode JSON with unexpected mimetype: '
+                                                       f'{response.content_type}', headers=response.headers)
+            return await self.decode(body), response.headers
+
+    async def decode(self, body, parse=None):
+        """
+        Decodes a response body, in the executor if it is at least offload_bytes long.
+
+        Args:
+            body (bytes): The response body.
+            parse (callable, optional): Called as parse(body, decoder) instead of decoding the whole body, so the
+                parts a caller needs can be extracted in the same worker.  Must be picklable when the executor is
+                a process pool. Defaults to None.
+
+        Returns:
+            The decoded JSON (or the result of parse), or None for an empty body.
+        """
+        if not body or body.isspace():
+            return None
+        args = (body,) if parse is None else (body, self.decoder)
+        parse = parse or self.decoder
+        if self.offload_bytes and len(body) >= self.offload_bytes:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, parse, *args)
+        return parse(*args)
+
+    async def get(self, url, params=None, headers=None, raw=False):
         """
         Fetches data from the specified API endpoint with given parameters.
 
@@ -27,6 +204,8 @@ class APIClient:
             url (str): The URL to fetch data from.
             params (dict, optional): The query parameters. Defaults to None.
             headers (dict, optional): The request headers. Defaults to None.
+            raw (bool, optional): Return the undecoded body (bytes), e.g. to decode it later with decode().
+                Defaults to False.
 
         Returns:
             tuple: A tuple containing the JSON response from the API (dict) and response headers (aiohttp.ClientResponse.headers).
@@ -34,13 +213,9 @@ class APIClient:
         Raises:
             aiohttp.ClientError: If the request fails.
         """
-        async with aiohttp.ClientSession() as c:
-            async with c.get(url, params=params, headers=headers) as response:
-                response.raise_for_status()
-                json = await response.json()
-                return json, response.headers
-        
-    async def post(self, url, params=None, json=None):
+        return await self._request('GET', url, params=params, headers=headers, raw=raw)
+
+    async def post(self, url, params=None, json=None, raw=False, data=None):
         """
         Posts data to the specified API endpoint.
 
@@ -48,6 +223,9 @@ class APIClient:
             url (str): The URL to post data to.
             params (dict, optional): The query parameters. Defaults to None.
             json (dict, optional): The JSON payload to send in the request body. Defaults to None.
+            raw (bool, optional): Return the undecoded body (bytes), e.g. to decode it later with decode().
+                Defaults to False.
+            data (str or bytes, optional): An already encoded JSON body, sent instead of json. Defaults to None.
 
         Returns:
             tuple: A tuple containing the JSON response from the API (dict) and response headers (aiohttp.ClientResponse.headers).
@@ -55,8 +233,7 @@ class APIClient:
         Raises:
             aiohttp.ClientError: If the request fails.
         """
-        async with aiohttp.ClientSession() as c:
-            async with c.post(url, params=params, json=json) as response:
-                response.raise_for_status()
-                json = await response.json()
-                return json, response.headers
+        if data is not None:
+            return await self._request('POST', url, params=params, data=data, raw=raw,
+                                       headers={hdrs.CONTENT_TYPE: 'application/json'})
+        return await self._request('POST', url, params=params, json=json, raw=raw)
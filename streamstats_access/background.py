@@ -0,0 +1,161 @@
+"""
+Background Module
+
+This module contains the BackgroundLoop class, which runs an asyncio event loop in a daemon thread so that
+synchronous code can run coroutines without starting a new event loop, and new connections, for every call.
+"""
+
+import asyncio
+import atexit
+import logging
+import threading
+
+
+class BackgroundLoop:
+    """
+    BackgroundLoop runs an event loop in a daemon thread and runs coroutines on it for synchronous callers.
+
+    Clients and sessions created on the loop stay alive between calls, so their keep-alive connections are reused.
+    The loop is started on first use and may be used from any number of threads at once.
+
+    Attributes:
+        name (str): The name of the loop's thread.
+        loop (asyncio.AbstractEventLoop): The running loop, or None before it is started.
+    """
+
+    def __init__(self, name='streamstats-loop'):
+        """
+        Initializes the background loop without starting it.
+
+        Args:
+            name (str, optional): The name of the loop's thread. Defaults to 'streamstats-loop'.
+        """
+        self.name = name
+        self.loop = None
+        self._thread = None
+        self._closers = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts the loop's thread if it is not running.
+
+        Returns:
+            asyncio.AbstractEventLoop: The running loop.
+        """
+        with self._lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self.loop.run_forever, name=self.name, daemon=True)
+                self._thread.start()
+            return self.loop
+
+    def run(self, coro, timeout=None):
+        """
+        Runs a coroutine on the loop and waits for its result.
+
+        Args:
+            coro (coroutine): The coroutine to run.
+            timeout (float, optional): Seconds to wait before cancelling the coroutine. Defaults to None (no limit).
+
+        Returns:
+            The coroutine's result.
+
+        Raises:
+            RuntimeError: If called from the loop's own thread, which would deadlock.
+        """
+        loop = self.start()
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError('BackgroundLoop.run cannot be called from a coroutine running on the same loop')
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            # Timeouts and interrupts cancel the coroutine rather than leaving it running
+            future.cancel()
+            raise
+
+    async def run_async(self, coro):
+        """
+        Awaits a coroutine on the loop from a coroutine running on any loop, including this one.
+
+        Args:
+            coro (coroutine): The coroutine to run.
+
+        Returns:
+            The coroutine's result.
+        """
+        loop = self.start()
+        if asyncio.get_running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    def add_closer(self, close):
+        """
+        Registers a coroutine function to await on the loop when it is stopped, e.g. a client's close method.
+
+        Args:
+            close (callable): Returns the coroutine to await.
+        """
+        with self._lock:
+            self._closers.append(close)
+
+    def remove_closer(self, close):
+        """
+        Unregisters a closer, e.g. once the client it closes has been closed some other way.
+
+        Args:
+            close (callable): A coroutine function passed to add_closer.
+        """
+        with self._lock:
+            if close in self._closers:
+                self._closers.remove(close)
+
+    def stop(self):
+        """
+        Awaits the registered closers, cancels any remaining tasks and stops the loop.  The loop starts again if
+        it is used afterwards.
+        """
+        with self._lock:
+            loop, thread = self.loop, self._thread
+            closers, self._closers = self._closers, []
+            self.loop = self._thread = None
+        if loop is None:
+            return
+
+        async def shutdown():
+            for close in closers:
+                try:
+                    await close()
+                except Exception:
+                    logging.exception('Error closing a client on the background loop')
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await loop.shutdown_asyncgens()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_loop():
+    """
+    Returns the process-wide background loop, creating it on first use.  It is stopped when the interpreter exits.
+
+    Returns:
+        BackgroundLoop: The shared loop.
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = BackgroundLoop()
+            atexit.register(_shared.stop)
+        return _shared
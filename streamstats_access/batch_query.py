@@ -3,152 +3,676 @@ Batch Query Module
 
 This module contains the BatchQueryTool class which provides functionality to process batch 
 queries using the USGS Streamstats API.  This mimics the functionality of the Batch Processor Tool.
+
+Points move through a pipeline of stages (delineation, regression regions, scenarios, basin
+characteristics, flow statistics).  Each stage has its own queue and worker pool, so slow requests
+at one stage do not hold up other points at other stages.
 """
 
 import asyncio
-from .utils import load_datasource, export_data
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from .cache import ResponseCache
+from .config import config
+from .endpoints import USGSEndpoints
+from .estimator import RegressionEstimator
+from .hedging import HedgePolicy
+from .metrics import BatchMetrics
+from .monitor import LoopMonitor
+from .payload import PayloadMode
+from .pool import ServerPool
+from .retry import classify_error, retry_delay
+from .scheduler import PollScheduler
+from .stages import STAGES
+from .utils import iter_points, cluster_points, read_finished_ids, discard_unfinished
+from .writers import get_writer
 import os
 import logging
 
 
-async def point_worker(in_q, out_q, server_name, max_retries=3):
+class _Progress:
+    """
+    Tracks how many points are still in the pipeline and hands finished ones to the output queue.  When
+    max_pending is set, add() waits for room so that input is only read as fast as it is processed.  Loaded,
+    finished and failed IDs (including clustered members) are counted per region, and finished points are
+    reported to the run's metrics.
+    """
+
+    def __init__(self, out_q, max_pending=None, metrics=None):
+        self.out_q = out_q
+        self.metrics = metrics or BatchMetrics()
+        self.remaining = 0
+        self.loaded = False
+        self.done = asyncio.Event()
+        self.regions = {}
+        self._slots = asyncio.Semaphore(max_pending) if max_pending else None
+
+    def _count(self, pt, field):
+        counts = self.regions.setdefault(pt.rcode, {'loaded': 0, 'finished': 0, 'failed': 0})
+        counts[field] += 1 + len(pt.members)
+
+    def report(self):
+        return ' | '.join(f'{region}: {c["finished"]}/{c["loaded"]} finished, {c["failed"]} failed'
+                          for region, c in sorted(self.regions.items()))
+
+    async def add(self, pt, queue):
+        if self._slots is not None:
+            await self._slots.acquire()
+        self.remaining += 1
+        self._count(pt, 'loaded')
+        queue.put_nowait(pt)
+
+    def finish_loading(self):
+        self.loaded = True
+        if self.remaining == 0:
+            self.done.set()
+
+    def finish(self, pt, failed=False):
+        pt.failed = failed
+        if pt.payload is not None and pt.payload.stats_only:
+            # Points that failed before their regression regions were looked up still hold their polygon
+            pt.wshed_features = None
+        self._count(pt, 'failed' if failed else 'finished')
+        self.metrics.point_done(pt, failed)
+        self.out_q.put_nowait(pt)
+        self.remaining -= 1
+        if self._slots is not None:
+            self._slots.release()
+        if self.loaded and self.remaining == 0:
+            self.done.set()
+
+
+async def input_worker(reader, queue, progress, finished=None, cluster_tolerance=None, payload=None,
+                       stat_groups=None):
     """
-    Processes a single point by querying all necessary APIs and logging the result.
-    
+    Feeds points from a chunked reader into the first pipeline stage.  Chunks are read on a worker thread, and
+    each point waits for room in the pipeline, so memory stays bounded on very large inputs.
+
     Args:
-        in_q (asyncio.Queue): The queue containing points to process.
-        out_q (asyncio.Queue): The queue to put processed points in.
-        server_name (str): The name of the server to query.  Essentially, ID for worker.
-        max_retries (int, optional): The maximum number of times to retry a failed request. Defaults to 3.
-    """
-    while not in_q.empty():
-        pt = in_q.get_nowait()
-        logging.info(f'{server_name}: Processing {pt} | Attempt: {pt.attempts}')
-        if pt.attempts > max_retries:
-            logging.info(f'{server_name}: Too many tries ({pt.attempts}) {pt}')
-            out_q.put_nowait(pt)
-            continue
-        pt.set_server_name(server_name)
+        reader (iterator): Yields lists of Point objects, e.g. from iter_datasource.
+        queue (asyncio.Queue): The first stage's queue.
+        progress (_Progress): Tracks points in the pipeline.
+        finished (set, optional): IDs (as strings) to skip because they already have results. Defaults to None.
+        cluster_tolerance (float, optional): Distance in meters within which points in a chunk share one set of
+            requests (see utils.cluster_points). Defaults to None.
+        payload (PayloadMode, optional): Set on every point. Defaults to None (each point's own setting).
+        stat_groups (tuple, optional): Set on every point. Defaults to None (each point's own setting).
+    """
+    loop = asyncio.get_running_loop()
+    n_loaded = n_skipped = n_clustered = 0
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, next, reader, None)
+            if chunk is None:
+                break
+            if finished:
+                n_skipped += len(chunk)
+                chunk = [pt for pt in chunk if str(pt.id) not in finished]
+                n_skipped -= len(chunk)
+            if cluster_tolerance:
+                n_points = len(chunk)
+                chunk = await loop.run_in_executor(None, cluster_points, chunk, cluster_tolerance)
+                n_clustered += n_points - len(chunk)
+            for pt in chunk:
+                if payload is not None:
+                    pt.payload = payload
+                if stat_groups is not None:
+                    pt.stat_groups = stat_groups
+                await progress.add(pt, queue)
+                n_loaded += 1
+            logging.info(f'Loaded {n_loaded} points')
+    finally:
+        if finished is not None:
+            logging.info(f'Resuming: skipped {n_skipped} finished points')
+        if cluster_tolerance:
+            logging.info(f'Clustering: {n_clustered} points share results with a point within {cluster_tolerance} m, '
+                         f'saving up to {n_clustered * len(STAGES)} API calls')
+        progress.finish_loading()
 
-        # Delineate watershed
-        try:
-            logging.debug(f'{server_name}: Delineating {pt}')
-            await pt._delineate_watershed_async()
-            logging.debug(f'{server_name}: Finished delineating {pt}')
-        except Exception as e:
-            logging.debug(f'{server_name}: Failed delineating {pt} | {e}')
-            pt.attempts += 1
-            in_q.put_nowait(pt)
-            continue
 
-        
-        # Get regression regions
-        try:
-            logging.debug(f'{server_name}: Getting regression region {pt}')
-            await pt._get_regression_regions_async()
-            logging.debug(f'{server_name}: Finished regression region {pt}')
-        except Exception as e:
-            logging.debug(f'{server_name}: Failed regression region {pt} | {e}')
-            pt.attempts += 1
-            in_q.put_nowait(pt)
-            continue
-        
-        # Get scenarios
+async def stage_worker(stage, queues, progress, scheduler, pool=None, max_retries=3):
+    """
+    Runs one pipeline stage on points from that stage's queue and passes them on to the next stage.
+
+    Failed points are re-queued at the stage that failed after a jittered backoff based on the kind of
+    error, so earlier (expensive) stages are not repeated.  A client error fetching basin characteristics
+    usually means the workspace is gone, so those points restart from delineation.  Stages that are still
+    waiting on the server (incomplete basin characteristics) hand the point to the scheduler so the worker
+    can move on.
+
+    Each delineation attempt goes to a server chosen by the pool.  Basin characteristics always go to the
+    server that returned the delineation, which holds the workspace.  Both report their outcome to the pool.
+
+    Args:
+        stage (int): Index of the stage in STAGES.
+        queues (list): One asyncio.Queue per stage.
+        progress (_Progress): Collects points that have finished or run out of retries.
+        scheduler (PollScheduler): Holds points whose stage is not finished until they are due to be polled.
+        pool (ServerPool, optional): Chooses delineation servers and tracks server health. Defaults to None.
+        max_retries (int, optional): The maximum number of times to retry a failed point. Defaults to 3.
+    """
+    name, run = STAGES[stage]
+    while True:
+        pt = await queues[stage].get()
+        server = None
+        if pool is not None and name == 'delineation':
+            server = pool.choose()
+            pt.set_server_name(server)
+        elif pool is not None and name == 'basin_characteristics':
+            server = pt.server_name
+        worker_id = f'{name}/{server}' if server else name
+
+        start = time.monotonic()
         try:
-            logging.debug(f'{server_name}: Getting scenarios {pt}')
-            await pt._get_scenarios_async()
-            logging.debug(f'{server_name}: Finished scenarios {pt}')
+            logging.debug(f'{worker_id}: Starting {pt} | Attempt: {pt.attempts}')
+            done = await run(pt) is not False
         except Exception as e:
-            logging.debug(f'{server_name}: Failed scenarios {pt} | {e}')
-            pt.attempts += 1
-            in_q.put_nowait(pt)
+            _record(pool, server, start, e)
+            _observe(progress.metrics, pt, name, start, 'failed')
+            _retry(pt, stage, e, queues, progress, max_retries, worker_id)
             continue
-        
-        # Get basin characteristics
-        logging.debug(f'{server_name}: Getting characteristics {pt}')
-        working = True
-        attempt = 1
-        try:
-            while working:
-                await pt._get_basin_characteristics_async()
-                if not all(['value' in j for j in pt.basin_char_json['parameters']]):
-                    if attempt > 4:
-                        raise RuntimeError
-                    await asyncio.sleep(3 ** attempt)
-                    attempt += 1
-                else:
-                    working = False
-                    logging.debug(f'{server_name}: Finished characteristics {pt}')
-        except Exception as e:
-            logging.debug(f'{server_name}: Failed characteristics {pt} | {e}')
-            pt.attempts += 1
-            in_q.put_nowait(pt)
+        _record(pool, server, start)
+        _observe(progress.metrics, pt, name, start, 'finished' if done else 'deferred')
+        if not done:
+            if scheduler.defer(pt):
+                logging.debug(f'{worker_id}: Deferred {pt} | Poll: {pt.polls}')
+                continue
+            _retry(pt, stage, RuntimeError(f'{name} incomplete after {pt.polls} polls'), queues, progress, max_retries,
+                   worker_id)
             continue
-        
-        # Get flow statistics
+        logging.debug(f'{worker_id}: Finished {pt}')
+        _advance(pt, stage, queues, progress)
+
+
+def _record(pool, server, start, error=None):
+    """
+    Reports the outcome of a request to a pooled server.  Client errors are caused by the request, not the server.
+    """
+    if server is not None:
+        pool.record(server, time.monotonic() - start, error is None or classify_error(error) == 'client_error')
+
+
+def _observe(metrics, pt, name, start, outcome):
+    """
+    Records how long a point spent in a stage.
+    """
+    seconds = time.monotonic() - start
+    metrics.observe('ssa_stage_seconds', seconds, stage=name)
+    metrics.emit('stage', point=pt, stage=name, seconds=seconds, outcome=outcome)
+
+
+def _retry(pt, stage, error, queues, progress, max_retries, worker_id):
+    """
+    Records a failed stage and either gives up on the point or schedules it to retry after a backoff.
+    """
+    name = STAGES[stage][0]
+    error_class = classify_error(error)
+    pt.attempts += 1
+    pt.polls = 0
+    pt.last_error = f'{name}: {error_class}: {error}'
+    logging.debug(f'{worker_id}: Failed {pt} | {pt.last_error}')
+    if pt.attempts > max_retries:
+        logging.info(f'{worker_id}: Too many tries ({pt.attempts}) {pt} | {pt.last_error}')
+        progress.metrics.inc('ssa_failures_total', stage=name, error=error_class)
+        progress.finish(pt, failed=True)
+        return
+    progress.metrics.inc('ssa_retries_total', stage=name, error=error_class)
+    progress.metrics.emit('retry', point=pt, stage=name, error=error_class)
+    pt.stage = stage
+    if name == 'basin_characteristics' and error_class == 'client_error':
+        pt.stage = 0
+    asyncio.get_running_loop().call_later(retry_delay(error, pt.attempts), queues[pt.stage].put_nowait, pt)
+
+
+def _advance(pt, stage, queues, progress):
+    """
+    Passes a point that finished a stage on to the next one.
+    """
+    pt.stage = stage + 1
+    pt.polls = 0
+    if pt.stage < len(STAGES):
+        queues[pt.stage].put_nowait(pt)
+    else:
+        logging.info(f'Finished processing {pt}')
+        progress.finish(pt)
+
+
+async def estimate_worker(queues, progress, estimator, batch_size=500, max_retries=3):
+    """
+    Runs the flow statistics stage for batches of points with a RegressionEstimator, so points sharing a
+    regression region are evaluated together instead of one computeFlowStats request each.
+
+    Args:
+        queues (list): One asyncio.Queue per stage.
+        progress (_Progress): Collects points that have finished or run out of retries.
+        estimator (RegressionEstimator): The local estimator.
+        batch_size (int, optional): The most points taken from the queue at once. Defaults to 500.
+        max_retries (int, optional): The maximum number of times to retry a failed point. Defaults to 3.
+    """
+    stage = [name for name, _ in STAGES].index('flow_statistics')
+    while True:
+        points = [await queues[stage].get()]
+        while not queues[stage].empty() and len(points) < batch_size:
+            points.append(queues[stage].get_nowait())
+        logging.debug(f'local_estimate: Estimating {len(points)} points')
+        start = time.monotonic()
         try:
-            logging.debug(f'{server_name}: Getting flowstats {pt}')
-            await pt._get_flow_statistics_async()
-            logging.debug(f'{server_name}: Finished flowstats {pt}')
+            errors = await estimator.estimate(points)
         except Exception as e:
-            logging.debug(f'{server_name}: Failed flowstats {pt} | {e}')
-            pt.attempts += 1
-            in_q.put_nowait(pt)
-            continue
+            # Every point of the batch is retried rather than the worker dying with them
+            errors = [e] * len(points)
+        for pt, error in zip(points, errors):
+            _observe(progress.metrics, pt, 'flow_statistics', start, 'finished' if error is None else 'failed')
+            if error is None:
+                _advance(pt, stage, queues, progress)
+            else:
+                _retry(pt, stage, error, queues, progress, max_retries, 'local_estimate')
+
 
-        logging.info(f'{server_name}: Finished processing {pt}')
-        out_q.put_nowait(pt)
-        logging.debug(f'{server_name}: Finished putting in out queue {pt}')
-        
+def _sample(metrics, queues, scheduler, progress, monitor):
+    """
+    Updates the run's gauges (queue depths, throughput, ETA) and logs a progress line.  Until all input is loaded the
+    ETA only covers points loaded so far.
+    """
+    for (name, _), queue in zip(STAGES, queues):
+        metrics.set('ssa_queue_depth', queue.qsize(), stage=name)
+    metrics.set('ssa_polls_pending', scheduler.pending)
+    metrics.set('ssa_points_in_pipeline', progress.remaining)
+    metrics.set('ssa_input_loaded', int(progress.loaded))
+    metrics.set('ssa_loop_stalled_seconds', monitor.stats['total'])
+    loaded = sum(c['loaded'] for c in progress.regions.values())
+    done = sum(c['finished'] + c['failed'] for c in progress.regions.values())
+    rate = metrics.points_per_minute()
+    eta = metrics.eta(loaded - done)
+    metrics.set('ssa_points_per_minute', rate)
+    metrics.set('ssa_eta_seconds', eta)
+    eta = 'unknown' if eta is None else f'{eta / 60:.1f} min' + ('' if progress.loaded else ' (still loading)')
+    logging.info(f'Progress: {done}/{loaded} points done | {rate:.1f} points/min | ETA {eta}')
 
 
-                             
-async def _process_batch_async(in_path, out_path, rcode, unique_field, parallel=True):
+def _latency_summary(metrics):
     """
-    Processes the batch query by querying the API for each point in the input file and saving 
-    the results.
+    Describes the median and 95th percentile latency of each stage and endpoint.
+    """
+    lines = []
+    for (name, labels), h in sorted(metrics.histograms.items()):
+        if name in ('ssa_stage_seconds', 'ssa_request_seconds'):
+            label = ' '.join(v for _, v in labels)
+            lines.append(f'{"Stage" if name == "ssa_stage_seconds" else "Requests"} {label}: {h.count} | '
+                         f'p50 {h.quantile(0.5):.2f}s | p95 {h.quantile(0.95):.2f}s')
+    return lines
+
+
+def _payload_summary(metrics):
+    """
+    Describes the bytes transferred per endpoint and, per point, transferred and kept as geometry.
+    """
+    points = metrics.total('ssa_points_total')
+    if not points:
+        return []
+    lines = []
+    for name, direction in [('ssa_response_bytes_total', 'received'), ('ssa_request_bytes_total', 'sent')]:
+        by_endpoint = {dict(labels)['endpoint']: v for (n, labels), v in sorted(metrics.counters.items()) if n == name}
+        if by_endpoint:
+            lines.append(f'Bytes {direction}: ' + ' | '.join(f'{endpoint} {v / 2 ** 20:.1f} MiB'
+                                                             for endpoint, v in by_endpoint.items()))
+    lines.append('Payload per point: {:.1f} KiB received | {:.1f} KiB sent | {:.1f} KiB geometry kept'.format(
+        *(metrics.total(name) / points / 1024 for name in
+          ['ssa_response_bytes_total', 'ssa_request_bytes_total', 'ssa_geometry_bytes_total'])))
+    return lines
+
+
+async def output_worker(out_q, writer, flush_size=100, executor=None, max_inflight=2):
+    """
+    Writes processed points to the output in batches as they arrive, so finished work survives a crash and memory
+    stays flat.  Stops when it receives None.
+
+    Each batch is converted to output rows (writer.prepare) in executor while requests carry on, and written
+    (writer.write_prepared) in order in a thread of its own, so neither step blocks the event loop.  At most
+    max_inflight batches are converted at once; the oldest is written before another is started, which bounds the
+    finished points held in memory.
 
     Args:
-        in_path (str): filepath to load points from
-        out_path (str): filepath to save results to
-        rcode (str): the region code to use
-        unique_field (str): the field in the input geospatial file that contains unique identifiers for each point
-        parallel (bool, optional): whether to asynchronously query prodweba and prodwebb. Defaults to True.
+        out_q (asyncio.Queue): The queue of processed points.
+        writer (writers.Writer): The output writer (see writers.get_writer).
+        flush_size (int, optional): the number of points written per transaction. Defaults to 100.
+        executor (concurrent.futures.Executor, optional): Executor converting batches, e.g. a ProcessPoolExecutor,
+            which is sent each point's results() rather than the point. Defaults to None (the event loop's default
+            thread pool).
+        max_inflight (int, optional): the most batches converted at once. Defaults to 2.
     """
-    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s", handlers=[logging.FileHandler(os.path.join(os.path.dirname(in_path), 'ssa.log')), logging.StreamHandler()])
-    logging.info('Initiating batch query')
-    input_data = load_datasource(in_path, rcode, unique_field)
+    loop = asyncio.get_running_loop()
+    write_executor = ThreadPoolExecutor(1, thread_name_prefix='ssa-writer')
+    inflight = deque()
+    buffer = []
+    n_written = 0
+    regions = {}
+
+    async def write_oldest():
+        nonlocal n_written
+        n_points, prepared = inflight.popleft()
+        await loop.run_in_executor(write_executor, writer.write_prepared, await prepared)
+        n_written += n_points
+        logging.info(f'Wrote {n_written} points to {writer.out_path}')
+        if len(regions) > 1:
+            logging.info('Written by region: ' + ' | '.join(
+                f'{region}: {c["finished"]} finished, {c["failed"]} failed' for region, c in sorted(regions.items())))
+
+    try:
+        while True:
+            pt = await out_q.get()
+            if pt is not None:
+                buffer.append(pt)
+                counts = regions.setdefault(pt.rcode, {'finished': 0, 'failed': 0})
+                counts['failed' if pt.failed else 'finished'] += 1 + len(pt.members)
+            if buffer and (pt is None or len(buffer) >= flush_size):
+                if isinstance(executor, ProcessPoolExecutor):
+                    # Only what the output is built from is sent to the worker processes, not whole points
+                    buffer = [p.results() for p in buffer]
+                inflight.append((len(buffer), loop.run_in_executor(executor, writer.prepare, buffer)))
+                buffer = []
+            # Write converted batches in order, waiting for the oldest when too many are in flight
+            while inflight and (inflight[0][1].done() or len(inflight) > max_inflight or pt is None):
+                await write_oldest()
+            if pt is None:
+                break
+    finally:
+        for _, prepared in inflight:
+            prepared.cancel()
+        write_executor.shutdown()
+
+
+async def iter_batch(points, rcode=None, unique_field=None, client=None, parallel=True, concurrency=1, adaptive=False,
+                     cache=None, stage_concurrency=None, timeout=None, poll_schedule=(3, 9, 27, 81),
+                     local_estimates=False, verify_fraction=0.0, chunk_size=None, bbox=None, max_pending=None,
+                     decode_workers=0, cluster_tolerance=None, region_field='rcode', servers=None, hooks=None,
+                     metrics=None, metrics_path=None, metrics_interval=30, skip_ids=None, payload=None,
+                     hedge=None, stat_groups=None):
+    """
+    Runs points through the pipeline and yields each one as soon as it has finished or run out of retries.
+
+    Points are yielded in the order they finish.  Failed points have `failed` set and `last_error` describes the
+    last failure.  Clustered points are yielded once, with the IDs sharing their results in `members`.  Nothing is
+    written to disk, and logging is left to the caller's configuration.  Closing the generator cancels the points
+    still in flight; use contextlib.aclosing to do so as soon as a loop over it is left early.
+
+    Args:
+        points (str, geopandas.GeoDataFrame or iterable): a geospatial file path, a GeoDataFrame of points, or Point
+            objects (see utils.iter_points).
+        rcode (str or geopandas.GeoDataFrame, optional): the region code to use, the name of an input field holding
+            each point's region code, or a region polygon layer (GeoDataFrame or file path) that points are spatially
+            joined to.  Required unless points are Point objects.
+        unique_field (str, optional): the field that contains unique identifiers for each point.  Required unless
+            points are Point objects.
+        client (USGSEndpoints or aiohttp.ClientSession, optional): an existing client, or a session to build one on.
+            A client passed in is used as is and left open, so adaptive, cache, timeout, decode_workers and hedge
+            only apply to clients created here.  Pass trace_configs=[metrics.trace_config()] when creating it to record
+            request metrics. Defaults to None.
+        parallel (bool, optional): whether to spread delineations over every server in the pool, rather than only
+            the first. Defaults to True.
+        concurrency (int, optional): number of delineation workers to run per server.  Later stages default to
+            this many workers per server in total. Defaults to 1.
+        adaptive (bool, optional): whether to adapt in-flight requests per host to observed latency and 429/5xx
+            responses, up to the total number of workers. Defaults to False.
+        cache (str or ResponseCache, optional): path to a SQLite response cache (or an open ResponseCache) used to
+            skip requests already answered by a previous run. Defaults to None.
+        stage_concurrency (dict, optional): number of workers per stage name in STAGES, overriding the defaults
+            above.  The delineation count is per server. Defaults to None.
+        timeout (dict, optional): request timeouts in seconds (total, connect, sock_read), overriding the
+            Timeouts section of config.json. Defaults to None.
+        poll_schedule (iterable, optional): seconds to wait before each re-poll of incomplete basin characteristics.
+            A point still incomplete after the last poll counts as a failed attempt. Defaults to (3, 9, 27, 81).
+        local_estimates (bool, optional): whether to evaluate regression equations locally, in batches per regression
+            region, instead of requesting flow statistics for every point. Defaults to False.
+        verify_fraction (float, optional): share of locally estimated points also estimated remotely; mismatches are
+            logged and the remote result kept. Defaults to 0.0.
+        chunk_size (int, optional): number of input points read at a time.  None reads all input up front.
+            Defaults to None.
+        bbox (tuple, optional): only process input features intersecting (minx, miny, maxx, maxy), in the CRS of the
+            input. Defaults to None.
+        max_pending (int, optional): most points in the pipeline at once; reading pauses until earlier points
+            finish.  None is unbounded. Defaults to None.
+        decode_workers (int, optional): number of worker processes decoding large watershed responses, so that
+            parsing them never blocks the event loop.  0 decodes them in a thread. Defaults to 0.
+        cluster_tolerance (float, optional): distance in meters within which input points are treated as the same
+            outlet.  Only the first point of each cluster is queried.  Clusters are formed within each input chunk.
+            None disables clustering. Defaults to None.
+        region_field (str, optional): the field of the region polygon layer holding region codes. Defaults to 'rcode'.
+        servers (list, optional): StreamStats servers to route delineations to, weighted by their observed latency
+            and error rate.  Failing servers are ejected and probed before being used again. Defaults to the
+            ServerPool servers in config.json.
+        hooks (list, optional): callables taking (event, data), called on stage, retry, point, request and snapshot
+            events (see metrics.BatchMetrics). Defaults to None.
+        metrics (BatchMetrics, optional): collects the run's metrics, e.g. to read them afterwards. Defaults to None.
+        metrics_path (str, optional): file that a metrics snapshot (stage and request latency histograms, request,
+            retry and failure counters, queue depths, points per minute and ETA) is written to every
+            metrics_interval seconds; JSON if it ends in .json, otherwise Prometheus text. Defaults to None.
+        metrics_interval (float, optional): seconds between metrics snapshots and progress log lines. Defaults to 30.
+        skip_ids (set, optional): IDs (as strings) of input points not to process. Defaults to None.
+        payload (PayloadMode or dict, optional): trims what is requested, kept and exported per point: stats_only,
+            precision, simplify and include_parameters (see payload.PayloadMode).  Bytes transferred and geometry
+            bytes kept per point are logged at the end of the run. Defaults to None (everything).
+        hedge (bool, dict or HedgePolicy, optional): send a second copy of requests that outlast their endpoint's
+            usual latency (the 95th percentile by default), to the other server for delineations, and use
+            whichever answers first.  Hedges are capped at a share of all requests.  True uses the Hedging section
+            of config.json; a dict overrides it (see hedging.HedgePolicy). Defaults to None (no hedging).
+        stat_groups (list, optional): IDs of the NSS statistic groups to compute for every point, e.g. [2, 4] for
+            peak and low flows.  Each point is delineated once, fetches basin characteristics once for the
+            parameters of every group, and gets a scenario and flow statistics request per group.  Defaults to
+            None (each point's own groups, peak flows for points read from a file).
+
+    Yields:
+        Point: Each point once it has finished or failed.
+    """
+    servers = servers or config['ServerPool']['servers']
+    if not parallel:
+        servers = servers[:1]
+    pool = ServerPool(servers)
+    n_workers = {name: concurrency * len(servers) for name, _ in STAGES}
+    n_workers.update(stage_concurrency or {})
+    if stage_concurrency and 'delineation' in stage_concurrency:
+        n_workers['delineation'] *= len(servers)
+    total_workers = sum(n_workers.values())
+
+    if metrics is None:
+        metrics = BatchMetrics(hooks)
+    elif hooks:
+        metrics.hooks.extend(hooks)
+
+    owns_client = not isinstance(client, USGSEndpoints)
+    owns_cache = owns_client and isinstance(cache, str)
+    executor = None
+    if owns_client:
+        if owns_cache:
+            cache = ResponseCache(cache)
+        executor = ProcessPoolExecutor(decode_workers) if decode_workers else None
+        limit_per_host = max(config['ClientSettings']['limit_per_host'], total_workers)
+        limiter_kwargs = {'max_limit': total_workers, 'initial_limit': min(len(servers) * 2, total_workers)}
+        hedge = HedgePolicy.from_options(hedge, servers=servers, pool=pool)
+        client = USGSEndpoints(session=client, cache=cache, coalesce=True, adaptive=adaptive, hedge=hedge,
+                               limiter_kwargs=limiter_kwargs, timeout=timeout, executor=executor,
+                               trace_configs=[metrics.trace_config()], limit_per_host=limit_per_host)
+
     tasks = []
-    q = asyncio.Queue()
-    out_q = asyncio.Queue()
+    loader = None
+    try:
+        reader = iter_points(points, rcode, unique_field, client, chunk_size, bbox, region_field)
+        queues = [asyncio.Queue() for _ in STAGES]
+        out_q = asyncio.Queue()
+        progress = _Progress(out_q, max_pending, metrics)
+        estimator = RegressionEstimator(verify_fraction) if local_estimates else None
+        scheduler = PollScheduler(queues[[name for name, _ in STAGES].index('basin_characteristics')], poll_schedule)
+        tasks.append(asyncio.create_task(scheduler.run()))
+        monitor = LoopMonitor()
+        tasks.append(asyncio.create_task(monitor.run()))
+
+        def sample():
+            _sample(metrics, queues, scheduler, progress, monitor)
+        tasks.append(asyncio.create_task(metrics.report(sample, metrics_path, metrics_interval)))
+
+        if stat_groups is not None:
+            stat_groups = tuple(str(g) for g in stat_groups)
+        loader = asyncio.create_task(input_worker(reader, queues[0], progress, skip_ids, cluster_tolerance,
+                                                  PayloadMode.from_options(payload), stat_groups))
+
+        for stage, (name, _) in enumerate(STAGES):
+            if name == 'flow_statistics' and estimator is not None:
+                tasks.append(asyncio.create_task(estimate_worker(queues, progress, estimator)))
+            else:
+                tasks.extend(asyncio.create_task(stage_worker(stage, queues, progress, scheduler, pool))
+                             for _ in range(n_workers[name]))
+
+        async def close_when_done():
+            await progress.done.wait()
+            out_q.put_nowait(None)
+        tasks.append(asyncio.create_task(close_when_done()))
+
+        while (pt := await out_q.get()) is not None:
+            yield pt
+
+        # Surface any error reading the input once the points already loaded have been yielded
+        loader.result()
+        logging.info(f'Points by region: {progress.report()}')
+        metrics.publish(sample, metrics_path)
+        for line in _latency_summary(metrics) + _payload_summary(metrics):
+            logging.info(line)
+        for line in pool.summary():
+            logging.info(line)
+        if client.hedge is not None:
+            for line in client.hedge.summary():
+                logging.info(f'Hedging {line}')
+        for host, limiter in client.limiters.items():
+            logging.info(f'{host}: final concurrency limit {limiter.limit} | smoothed latency {limiter.latency:.2f}s')
+        if client.single_flight is not None:
+            logging.info('Shared NSS lookups: {hits} memoized | {coalesced} coalesced | {misses} sent'.format(
+                **client.single_flight.stats))
+        logging.info('Event loop stalls: {stalls} over {threshold:.0f} ms | {total:.2f}s total | longest {max:.3f}s'.format(
+            threshold=monitor.threshold * 1000, **monitor.stats))
+        if estimator is not None:
+            logging.info('Flow statistics: {local} local | {remote} remote | {verified} verified | {mismatched} '
+                         'mismatched'.format(**estimator.stats))
+        if client.cache is not None:
+            for endpoint, stats in client.cache.stats.items():
+                logging.info(f'Cache {endpoint}: {stats["hits"]} hits | {stats["misses"]} misses')
+    finally:
+        if loader is not None and not loader.done():
+            tasks.append(loader)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if owns_client:
+            await client.close()
+            if executor is not None:
+                executor.shutdown()
+            if owns_cache:
+                cache.close()
 
-    for item in input_data:
-        q.put_nowait(item)
-    
-    if parallel:
-        servers = ['prodweba', 'prodwebb']
-    else:
-        servers = ['prodweba']
 
-    for s in servers:
-        task = asyncio.create_task(point_worker(q, out_q, s))
-        tasks.append(task)
+async def process_batch_async(in_path, out_path, rcode, unique_field, parallel=True, concurrency=1, adaptive=False,
+                              cache=None, flush_size=100, resume=False, stage_concurrency=None, timeout=None,
+                              poll_schedule=(3, 9, 27, 81), local_estimates=False, verify_fraction=0.0,
+                              chunk_size=None, bbox=None, max_pending=None, decode_workers=0,
+                              cluster_tolerance=None, region_field='rcode', servers=None, hooks=None,
+                              metrics_path=None, metrics_interval=30, client=None, metrics=None,
+                              output_format='gpkg', payload=None, convert_workers=0, hedge=None,
+                              stat_groups=None):
+    """
+    Processes the batch query by querying the API for each point in the input and saving the results, from within
+    a running event loop.  Logging is left to the caller's configuration.
+
+    Points are run through iter_batch, and every option not listed here is passed on to it; see iter_batch for
+    their descriptions.  The results of clustered points are written for every member of the cluster, and the
+    statistics table has a StatGroup column holding the statistic group of each row.
 
-    await asyncio.gather(*tasks)
+    Args:
+        in_path (str, geopandas.GeoDataFrame or iterable): filepath to load points from, or a GeoDataFrame of points,
+            or Point objects
+        out_path (str): filepath to save results to
+        rcode (str or geopandas.GeoDataFrame): the region code to use, the name of an input field holding each
+            point's region code, or a region polygon layer (GeoDataFrame or file path) that points are spatially
+            joined to.  Points from every region are processed in the same run and written to one output.
+        unique_field (str): the field in the input geospatial file that contains unique identifiers for each point
+        flush_size (int, optional): number of finished points written to out_path per transaction. Defaults to 100.
+        resume (bool, optional): whether to skip points that already have results in out_path and append to it.
+            Defaults to False.
+        output_format (str, optional): 'gpkg' writes a GeoPackage; 'parquet' writes a GeoParquet file per layer and
+            'partitioned' GeoParquet files partitioned by layer and region, both into the out_path directory.
+            Resuming is only supported for GeoPackage output. Defaults to 'gpkg'.
+        convert_workers (int or concurrent.futures.Executor, optional): number of worker processes converting
+            finished points to output rows while requests continue, or an executor to convert them in.  0 converts
+            them in a thread, which is faster unless spare cores are available and watersheds are large enough
+            for conversion to outweigh sending each batch to a worker. Defaults to 0.
+        **iter_batch options: parallel, concurrency, adaptive, cache, stage_concurrency, timeout, poll_schedule,
+            local_estimates, verify_fraction, chunk_size, bbox, max_pending, decode_workers, cluster_tolerance,
+            region_field, servers, hooks, metrics_path, metrics_interval, client, metrics, payload, hedge and
+            stat_groups (see iter_batch).
+    """
+    logging.info('Initiating batch query')
+    output = get_writer(out_path, output_format, resume)
+    finished = None
+    if resume:
+        finished = read_finished_ids(out_path, unique_field, stat_groups)
+        discard_unfinished(out_path, unique_field, finished)
+    owns_executor = not isinstance(convert_workers, Executor)
+    if owns_executor:
+        executor = ProcessPoolExecutor(convert_workers) if convert_workers else None
+    else:
+        executor = convert_workers
+    out_q = asyncio.Queue()
+    writer = asyncio.create_task(output_worker(out_q, output, flush_size, executor))
+    try:
+        async for pt in iter_batch(in_path, rcode, unique_field, client=client, parallel=parallel,
+                                   concurrency=concurrency, adaptive=adaptive, cache=cache,
+                                   stage_concurrency=stage_concurrency, timeout=timeout, poll_schedule=poll_schedule,
+                                   local_estimates=local_estimates, verify_fraction=verify_fraction,
+                                   chunk_size=chunk_size, bbox=bbox, max_pending=max_pending,
+                                   decode_workers=decode_workers, cluster_tolerance=cluster_tolerance,
+                                   region_field=region_field, servers=servers, hooks=hooks, metrics=metrics,
+                                   metrics_path=metrics_path, metrics_interval=metrics_interval, skip_ids=finished,
+                                   payload=payload, hedge=hedge, stat_groups=stat_groups):
+            if writer.done():
+                # Stop processing if the output can no longer be written
+                writer.result()
+            out_q.put_nowait(pt)
+    finally:
+        out_q.put_nowait(None)
+        try:
+            await writer
+        finally:
+            output.close()
+            if owns_executor and executor is not None:
+                executor.shutdown()
     logging.info('Finished processing batch queries')
-    export_data(out_path, out_q)
 
 
-def process_batch(in_path, out_path, rcode, unique_field, parallel=True):
+def process_batch(in_path, out_path, rcode, unique_field, parallel=True, concurrency=1, adaptive=False, cache=None,
+                  flush_size=100, resume=False, stage_concurrency=None, timeout=None,
+                  poll_schedule=(3, 9, 27, 81), local_estimates=False, verify_fraction=0.0,
+                  chunk_size=None, bbox=None, max_pending=None, decode_workers=0, cluster_tolerance=None,
+                  region_field='rcode', servers=None, hooks=None, metrics_path=None, metrics_interval=30,
+                  output_format='gpkg', payload=None, convert_workers=0, hedge=None, stat_groups=None):
     """
-    User entrypoint to the batch processor tool.
+    User entrypoint to the batch processor tool.  Logs to the console and to ssa.log next to the input file, and
+    runs process_batch_async in a new event loop.  Takes the same arguments as process_batch_async, apart from client
+    and metrics; see process_batch_async and iter_batch for their descriptions.
 
     Args:
         in_path (str): filepath to load points from
         out_path (str): filepath to save results to
-        rcode (str): the region code to use
+        rcode (str or geopandas.GeoDataFrame): the region code to use, the name of an input field holding each
+            point's region code, or a region polygon layer (GeoDataFrame or file path) that points are spatially
+            joined to.
         unique_field (str): the field in the input geospatial file that contains unique identifiers for each point
-        parallel (bool, optional): whether to asynchronously query prodweba and prodwebb. Defaults to True.
     """
-    asyncio.run(_process_batch_async(in_path, out_path, rcode, unique_field, parallel))
-
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s", handlers=[logging.FileHandler(os.path.join(os.path.dirname(in_path), 'ssa.log')), logging.StreamHandler()])
+    asyncio.run(process_batch_async(in_path, out_path, rcode, unique_field, parallel=parallel, concurrency=concurrency,
+                                    adaptive=adaptive, cache=cache, flush_size=flush_size, resume=resume,
+                                    stage_concurrency=stage_concurrency, timeout=timeout, poll_schedule=poll_schedule,
+                                    local_estimates=local_estimates, verify_fraction=verify_fraction,
+                                    chunk_size=chunk_size, bbox=bbox, max_pending=max_pending,
+                                    decode_workers=decode_workers, cluster_tolerance=cluster_tolerance,
+                                    region_field=region_field, servers=servers, hooks=hooks,
+                                    metrics_path=metrics_path, metrics_interval=metrics_interval,
+                                    output_format=output_format, payload=payload, convert_workers=convert_workers,
+                                    hedge=hedge, stat_groups=stat_groups))
@@ -0,0 +1,176 @@
+"""
+Cache Module
+
+This module contains the ResponseCache class, an opt-in SQLite-backed store of API responses so that
+repeat runs and overlapping batches do not re-query the USGS services.
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+from multidict import CIMultiDict
+from .decoding import get_decoder
+
+
+class ResponseCache:
+    """
+    ResponseCache persists JSON responses in a SQLite database keyed on the endpoint and its normalized
+    request parameters.  Entries expire after `ttl` seconds and the least recently used entries are
+    evicted once the cache grows beyond `max_entries` or `max_bytes`.
+
+    Attributes:
+        path (str): The path to the SQLite database.
+        ttl (float): Seconds an entry stays valid.  None disables expiry.
+        max_entries (int): The maximum number of stored responses.
+        max_bytes (int): The maximum total size of stored responses in bytes.
+        stats (dict): Hit and miss counters keyed by endpoint name.
+    """
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=250000, max_bytes=2 * 1024 ** 3):
+        """
+        Opens (or creates) the cache database.
+
+        Args:
+            path (str): The path to the SQLite database.
+            ttl (float, optional): Seconds an entry stays valid. Defaults to one week.
+            max_entries (int, optional): The maximum number of stored responses. Defaults to 250,000.
+            max_bytes (int, optional): The maximum total size of stored responses. Defaults to 2 GiB.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stats = {}
+        self._loads = get_decoder()
+        # Synchronous clients use the cache from their background loop's thread
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        self.con.execute('PRAGMA journal_mode=WAL')
+        self.con.execute('PRAGMA synchronous=NORMAL')
+        self.con.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, endpoint TEXT, created REAL, '
+                         'accessed REAL, size INTEGER, body BLOB, headers TEXT)')
+        self.con.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self.con.commit()
+        self._entries, self._bytes = self.con.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+
+    @property
+    def hits(self):
+        """
+        Returns the total number of cache hits.
+
+        Returns:
+            int: Hits across all endpoints.
+        """
+        return sum(s['hits'] for s in self.stats.values())
+
+    @property
+    def misses(self):
+        """
+        Returns the total number of cache misses.
+
+        Returns:
+            int: Misses across all endpoints.
+        """
+        return sum(s['misses'] for s in self.stats.values())
+
+    @staticmethod
+    def make_key(endpoint, params):
+        """
+        Builds a cache key from an endpoint name and its request parameters.
+
+        Args:
+            endpoint (str): The endpoint name.
+            params: Any JSON-serializable request parameters (query string and/or body).
+
+        Returns:
+            str: A hex digest identifying the request.
+        """
+        normalized = json.dumps([endpoint, params], sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    def _count(self, endpoint, field):
+        self.stats.setdefault(endpoint, {'hits': 0, 'misses': 0})[field] += 1
+
+    def get(self, endpoint, params, raw=False):
+        """
+        Looks up a stored response.
+
+        Args:
+            endpoint (str): The endpoint name.
+            params: The request parameters.
+            raw (bool, optional): Return the stored body undecoded (bytes). Defaults to False.
+
+        Returns:
+            tuple: The JSON response and headers (multidict.CIMultiDict), or None on a miss.
+        """
+        key = self.make_key(endpoint, params)
+        row = self.con.execute('SELECT created, size, body, headers FROM responses WHERE key = ?', (key,)).fetchone()
+        now = time.time()
+        if row is None:
+            self._count(endpoint, 'misses')
+            return None
+        created, size, body, headers = row
+        if self.ttl is not None and now - created > self.ttl:
+            self._delete(key, size)
+            self._count(endpoint, 'misses')
+            return None
+        self.con.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+        self.con.commit()
+        self._count(endpoint, 'hits')
+        return body if raw else self._loads(body), CIMultiDict(json.loads(headers))
+
+    def set(self, endpoint, params, response, headers=None):
+        """
+        Stores a response, evicting least recently used entries if the cache is over its limits.
+
+        Args:
+            endpoint (str): The endpoint name.
+            params: The request parameters.
+            response: The JSON response, or an undecoded JSON body (bytes) which is stored as is.
+            headers (Mapping, optional): Response headers to store alongside the body. Defaults to None.
+        """
+        key = self.make_key(endpoint, params)
+        body = response if isinstance(response, bytes) else json.dumps(response, separators=(',', ':')).encode()
+        headers = json.dumps(dict(headers or {}))
+        now = time.time()
+        old = self.con.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+        if old is not None:
+            self._entries -= 1
+            self._bytes -= old[0]
+        self.con.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         (key, endpoint, now, now, len(body), body, headers))
+        self._entries += 1
+        self._bytes += len(body)
+        self._evict()
+        self.con.commit()
+
+    def _delete(self, key, size):
+        self.con.execute('DELETE FROM responses WHERE key = ?', (key,))
+        self.con.commit()
+        self._entries -= 1
+        self._bytes -= size
+
+    def _evict(self):
+        while self._entries > self.max_entries or self._bytes > self.max_bytes:
+            n = max(1, self._entries - self.max_entries, self._entries // 100)
+            rows = self.con.execute('SELECT key, size FROM responses ORDER BY accessed LIMIT ?', (n,)).fetchall()
+            if not rows:
+                break
+            self.con.executemany('DELETE FROM responses WHERE key = ?', [(k,) for k, _ in rows])
+            self._entries -= len(rows)
+            self._bytes -= sum(s for _, s in rows)
+
+    def clear(self):
+        """
+        Removes every stored response and resets the counters.
+        """
+        self.con.execute('DELETE FROM responses')
+        self.con.commit()
+        self._entries, self._bytes = 0, 0
+        self.stats = {}
+
+    def close(self):
+        """
+        Closes the database connection.
+        """
+        self.con.close()
@@ -0,0 +1,186 @@
+"""
+Client Module
+
+This module contains the StreamStatsClient class, a synchronous client for single-point lookups that runs the
+full pipeline, from delineation to flow statistics, on a reused background event loop.
+"""
+
+import asyncio
+from .background import BackgroundLoop
+from .cache import ResponseCache
+from .endpoints import USGSEndpoints
+from .models import Point
+from .payload import PayloadMode
+from .retry import classify_error, retry_delay
+from .stages import STAGES
+
+
+class StreamStatsClient:
+    """
+    StreamStatsClient answers single-point StreamStats queries from synchronous code, e.g. a Flask view or a
+    notebook cell.
+
+    Every call runs on one background event loop through one USGSEndpoints client, so keep-alive connections,
+    DNS lookups and coalesced scenario lookups are shared by all calls instead of being set up again for each one.
+    Calls may be made from several threads at once and then run concurrently on the loop.  Failed stages are
+    retried with the same backoff as batch runs, and incomplete basin characteristics are polled again.
+
+    Attributes:
+        client (USGSEndpoints): The client every request goes through.  It lives on the background loop.
+        loop (BackgroundLoop): The loop requests run on.
+        max_retries (int): The maximum number of times a failed stage is retried per lookup.
+        poll_schedule (tuple): Seconds to wait before each re-poll of incomplete basin characteristics.
+        payload (PayloadMode): How much of each delineation is requested and kept, or None for everything.
+        stat_groups (tuple): IDs of the NSS statistic groups computed per lookup, or None for peak flows.
+    """
+
+    def __init__(self, server_name='prodweba', cache=None, coalesce=True, max_retries=3,
+                 poll_schedule=(3, 9, 27, 81), loop=None, payload=None, stat_groups=None, **client_kwargs):
+        """
+        Initializes the client.  The background loop starts with the first request.
+
+        Args:
+            server_name (str, optional): The server delineations are sent to. Defaults to 'prodweba'.
+            cache (str or ResponseCache, optional): path to a SQLite response cache, or an open ResponseCache.
+                Defaults to None.
+            coalesce (bool or int, optional): Share and memoize regression region and scenario lookups across
+                calls (see USGSEndpoints). Defaults to True.
+            max_retries (int, optional): The maximum number of times a failed stage is retried. Defaults to 3.
+            poll_schedule (iterable, optional): seconds to wait before each re-poll of incomplete basin
+                characteristics. Defaults to (3, 9, 27, 81).
+            loop (BackgroundLoop, optional): A loop to share with other clients, e.g. background.shared_loop().
+                Defaults to a loop owned by this client.
+            payload (PayloadMode or dict, optional): trims what is requested and kept per point (see
+                payload.PayloadMode). Defaults to None (everything).
+            stat_groups (iterable, optional): IDs of the NSS statistic groups to compute per lookup, e.g. [2, 4].
+                Defaults to None (peak flows).
+            **client_kwargs: Keyword arguments passed to USGSEndpoints, e.g. timeout, adaptive or hedge.
+        """
+        self._owns_loop = loop is None
+        self.loop = BackgroundLoop() if loop is None else loop
+        self._owns_cache = isinstance(cache, str)
+        if self._owns_cache:
+            cache = ResponseCache(cache)
+        self.client = USGSEndpoints(server_name, cache=cache, coalesce=coalesce, **client_kwargs)
+        self.max_retries = max_retries
+        self.poll_schedule = tuple(poll_schedule)
+        self.payload = PayloadMode.from_options(payload)
+        self.stat_groups = None if stat_groups is None else tuple(str(g) for g in stat_groups)
+
+    def run(self, coro, timeout=None):
+        """
+        Runs a coroutine on the background loop, e.g. one awaiting methods of self.client.
+
+        Args:
+            coro (coroutine): The coroutine to run.
+            timeout (float, optional): Seconds to wait before cancelling it. Defaults to None (no limit).
+
+        Returns:
+            The coroutine's result.
+        """
+        return self.loop.run(coro, timeout)
+
+    async def _run_stages(self, pt, stages):
+        stage = 0
+        polls = 0
+        while stage < len(stages):
+            name, run = stages[stage]
+            try:
+                if await run(pt) is not False:
+                    stage += 1
+                    polls = 0
+                    continue
+                if polls < len(self.poll_schedule):
+                    await asyncio.sleep(self.poll_schedule[polls])
+                    polls += 1
+                    continue
+                raise RuntimeError(f'{name} incomplete after {polls} polls')
+            except Exception as e:
+                error_class = classify_error(e)
+                pt.attempts += 1
+                pt.last_error = f'{name}: {error_class}: {e}'
+                if pt.attempts > self.max_retries:
+                    raise
+                # A client error fetching basin characteristics usually means the workspace is gone
+                if name == 'basin_characteristics' and error_class == 'client_error':
+                    stage = 0
+                polls = 0
+                await asyncio.sleep(retry_delay(e, pt.attempts))
+        return pt
+
+    def _point(self, rcode, x, y, crs, uid, keep_raw):
+        return Point(rcode, x, y, crs, uid, api_client=self.client, keep_raw=keep_raw, payload=self.payload,
+                     stat_groups=self.stat_groups)
+
+    def query(self, rcode, x, y, crs='4326', uid=None, keep_raw=False, timeout=None):
+        """
+        Delineates the watershed at a point and computes its basin characteristics and flow statistics.
+
+        Args:
+            rcode (str): The region code.
+            x (float): The x-coordinate (longitude) of the point.
+            y (float): The y-coordinate (latitude) of the point.
+            crs (str, optional): The coordinate reference system. Defaults to '4326'.
+            uid (str, optional): An identifier for the point. Defaults to None.
+            keep_raw (bool, optional): Whether to keep the raw JSON responses on the point. Defaults to False.
+            timeout (float, optional): Seconds to wait for the whole lookup. Defaults to None (no limit).
+
+        Returns:
+            Point: The point, with characteristics and statistics set.
+
+        Raises:
+            Exception: The last error of a stage that failed more than max_retries times.
+        """
+        pt = self._point(rcode, x, y, crs, uid, keep_raw)
+        return self.run(self._run_stages(pt, STAGES), timeout)
+
+    def delineate(self, rcode, x, y, crs='4326', uid=None, keep_raw=False, timeout=None):
+        """
+        Delineates the watershed at a point.
+
+        Args:
+            rcode (str): The region code.
+            x (float): The x-coordinate (longitude) of the point.
+            y (float): The y-coordinate (latitude) of the point.
+            crs (str, optional): The coordinate reference system. Defaults to '4326'.
+            uid (str, optional): An identifier for the point. Defaults to None.
+            keep_raw (bool, optional): Whether to keep the raw JSON response on the point. Defaults to False.
+            timeout (float, optional): Seconds to wait for the delineation. Defaults to None (no limit).
+
+        Returns:
+            Point: The point, with its watershed and workspace ID set.
+        """
+        pt = self._point(rcode, x, y, crs, uid, keep_raw)
+        return self.run(self._run_stages(pt, STAGES[:1]), timeout)
+
+    def get_basin_characteristics(self, rcode, workspace_id=None, parameters=None, server_name=None):
+        """
+        Fetches basin characteristics for a delineated workspace.
+
+        Args:
+            rcode (str): The region code.
+            workspace_id (str, optional): The workspace ID. Defaults to None.
+            parameters (str, optional): The parameters to include. Defaults to None.
+            server_name (str, optional): The server that owns workspace_id. Defaults to the client's server.
+
+        Returns:
+            tuple: A tuple containing the JSON response from the API and the response headers.
+        """
+        return self.run(self.client._get_basin_characteristics_async(rcode, workspace_id, parameters, server_name))
+
+    def close(self):
+        """
+        Closes the client's connections, its cache if it opened it, and its background loop if it owns it.
+        """
+        if self.loop.loop is not None:
+            self.run(self.client.close())
+        if self._owns_cache:
+            self.client.cache.close()
+        if self._owns_loop:
+            self.loop.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,83 @@
+"""
+Coalesce Module
+
+This module contains the SingleFlight class, which merges concurrent identical requests into one and
+memoizes their results so that points sharing the same lookup only query the API once.
+"""
+
+import asyncio
+import copy
+from collections import OrderedDict
+
+
+class SingleFlight:
+    """
+    SingleFlight shares one in-flight request between concurrent callers with the same key and keeps
+    completed results in a bounded LRU.  Every caller receives its own deep copy of the result, so
+    callers may mutate what they get back.
+
+    Attributes:
+        maxsize (int): The maximum number of memoized results.
+        stats (dict): Counts of 'hits' (served from the LRU), 'coalesced' (joined an in-flight request)
+            and 'misses' (sent a request).
+    """
+
+    def __init__(self, maxsize=1024):
+        """
+        Initializes the single-flight group.
+
+        Args:
+            maxsize (int, optional): The maximum number of memoized results. Defaults to 1024.
+        """
+        self.maxsize = maxsize
+        self.stats = {'hits': 0, 'coalesced': 0, 'misses': 0}
+        self._results = OrderedDict()
+        self._in_flight = {}
+
+    async def do(self, key, request):
+        """
+        Returns the result for key, sending the request only if no identical one is memoized or in flight.
+
+        Args:
+            key (hashable): Identifies the request.
+            request (callable): Returns an awaitable producing the (json, headers) result.
+
+        Returns:
+            tuple: A deep copy of the JSON response and the response headers.
+        """
+        if key in self._results:
+            self._results.move_to_end(key)
+            self.stats['hits'] += 1
+            return self._copy(self._results[key])
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.stats['coalesced'] += 1
+            return self._copy(await asyncio.shield(task))
+
+        self.stats['misses'] += 1
+        task = asyncio.ensure_future(request())
+        self._in_flight[key] = task
+        try:
+            # Shielded so that cancelling this caller does not cancel the request for the others
+            result = await asyncio.shield(task)
+        finally:
+            if task.done():
+                self._in_flight.pop(key, None)
+            else:
+                task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        self._results[key] = result
+        if len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+        return self._copy(result)
+
+    @staticmethod
+    def _copy(result):
+        response, headers = result
+        return copy.deepcopy(response), headers
+
+    def clear(self):
+        """
+        Forgets every memoized result.
+        """
+        self._results.clear()
@@ -0,0 +1,41 @@
+"""
+Decoding Module
+
+This module contains the JSON decoders APIClient can use for response bodies.  orjson is used when it is
+installed, otherwise the standard library json module.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def get_decoder(decoder='auto'):
+    """
+    Looks up a JSON decoder.
+
+    Args:
+        decoder (str or callable, optional): 'auto' (orjson if installed, else json), 'orjson', 'json', or a
+            callable taking bytes and returning the decoded JSON. Defaults to 'auto'.
+
+    Returns:
+        callable: A function decoding a bytes body to JSON.
+
+    Raises:
+        ImportError: If 'orjson' is requested but not installed.
+        ValueError: If the decoder name is not recognized.
+    """
+    if callable(decoder):
+        return decoder
+    if decoder == 'auto':
+        decoder = 'json' if orjson is None else 'orjson'
+    if decoder == 'orjson':
+        if orjson is None:
+            raise ImportError('orjson is not installed; pip install orjson or use the json decoder')
+        return orjson.loads
+    if decoder == 'json':
+        return json.loads
+    raise ValueError(f'Unknown JSON decoder: {decoder}')
@@ -5,15 +5,120 @@ This module contains classes and methods to interact with specific USGS API endp
 """
 
 from .api_client import APIClient
+from .background import shared_loop
+from .cache import ResponseCache
+from .coalesce import SingleFlight
 from .config import config
-import asyncio
+from .hedging import HedgePolicy
 
 class USGSEndpoints(APIClient):
     """
     USGSEndpoints provides methods to interact with various USGS API endpoints.
+
+    Attributes:
+        cache (ResponseCache): Optional persistent cache consulted before each request.
+        single_flight (SingleFlight): Optional in-process coalescing of identical NSS lookups.
+        hedge (HedgePolicy): Optional hedging of slow requests (see hedging.HedgePolicy).
     """
+
+    def __init__(self, *args, cache=None, coalesce=False, hedge=None, **kwargs):
+        """
+        Initializes the endpoints client.
+
+        Args:
+            *args: Positional arguments passed to APIClient.
+            cache (ResponseCache, optional): A response cache to read from and write to. Defaults to None.
+            coalesce (bool or int, optional): Share in-flight and memoize completed regression region and scenario
+                lookups for the lifetime of the client.  An int sets the memo size. Defaults to False.
+            hedge (bool, dict or HedgePolicy, optional): Send a second copy of requests that outlast their
+                endpoint's usual latency and use whichever answers first.  True uses the Hedging section of
+                config.json; a dict overrides it. Defaults to None (no hedging).
+            **kwargs: Keyword arguments passed to APIClient.
+        """
+        super().__init__(*args, **kwargs)
+        self.cache = cache
+        if coalesce:
+            self.single_flight = SingleFlight() if coalesce is True else SingleFlight(coalesce)
+        else:
+            self.single_flight = None
+        self.hedge = HedgePolicy.from_options(hedge)
+        self._sync_client = None
+
+    async def close(self):
+        """
+        Closes the client's session, and the copy of the client used by get_basin_characteristics if there is one.
+        """
+        helper, self._sync_client = self._sync_client, None
+        if helper is not None:
+            loop = shared_loop()
+            loop.remove_closer(helper.close)
+            await loop.run_async(helper.close())
+        await super().close()
+
+    async def _coalesced(self, endpoint, key, request):
+        """
+        Runs a request through the single-flight group if coalescing is enabled.
+
+        Args:
+            endpoint (str): The endpoint name.
+            key: The normalized request parameters identifying the response.
+            request (callable): Returns the coroutine to await if no identical request is memoized or in flight.
+
+        Returns:
+            tuple: A tuple containing the JSON response from the API and the response headers.
+        """
+        if self.single_flight is None:
+            return await request()
+        return await self.single_flight.do(ResponseCache.make_key(endpoint, key), request)
+
+    async def _hedged(self, endpoint, send, server=None, alternate=None):
+        """
+        Sends a request through the hedge policy if hedging is enabled.
+
+        Args:
+            endpoint (str): The endpoint name.
+            send (callable): Called with a server name and returns the request coroutine.
+            server (str, optional): The server the request goes to. Defaults to None.
+            alternate (str, optional): The server a hedge goes to. Defaults to server.
+
+        Returns:
+            tuple: A tuple containing the JSON response from the API and the response headers.
+        """
+        if self.hedge is None:
+            return await send(server)
+        return await self.hedge.run(endpoint, send, server, alternate)
+
+    async def _cached(self, endpoint, key, request, cacheable=None, refresh=False, raw=False):
+        """
+        Returns a cached response if one exists, otherwise awaits the request and stores its result.
+
+        Args:
+            endpoint (str): The endpoint name used to group cache entries and counters.
+            key: The normalized request parameters identifying the response.
+            request (coroutine): The request to await on a cache miss.
+            cacheable (callable, optional): Predicate on the JSON response deciding whether it is stored.
+                Defaults to None (always store).
+            refresh (bool, optional): Skip the cache lookup but still store the fresh response. Defaults to False.
+            raw (bool, optional): The request returns the undecoded body, and hits are returned undecoded too.
+                Defaults to False.
+
+        Returns:
+            tuple: A tuple containing the JSON response from the API and the response headers.
+        """
+        if self.cache is None:
+            return await request
+        if not refresh:
+            hit = self.cache.get(endpoint, key, raw=raw)
+            if hit is not None:
+                request.close()
+                return hit
+        response, headers = await request
+        if cacheable is None or cacheable(response):
+            self.cache.set(endpoint, key, response, headers)
+        return response, headers
     
-    async def get_watershed(self, rcode, x, y, crs):
+    async def get_watershed(self, rcode, x, y, crs, server_name=None, refresh=False, raw=False,
+                            include_parameters=True):
         """
         Fetches watershed data from the USGS API.
         
@@ -22,6 +127,13 @@ class USGSEndpoints(APIClient):
             x (float): The x-coordinate (longitude) of the point.
             y (float): The y-coordinate (latitude) of the point.
             crs (str): The coordinate reference system.
+            server_name (str, optional): Server to query. Defaults to the client's server_name.
+            refresh (bool, optional): Bypass any cached delineation, e.g. when its workspace has expired.
+                Defaults to False.
+            raw (bool, optional): Return the undecoded body (bytes) so that it can be parsed off the event loop
+                with decode(). Defaults to False.
+            include_parameters (bool, optional): Whether to compute basin characteristics with the delineation.
+                Defaults to True.
         
         Returns:
             tuple: A tuple containing the JSON response from the API and the response headers.
@@ -32,25 +144,33 @@ class USGSEndpoints(APIClient):
             'ylocation': str(y),
             'crs': str(crs),
             'simplify': 'true',
-            'includeparameters': 'true',
+            'includeparameters': 'true' if include_parameters else 'false',
             'includeflowtypes': 'false',
             'includefeatures': 'true'
         }
-        url = config['StreamStatsServiceURLS']['watershed'].format(self.server_name)
-        return await self.get(url, params)
+        server_name = server_name or self.server_name
+        url = config['StreamStatsServiceURLS']['watershed']
+        # A hedge goes to another server; the caller takes the workspace's server from the response headers
+        alternate = self.hedge.alternate(server_name) if self.hedge is not None else None
+        request = self._hedged('watershed', lambda server: self.get(url.format(server), params, raw=raw),
+                               server_name, alternate)
+        return await self._cached('watershed', params, request, refresh=refresh, raw=raw)
     
     async def get_regression_regions(self, delineated_basin):
         """
         Fetches regression regions from the USGS API.
         
         Args:
-            delineated_basin (dict): The delineated basin geometry.
+            delineated_basin (dict or str): The delineated basin geometry, or its GeoJSON text.  Text is sent as is,
+                which avoids re-encoding large geometries on the event loop.
         
         Returns:
             tuple: A tuple containing the JSON response from the API and the response headers.
         """
         url = config['NSSServiceURlS']['regressionRegions']
-        return await self.post(url, json=delineated_basin)
+        body = {'data' if isinstance(delineated_basin, str) else 'json': delineated_basin}
+        return await self._coalesced('regressionRegions', delineated_basin, lambda: self._cached(
+            'regressionRegions', delineated_basin, self._hedged('regressionRegions', lambda _: self.post(url, **body))))
     
     async def get_scenarios(self, rcode, stat_group, regression_regions):
         """
@@ -70,9 +190,10 @@ class USGSEndpoints(APIClient):
             'regressionregions': regression_regions
         }
         url = config['NSSServiceURlS']['scenarios']
-        return await self.get(url, params)
+        return await self._coalesced('scenarios', params, lambda: self._cached(
+            'scenarios', params, self._hedged('scenarios', lambda _: self.get(url, params))))
     
-    async def _get_basin_characteristics_async(self, rcode, workspace_id=None, parameters=None):
+    async def _get_basin_characteristics_async(self, rcode, workspace_id=None, parameters=None, server_name=None):
         """
         Fetches basin characteristics from the USGS API.
         
@@ -80,6 +201,8 @@ class USGSEndpoints(APIClient):
             rcode (str): The region code.
             workspace_id (str, optional): The workspace ID. Defaults to None.
             parameters (str, optional): The parameters to include. Defaults to None.
+            server_name (str, optional): Server to query.  Must be the server that owns workspace_id. Defaults to
+                the client's server_name.
         
         Returns:
             tuple: A tuple containing the JSON response from the API and the response headers.
@@ -92,8 +215,12 @@ class USGSEndpoints(APIClient):
                 'workspaceID': str(workspace_id),
                 'includeparameters': (parameters)
             }
-        url = config['StreamStatsServiceURLS']['basinCharacteristics'].format(self.server_name)
-        return await self.get(url, params)
+        url = config['StreamStatsServiceURLS']['basinCharacteristics'].format(server_name or self.server_name)
+        # Characteristics are still being computed server-side until every parameter has a value
+        complete = lambda r: all('value' in p for p in r.get('parameters', []))
+        # Hedges can only repeat the request, since the workspace lives on one server
+        request = self._hedged('basinCharacteristics', lambda _: self.get(url, params))
+        return await self._cached('basinCharacteristics', params, request, cacheable=complete)
     
     async def get_flow_statistics(self, rcode, scenarios):
         """
@@ -107,11 +234,16 @@ class USGSEndpoints(APIClient):
             tuple: A tuple containing the JSON response from the API and the response headers.
         """
         url = config['NSSServiceURlS']['computeFlowStats']
-        return await self.post(url, params=rcode, json=scenarios)
+        request = self._hedged('computeFlowStats', lambda _: self.post(url, params=rcode, json=scenarios))
+        return await self._cached('computeFlowStats', [rcode, scenarios], request)
 
     def get_basin_characteristics(self, rcode, workspace_id=None, parameters=None):
         """
         Fetches basin characteristics from the USGS API synchronously.
+
+        Requests run on the shared background event loop (see background.shared_loop) through a copy of this
+        client that is created on the first call and reused, so repeated calls share its connections.  The copy
+        is closed with this client, or when the background loop stops if this client is never closed.
         
         Args:
             rcode (str): The region code.
@@ -121,4 +253,10 @@ class USGSEndpoints(APIClient):
         Returns:
             dict: The JSON response from the API containing basin characteristics.
         """
-        return asyncio.run(self._get_basin_characteristics_async(rcode, workspace_id, parameters))
+        loop = shared_loop()
+        if self._sync_client is None:
+            self._sync_client = USGSEndpoints(self.server_name, cache=self.cache, timeout=self.timeout,
+                                              decoder=self.decoder, offload_bytes=self.offload_bytes,
+                                              executor=self.executor, hedge=self.hedge, **self.connector_kwargs)
+            loop.add_closer(self._sync_client.close)
+        return loop.run(self._sync_client._get_basin_characteristics_async(rcode, workspace_id, parameters))
@@ -0,0 +1,285 @@
+"""
+Estimator Module
+
+This module contains the RegressionEstimator class, which evaluates NSS regression equations locally
+so flow statistics for many points can be computed without a computeFlowStats request per point.
+"""
+
+import ast
+import asyncio
+import copy
+import json
+import logging
+import random
+import numpy as np
+
+# Functions and constants that may appear in NSS equations
+_FUNCTIONS = {
+    'log10': np.log10, 'log': np.log, 'ln': np.log, 'exp': np.exp, 'sqrt': np.sqrt, 'abs': np.abs,
+    'min': np.minimum, 'max': np.maximum, 'pow': np.power,
+}
+_CONSTANTS = {'e': np.e, 'pi': np.pi}
+_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Name, ast.Load, ast.Constant, ast.Tuple, ast.List,
+          ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd)
+
+
+def compile_equation(equation):
+    """
+    Compiles an NSS equation string into a function of parameter arrays.
+
+    Only arithmetic, the functions in _FUNCTIONS and parameter names are allowed.  '^' is read as
+    exponentiation and parameter names are matched case-insensitively.
+
+    Args:
+        equation (str): The equation, e.g. '10^(2.3)*DRNAREA^(0.84)'.
+
+    Returns:
+        tuple: The compiled function (taking a dict of upper-case parameter code to numpy array) and the
+            set of parameter codes it uses.
+
+    Raises:
+        ValueError: If the equation contains anything other than the allowed expressions.
+    """
+    tree = ast.parse(equation.replace('^', '**'), mode='eval')
+    params = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, _NODES):
+            raise ValueError(f'Unsupported expression in equation: {equation}')
+        if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name) and node.func.id.lower() in _FUNCTIONS):
+            raise ValueError(f'Unsupported function in equation: {equation}')
+        if isinstance(node, ast.Name):
+            if node.id.lower() in _FUNCTIONS or node.id.lower() in _CONSTANTS:
+                node.id = node.id.lower()
+            else:
+                node.id = node.id.upper()
+                params.add(node.id)
+    code = compile(tree, '<equation>', 'eval')
+
+    def evaluate(values):
+        namespace = {'__builtins__': {}, **_FUNCTIONS, **_CONSTANTS}
+        namespace.update({k: values[k] for k in params})
+        return eval(code, namespace)
+
+    return evaluate, params
+
+
+class RegressionEstimator:
+    """
+    RegressionEstimator computes flow statistics for groups of points from regression definitions.
+
+    Definitions are read once per regression region from a remote computeFlowStats response (the equation,
+    and the prediction interval terms where the service provides them).  All other points in the region are
+    then evaluated together as numpy arrays and given a flow statistics payload in the same shape as the remote
+    service returns, so Point.statistics_df is unchanged.  Regions whose responses carry no equations are
+    always estimated remotely.
+
+    Attributes:
+        verify_fraction (float): Share of locally estimated points also sent to the remote service for comparison.
+        rtol (float): Relative tolerance used when verifying.
+        definitions (dict): Parsed definitions keyed by region, or None for regions that must be estimated remotely.
+        stats (dict): Counts of 'local', 'remote', 'verified' and 'mismatched' estimates.
+    """
+
+    def __init__(self, verify_fraction=0.0, rtol=1e-3):
+        """
+        Initializes the estimator.
+
+        Args:
+            verify_fraction (float, optional): Share of locally estimated points to verify remotely. Defaults to 0.0.
+            rtol (float, optional): Relative tolerance used when verifying. Defaults to 1e-3.
+        """
+        self.verify_fraction = verify_fraction
+        self.rtol = rtol
+        self.definitions = {}
+        self.stats = {'local': 0, 'remote': 0, 'verified': 0, 'mismatched': 0}
+
+    @staticmethod
+    def region_key(pt, scenario):
+        """
+        Identifies the regression definitions one of a point's scenarios uses.
+
+        Args:
+            pt (Point): A point with scenarios.
+            scenario (dict): One of the point's scenarios.
+
+        Returns:
+            tuple: Region code, statistic group and regression region codes.
+        """
+        regions = tuple(r.get('code') for r in scenario['regressionRegions'])
+        return pt.rcode, scenario.get('statisticGroupID'), regions
+
+    @staticmethod
+    def parse_definitions(flow_stats):
+        """
+        Parses regression definitions from a computeFlowStats response.
+
+        Args:
+            flow_stats (list): The JSON response from computeFlowStats.
+
+        Returns:
+            list: One dict per statistic with the template result, compiled equation and optional prediction
+                interval terms, or None if any statistic has no equation.
+        """
+        definitions = []
+        for result in flow_stats[0]['regressionRegions'][0]['results']:
+            if not result.get('equation'):
+                return None
+            equation, params = compile_equation(result['equation'])
+            definition = {'template': result, 'equation': equation, 'params': params, 'interval': None}
+            pi = result.get('predictionInterval')
+            if pi and pi.get('covarianceMatrix') and pi.get('xiRowVector'):
+                covariance = pi['covarianceMatrix']
+                xi = pi['xiRowVector']
+                xi, xi_params = compile_equation(xi if isinstance(xi, str) else ','.join(map(str, xi)))
+                definition['params'] = params | xi_params
+                definition['interval'] = {
+                    'xi': xi,
+                    'covariance': np.asarray(json.loads(covariance) if isinstance(covariance, str) else covariance, dtype=float),
+                    'variance': float(pi['variance']),
+                    'student_t': float(pi['student_T']),
+                    'bcf': float(pi.get('biasCorrectionFactor') or 1.0),
+                }
+            definitions.append(definition)
+        return definitions
+
+    def evaluate(self, definitions, scenarios):
+        """
+        Evaluates regression definitions for the scenarios of a group of points.
+
+        Args:
+            definitions (list): Definitions from parse_definitions.
+            scenarios (list): Scenarios of the same region and statistic group, with their parameters filled.
+
+        Returns:
+            list: A flow statistics payload for each scenario, shaped like a computeFlowStats response.
+        """
+        n = len(scenarios)
+        values = {}
+        for s in scenarios:
+            for p in s['regressionRegions'][0]['parameters']:
+                values.setdefault(p['code'].upper(), []).append(p.get('value', np.nan))
+        values = {k: np.asarray(v, dtype=float) for k, v in values.items() if len(v) == n}
+
+        results = []
+        for d in definitions:
+            estimate = np.broadcast_to(d['equation'](values), (n,)).astype(float)
+            lower = upper = np.full(n, np.nan)
+            if d['interval'] is not None:
+                i = d['interval']
+                xi = np.column_stack([np.broadcast_to(np.asarray(c, dtype=float), (n,)) for c in i['xi'](values)])
+                xux = np.einsum('ij,jk,ik->i', xi, i['covariance'], xi)
+                t = 10 ** (i['student_t'] * np.sqrt(i['variance'] + xux))
+                lower = estimate / (i['bcf'] * t)
+                upper = estimate * t / i['bcf']
+            results.append((d['template'], estimate, lower, upper))
+
+        payloads = []
+        for j, s in enumerate(scenarios):
+            scenario = copy.deepcopy(s)
+            region = scenario['regressionRegions'][0]
+            region['results'] = []
+            for template, estimate, lower, upper in results:
+                # Equivalent years and standard errors belong to the equation, not the point, so they are kept
+                result = {k: v for k, v in template.items() if k != 'predictionInterval'}
+                result['value'] = float(estimate[j])
+                result['intervalBounds'] = None if np.isnan(lower[j]) else {'lower': float(lower[j]), 'upper': float(upper[j])}
+                region['results'].append(result)
+            payloads.append([scenario])
+        return payloads
+
+    async def estimate(self, points):
+        """
+        Computes flow statistics for a batch of points, locally where possible.  Each of a point's scenarios (one
+        per statistic group) is estimated with the other points' scenarios of the same region and group.
+
+        Args:
+            points (list): Points that have scenarios and basin characteristics.
+
+        Returns:
+            list: The exception raised for each point, or None if it succeeded.
+        """
+        errors = {}
+        groups = {}
+        results = {}
+        for pt in points:
+            try:
+                pt._fill_scenario_parameters()
+                results[id(pt)] = [None] * len(pt.scenarios)
+                for i, scenario in enumerate(pt.scenarios):
+                    groups.setdefault(self.region_key(pt, scenario), []).append((pt, i))
+            except Exception as e:
+                errors[id(pt)] = e
+
+        for key, group in groups.items():
+            # Estimate remotely until the region's definitions are known
+            while key not in self.definitions and group:
+                pt, i = group.pop(0)
+                try:
+                    flow_stats = await pt._get_scenario_statistics_async(pt.scenarios[i])
+                    self.stats['remote'] += 1
+                except Exception as e:
+                    errors[id(pt)] = e
+                    continue
+                results[id(pt)][i] = flow_stats
+                try:
+                    self.definitions[key] = self.parse_definitions(flow_stats)
+                except (KeyError, IndexError, TypeError, ValueError, SyntaxError) as e:
+                    logging.info(f'Estimating {key} remotely: {e}')
+                    self.definitions[key] = None
+            if not group:
+                continue
+
+            if self.definitions[key] is None:
+                await self._estimate_remotely(group, results, errors)
+                continue
+
+            try:
+                payloads = self.evaluate(self.definitions[key], [pt.scenarios[i] for pt, i in group])
+            except (KeyError, ValueError, TypeError, ArithmeticError) as e:
+                logging.info(f'Local estimate failed for {key}, estimating remotely: {e}')
+                await self._estimate_remotely(group, results, errors)
+                continue
+            self.stats['local'] += len(group)
+            for (pt, i), flow_stats in zip(group, payloads):
+                results[id(pt)][i] = flow_stats
+            if self.verify_fraction:
+                await self._verify([(pt, i) for pt, i in group if random.random() < self.verify_fraction], results)
+
+        for pt in points:
+            if id(pt) not in errors:
+                try:
+                    pt._set_flow_statistics([scenario for flow_stats in results[id(pt)] for scenario in flow_stats])
+                except Exception as e:
+                    errors[id(pt)] = e
+        return [errors.get(id(pt)) for pt in points]
+
+    async def _estimate_remotely(self, group, results, errors):
+        responses = await asyncio.gather(*[pt._get_scenario_statistics_async(pt.scenarios[i]) for pt, i in group],
+                                         return_exceptions=True)
+        for (pt, i), response in zip(group, responses):
+            if isinstance(response, Exception):
+                errors[id(pt)] = response
+            else:
+                results[id(pt)][i] = response
+                self.stats['remote'] += 1
+
+    async def _verify(self, group, results):
+        responses = await asyncio.gather(*[pt._get_scenario_statistics_async(pt.scenarios[i]) for pt, i in group],
+                                         return_exceptions=True)
+        for (pt, i), remote in zip(group, responses):
+            if isinstance(remote, Exception):
+                logging.debug(f'Could not verify {pt} | {remote}')
+                continue
+            try:
+                local_values = [r['value'] for r in results[id(pt)][i][0]['regressionRegions'][0]['results']]
+                remote_values = [r['value'] for r in remote[0]['regressionRegions'][0]['results']]
+                matched = np.allclose(local_values, remote_values, rtol=self.rtol, equal_nan=True)
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                logging.debug(f'Could not verify {pt} | {e}')
+                continue
+            self.stats['verified'] += 1
+            if not matched:
+                # Keep the remote answer for this point
+                self.stats['mismatched'] += 1
+                logging.warning(f'Local estimate differs from remote for {pt}: {local_values} != {remote_values}')
+                results[id(pt)][i] = remote
@@ -0,0 +1,223 @@
+"""
+Hedging Module
+
+This module contains the HedgePolicy class, which cuts tail latency by sending a second copy of a request that
+is taking longer than most requests to the same endpoint, and using whichever answer arrives first.
+"""
+
+import asyncio
+from collections import deque
+from .config import config
+
+
+class _Endpoint:
+    """
+    Recent latencies and hedging counters for one endpoint.
+    """
+
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)
+        self.threshold = None
+        self.requests = 0
+        self.hedged = 0
+        self.won = 0
+
+
+def _retrieve(task):
+    # Marks a loser's exception as retrieved so asyncio does not log it
+    if not task.cancelled():
+        task.exception()
+
+
+class HedgePolicy:
+    """
+    HedgePolicy decides when a request is hedged and runs hedged requests.
+
+    Latencies of successful requests are tracked per endpoint over the last `window` requests.  Once an endpoint
+    has `min_samples` of them, a request still unanswered after the endpoint's `percentile` latency gets a second
+    copy: delineations go to an alternate server, and requests to host-agnostic endpoints (the NSS services) are
+    repeated.  The first successful answer is used and the other request is cancelled.  If one copy fails, the
+    other is still awaited.  Hedges are capped at `max_ratio` of all requests, so a slow period cannot double the
+    load on the services.
+
+    Only the endpoints in `endpoints` are hedged.  Basin characteristics are left out by default: they must go to
+    the server holding the delineation's workspace, so the only possible hedge is a repeat to that same server.
+    A hedged delineation takes its workspace, and the server later requests go to, from the answer that won.
+
+    Attributes:
+        percentile (float): Latency percentile (0-100) after which a request is hedged.
+        max_ratio (float): Most hedges as a share of requests.
+        min_samples (int): Latencies needed per endpoint before its requests are hedged.
+        window (int): Number of recent latencies kept per endpoint.
+        endpoints (set): Names of the endpoints that are hedged.
+        servers (list): StreamStats servers delineations may be hedged to.
+        pool (ServerPool): When set, delineations are not hedged to ejected servers.
+        requests (int): Requests sent through the policy.
+        hedged (int): Hedges sent.
+    """
+
+    def __init__(self, percentile=None, max_ratio=None, min_samples=None, window=None, endpoints=None,
+                 servers=None, pool=None):
+        """
+        Initializes the policy.
+
+        Args:
+            percentile (float, optional): Latency percentile (0-100) after which a request is hedged.
+            max_ratio (float, optional): Most hedges as a share of requests.
+            min_samples (int, optional): Latencies needed per endpoint before its requests are hedged.
+            window (int, optional): Number of recent latencies kept per endpoint.
+            endpoints (iterable, optional): Endpoint names to hedge, out of watershed, basinCharacteristics,
+                regressionRegions, scenarios and computeFlowStats.
+            servers (list, optional): StreamStats servers delineations may be hedged to. Defaults to the
+                ServerPool servers in config.json.
+            pool (ServerPool, optional): Skips ejected servers when choosing an alternate. Defaults to None.
+
+        Unset options default to the Hedging section of config.json.
+        """
+        settings = config['Hedging']
+        self.percentile = settings['percentile'] if percentile is None else percentile
+        self.max_ratio = settings['max_ratio'] if max_ratio is None else max_ratio
+        self.min_samples = settings['min_samples'] if min_samples is None else min_samples
+        self.window = window or settings['window']
+        self.endpoints = set(settings['endpoints'] if endpoints is None else endpoints)
+        self.servers = list(servers or config['ServerPool']['servers'])
+        self.pool = pool
+        self.requests = 0
+        self.hedged = 0
+        self._stats = {}
+
+    @classmethod
+    def from_options(cls, options, **kwargs):
+        """
+        Builds a policy from a HedgePolicy, True, a dict of its arguments, or None.
+
+        Args:
+            options (HedgePolicy, bool, dict or None): The policy, True for the defaults, or its arguments.
+            **kwargs: Defaults for arguments not in options, e.g. servers.
+
+        Returns:
+            HedgePolicy: The policy, or None if hedging is off.
+        """
+        if not options or isinstance(options, cls):
+            return options or None
+        return cls(**{**kwargs, **(options if isinstance(options, dict) else {})})
+
+    def _endpoint(self, endpoint):
+        if endpoint not in self._stats:
+            self._stats[endpoint] = _Endpoint(self.window)
+        return self._stats[endpoint]
+
+    def delay(self, endpoint):
+        """
+        Returns how long a request to an endpoint may take before it is hedged.
+
+        Args:
+            endpoint (str): The endpoint name.
+
+        Returns:
+            float: Seconds, or None while the endpoint has too few latencies to tell.
+        """
+        stats = self._endpoint(endpoint)
+        if len(stats.samples) < max(self.min_samples, 1):
+            return None
+        if stats.threshold is None:
+            ordered = sorted(stats.samples)
+            stats.threshold = ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+        return stats.threshold
+
+    def record(self, endpoint, latency):
+        """
+        Records the latency of a successful request.
+
+        Args:
+            endpoint (str): The endpoint name.
+            latency (float): Seconds the request took.
+        """
+        stats = self._endpoint(endpoint)
+        stats.samples.append(latency)
+        stats.threshold = None
+
+    def alternate(self, server):
+        """
+        Chooses the server a delineation sent to `server` is hedged to.
+
+        Args:
+            server (str): The server the request went to.
+
+        Returns:
+            str: Another server that is not ejected from the pool, or `server` itself if there is none.
+        """
+        for name in self.servers:
+            host = self.pool.hosts.get(name) if self.pool is not None else None
+            if name != server and (host is None or host.open_until is None):
+                return name
+        return server
+
+    def _allow(self):
+        if self.hedged + 1 > self.max_ratio * self.requests:
+            return False
+        self.hedged += 1
+        return True
+
+    async def run(self, endpoint, send, server=None, alternate=None):
+        """
+        Sends a request, hedging it if it outlasts the endpoint's latency percentile.
+
+        Args:
+            endpoint (str): The endpoint name.
+            send (callable): Called with a server name (or None) and returns the request coroutine.
+            server (str, optional): The server the request goes to. Defaults to None.
+            alternate (str, optional): The server a hedge goes to. Defaults to server (a repeat of the request).
+
+        Returns:
+            The result of the first copy to succeed.
+
+        Raises:
+            Exception: The error of the original request if every copy failed.
+        """
+        if endpoint not in self.endpoints:
+            return await send(server)
+        stats = self._endpoint(endpoint)
+        self.requests += 1
+        stats.requests += 1
+        delay = self.delay(endpoint)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        primary = asyncio.ensure_future(send(server))
+        tasks = [primary]
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self._allow():
+                    stats.hedged += 1
+                    tasks.append(asyncio.ensure_future(send(alternate or server)))
+            pending = tasks
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        # The original request's latency, or a lower bound of it when the hedge won
+                        self.record(endpoint, loop.time() - start)
+                        stats.won += task is not primary
+                        return task.result()
+            return primary.result()
+        finally:
+            for task in tasks:
+                task.add_done_callback(_retrieve)
+                if not task.done():
+                    task.cancel()
+
+    def summary(self):
+        """
+        Describes hedging per endpoint.
+
+        Returns:
+            list: One line per endpoint that has had requests.
+        """
+        lines = []
+        for endpoint, stats in self._stats.items():
+            delay = self.delay(endpoint)
+            threshold = 'n/a' if delay is None else f'{delay:.2f}s'
+            lines.append(f'{endpoint}: p{self.percentile:g} {threshold} | {stats.hedged} of {stats.requests} '
+                         f'requests hedged | {stats.won} won by the hedge')
+        return lines
@@ -0,0 +1,127 @@
+"""
+Limiter Module
+
+This module contains the AIMDLimiter class, an adaptive concurrency limiter used to bound the number of
+in-flight requests sent to a single host.
+"""
+
+import asyncio
+import time
+
+
+class AIMDLimiter:
+    """
+    AIMDLimiter bounds in-flight requests to one host using additive-increase/multiplicative-decrease.
+
+    The limit grows by roughly `increase` per round trip while responses are healthy and is cut by
+    `decrease_factor` when the host returns 429/5xx, times out, or when an endpoint's smoothed latency rises
+    above `latency_tolerance` times its baseline (plus `latency_slack` seconds, so jitter on very fast responses
+    is not mistaken for congestion).
+
+    Endpoints of one host can differ in latency by orders of magnitude, so each endpoint has its own baseline: a
+    slow-moving average of its latency (weighted by `baseline_smoothing`).  A slow endpoint is therefore not
+    taken for a congested fast one, and a fastest-ever sample from a jittery endpoint does not become a bar
+    that its ordinary requests can never meet.
+
+    Attributes:
+        min_limit (int): The lowest the limit may fall.
+        max_limit (int): The highest the limit may rise.
+        in_flight (int): The number of requests currently holding a slot.
+        latency (float): Exponentially smoothed request latency in seconds, over every endpoint.
+        min_latency (float): The fastest request latency observed on any endpoint.
+        endpoints (dict): Smoothed latency and baseline per endpoint.
+    """
+
+    def __init__(self, initial_limit=2, min_limit=1, max_limit=16, increase=1.0, decrease_factor=0.5,
+                 latency_tolerance=2.0, latency_slack=0.05, smoothing=0.2, baseline_smoothing=0.02):
+        """
+        Initializes the limiter.
+
+        Args:
+            initial_limit (int, optional): The starting limit. Defaults to 2.
+            min_limit (int, optional): The lowest the limit may fall. Defaults to 1.
+            max_limit (int, optional): The highest the limit may rise. Defaults to 16.
+            increase (float, optional): Slots added per round trip of healthy responses. Defaults to 1.0.
+            decrease_factor (float, optional): Multiplier applied to the limit on overload. Defaults to 0.5.
+            latency_tolerance (float, optional): Ratio of smoothed to baseline latency treated as congestion.
+                Defaults to 2.0.
+            latency_slack (float, optional): Seconds added to the congestion threshold. Defaults to 0.05.
+            smoothing (float, optional): Weight of the newest sample in the latency average. Defaults to 0.2.
+            baseline_smoothing (float, optional): Weight of the newest uncongested sample in an endpoint's
+                baseline. Defaults to 0.02.
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.latency_slack = latency_slack
+        self.smoothing = smoothing
+        self.baseline_smoothing = baseline_smoothing
+        self.in_flight = 0
+        self.latency = None
+        self.min_latency = None
+        self.endpoints = {}
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._last_decrease = 0.0
+        self._condition = None
+
+    @property
+    def limit(self):
+        """
+        Returns the current whole-number concurrency limit.
+
+        Returns:
+            int: The number of requests allowed in flight.
+        """
+        return int(self._limit)
+
+    async def acquire(self):
+        """
+        Waits until a slot is free and takes it.
+        """
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self, latency, overloaded=False, endpoint=None):
+        """
+        Frees a slot and adjusts the limit from the outcome of the request.
+
+        Args:
+            latency (float): How long the request took in seconds.
+            overloaded (bool, optional): Whether the host signalled overload (429, 5xx, timeout). Defaults to False.
+            endpoint (str, optional): The endpoint the request went to, e.g. the URL path.  Its latency is compared
+                with that endpoint's baseline only. Defaults to None.
+        """
+        self.in_flight -= 1
+        self._update(latency, overloaded, endpoint)
+        async with self._condition:
+            self._condition.notify_all()
+
+    @staticmethod
+    def _smooth(average, latency, smoothing):
+        return latency if average is None else smoothing * latency + (1 - smoothing) * average
+
+    def _update(self, latency, overloaded, endpoint=None):
+        self.latency = self._smooth(self.latency, latency, self.smoothing)
+        if not overloaded:
+            self.min_latency = latency if self.min_latency is None else min(self.min_latency, latency)
+
+        stats = self.endpoints.setdefault(endpoint, {'latency': None, 'baseline': None})
+        stats['latency'] = self._smooth(stats['latency'], latency, self.smoothing)
+        congested = (stats['baseline'] is not None and
+                     stats['latency'] > self.latency_tolerance * stats['baseline'] + self.latency_slack)
+        if not (overloaded or congested):
+            stats['baseline'] = self._smooth(stats['baseline'], latency, self.baseline_smoothing)
+
+        if overloaded or congested:
+            # Back off at most once per smoothed round trip so one slow burst doesn't collapse the limit
+            now = time.monotonic()
+            if now - self._last_decrease >= stats['latency']:
+                self._limit = max(float(self.min_limit), self._limit * self.decrease_factor)
+                self._last_decrease = now
+        else:
+            self._limit = min(float(self.max_limit), self._limit + self.increase / self._limit)
@@ -0,0 +1,410 @@
+"""
+Metrics Module
+
+This module contains the BatchMetrics class, which collects counters, gauges and latency histograms
+from a batch run, passes events to user hooks and writes periodic JSON or Prometheus text snapshots.
+"""
+
+import asyncio
+import bisect
+import json
+import logging
+import os
+import re
+import time
+from collections import deque
+import aiohttp
+from yarl import URL
+from .config import config
+from .retry import classify_error
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, float('inf'))
+
+
+def endpoint_name(url):
+    """
+    Names the API endpoint a URL belongs to, using the keys of the service URLs in config.json.
+
+    Args:
+        url (str or yarl.URL): The request URL.
+
+    Returns:
+        str: The endpoint name (e.g. 'watershed'), or the URL path for URLs not in config.json.
+    """
+    url = URL(str(url)).with_query(None)
+    for section in ('StreamStatsServiceURLS', 'NSSServiceURlS'):
+        for name, template in config[section].items():
+            # The '{}' in StreamStats URLs is the server name
+            if re.fullmatch(re.escape(template).replace(r'\{\}', '[^/.]+'), str(url)):
+                return name
+    return url.path
+
+
+class Histogram:
+    """
+    Histogram counts observations in fixed buckets, as a Prometheus histogram does.
+
+    Attributes:
+        bounds (tuple): Upper bounds of the buckets, ending with infinity.
+        counts (list): Observations per bucket (not cumulative).
+        sum (float): Sum of all observations.
+        count (int): Number of observations.
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * len(self.bounds)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Adds an observation.
+
+        Args:
+            value (float): The observed value.
+        """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Estimates a quantile by interpolating within the bucket it falls in.
+
+        Args:
+            q (float): The quantile, between 0 and 1.
+
+        Returns:
+            float: The estimate, or None without observations.  Estimates in the last bucket are its lower bound.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.bounds[i - 1] if i else 0.0
+                if self.bounds[i] == float('inf'):
+                    return lower
+                return lower + (self.bounds[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.bounds[-2]
+
+
+class BatchMetrics:
+    """
+    BatchMetrics is the instrumentation surface of a batch run.
+
+    Metrics are keyed by name and labels: counters (requests, retries and failures by error type), gauges (queue
+    depths, points per minute, ETA) and histograms (stage and request latency).  Each notable event is also
+    passed to every hook as hook(event, data), where event is one of:
+
+        'stage'     a point left a stage: point, stage, seconds, outcome ('finished', 'deferred' or 'failed')
+        'retry'     a failed stage will be retried: point, stage, error (the error class)
+        'point'     a point left the pipeline: point, failed
+        'request'   an HTTP request completed: host, endpoint, status (code or error class), seconds
+        'snapshot'  a periodic snapshot was taken: the snapshot dict
+
+    Hooks run on the event loop and should return quickly.  Exceptions raised by hooks are logged and ignored.
+
+    Attributes:
+        hooks (list): Callables taking (event, data).
+        buckets (tuple): Histogram bucket bounds in seconds.
+        window (float): Seconds of completions used to compute points per minute.
+        counters (dict): Counter values keyed by (name, labels).
+        gauges (dict): Gauge values keyed by (name, labels).
+        histograms (dict): Histograms keyed by (name, labels).
+    """
+
+    def __init__(self, hooks=None, buckets=LATENCY_BUCKETS, window=300):
+        """
+        Initializes the metrics.
+
+        Args:
+            hooks (list, optional): Callables taking (event, data). Defaults to None.
+            buckets (tuple, optional): Histogram bucket bounds in seconds. Defaults to LATENCY_BUCKETS.
+            window (float, optional): Seconds of completions used to compute points per minute. Defaults to 300.
+        """
+        self.hooks = list(hooks or [])
+        self.buckets = buckets
+        self.window = window
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.started = time.monotonic()
+        self._completions = deque()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, n=1, **labels):
+        """
+        Increments a counter.
+
+        Args:
+            name (str): The counter name.
+            n (int, optional): The increment. Defaults to 1.
+            **labels: The counter's labels.
+        """
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + n
+
+    def set(self, name, value, **labels):
+        """
+        Sets a gauge.
+
+        Args:
+            name (str): The gauge name.
+            value (float): The value.
+            **labels: The gauge's labels.
+        """
+        self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        """
+        Adds an observation to a histogram.
+
+        Args:
+            name (str): The histogram name.
+            value (float): The observed value, in seconds for latencies.
+            **labels: The histogram's labels.
+        """
+        key = self._key(name, labels)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram(self.buckets)
+        self.histograms[key].observe(value)
+
+    def emit(self, event, **data):
+        """
+        Passes an event to every hook.
+
+        Args:
+            event (str): The event name.
+            **data: The event's data.
+        """
+        for hook in self.hooks:
+            try:
+                hook(event, data)
+            except Exception as e:
+                logging.warning(f'Metrics hook {hook!r} failed on {event}: {e}')
+
+    def point_done(self, pt, failed=False):
+        """
+        Records a point leaving the pipeline.
+
+        Args:
+            pt (Point): The point.
+            failed (bool, optional): Whether it ran out of retries. Defaults to False.
+        """
+        n = 1 + len(pt.members)
+        self.inc('ssa_points_total', n, outcome='failed' if failed else 'finished', region=pt.rcode)
+        features = (pt.wshed_features or []) + (pt.pt_features or [])
+        self.inc('ssa_geometry_bytes_total', sum(len(wkb) for _, wkb in features))
+        now = time.monotonic()
+        self._completions.append((now, n))
+        while self._completions[0][0] < now - self.window:
+            self._completions.popleft()
+        self.emit('point', point=pt, failed=failed)
+
+    def total(self, name):
+        """
+        Sums a counter over all of its labels.
+
+        Args:
+            name (str): The counter name.
+
+        Returns:
+            float: The total.
+        """
+        return sum(v for (n, _), v in self.counters.items() if n == name)
+
+    def points_per_minute(self):
+        """
+        Returns the rate at which points left the pipeline over the last `window` seconds.
+
+        Returns:
+            float: Points per minute.
+        """
+        now = time.monotonic()
+        while self._completions and self._completions[0][0] < now - self.window:
+            self._completions.popleft()
+        span = min(self.window, now - self.started)
+        return 60 * sum(n for _, n in self._completions) / span if span > 0 else 0.0
+
+    def eta(self, remaining):
+        """
+        Estimates the seconds left at the current rate.
+
+        Args:
+            remaining (int): Points still to finish.
+
+        Returns:
+            float: Seconds, or None before any point has finished.
+        """
+        rate = self.points_per_minute()
+        return 60 * remaining / rate if rate else None
+
+    def trace_config(self):
+        """
+        Builds an aiohttp trace config recording request latency, status, connection wait and request and response
+        body bytes per host and endpoint.
+
+        Request time runs from sending the request until the response headers arrive.  Connection wait is the time
+        a request queued for a free connection because of the connector's limits, and connect the time spent
+        opening a new connection.  Response bytes are counted after any content encoding has been removed.  The
+        host and endpoint of a request are resolved once when it starts, not for every body chunk.
+
+        Returns:
+            aiohttp.TraceConfig: Pass to the session (or APIClient(trace_configs=...)).
+        """
+        async def on_request_start(session, ctx, params):
+            ctx.start = time.monotonic()
+            ctx.host, ctx.endpoint = params.url.host, endpoint_name(params.url)
+
+        async def on_request_end(session, ctx, params):
+            self._request(ctx, params.response.status)
+
+        async def on_request_exception(session, ctx, params):
+            self._request(ctx, classify_error(params.exception))
+
+        async def on_queued_start(session, ctx, params):
+            ctx.queued = time.monotonic()
+
+        async def on_queued_end(session, ctx, params):
+            self.observe('ssa_connection_wait_seconds', time.monotonic() - ctx.queued)
+
+        async def on_create_start(session, ctx, params):
+            ctx.connecting = time.monotonic()
+
+        async def on_create_end(session, ctx, params):
+            self.observe('ssa_connect_seconds', time.monotonic() - ctx.connecting)
+
+        async def on_chunk_sent(session, ctx, params):
+            self.inc('ssa_request_bytes_total', len(params.chunk), endpoint=ctx.endpoint)
+
+        async def on_chunk_received(session, ctx, params):
+            self.inc('ssa_response_bytes_total', len(params.chunk), endpoint=ctx.endpoint)
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        trace_config.on_connection_queued_start.append(on_queued_start)
+        trace_config.on_connection_queued_end.append(on_queued_end)
+        trace_config.on_connection_create_start.append(on_create_start)
+        trace_config.on_connection_create_end.append(on_create_end)
+        trace_config.on_request_chunk_sent.append(on_chunk_sent)
+        trace_config.on_response_chunk_received.append(on_chunk_received)
+        return trace_config
+
+    def _request(self, ctx, status):
+        seconds = time.monotonic() - ctx.start
+        host, endpoint = ctx.host, ctx.endpoint
+        self.inc('ssa_requests_total', host=host, endpoint=endpoint, status=status)
+        self.observe('ssa_request_seconds', seconds, host=host, endpoint=endpoint)
+        self.emit('request', host=host, endpoint=endpoint, status=status, seconds=seconds)
+
+    def snapshot(self):
+        """
+        Returns every metric as plain data.
+
+        Returns:
+            dict: 'elapsed' seconds, and lists of 'counters', 'gauges' and 'histograms' with their name, labels and
+                values.  Histograms include cumulative bucket counts and p50/p95 estimates.
+        """
+        histograms = []
+        for (name, labels), h in self.histograms.items():
+            cumulative, total = {}, 0
+            for bound, n in zip(h.bounds, h.counts):
+                total += n
+                cumulative['+Inf' if bound == float('inf') else bound] = total
+            histograms.append({'name': name, 'labels': dict(labels), 'count': h.count, 'sum': h.sum,
+                               'p50': h.quantile(0.5), 'p95': h.quantile(0.95), 'buckets': cumulative})
+        return {
+            'elapsed': time.monotonic() - self.started,
+            'counters': [{'name': name, 'labels': dict(labels), 'value': v} for (name, labels), v in self.counters.items()],
+            'gauges': [{'name': name, 'labels': dict(labels), 'value': v} for (name, labels), v in self.gauges.items()],
+            'histograms': histograms,
+        }
+
+    def to_prometheus(self):
+        """
+        Formats every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics text.
+        """
+        def fmt(labels, **extra):
+            pairs = list(labels) + list(extra.items())
+            if not pairs:
+                return ''
+            return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('"', r'\"'))
+                                  for k, v in pairs) + '}'
+
+        lines = []
+        for kind, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+            for name in sorted({name for name, _ in metrics}):
+                lines.append(f'# TYPE {name} {kind}')
+                lines.extend(f'{name}{fmt(labels)} {v if v is not None else "NaN"}'
+                             for (n, labels), v in metrics.items() if n == name)
+        for name in sorted({name for name, _ in self.histograms}):
+            lines.append(f'# TYPE {name} histogram')
+            for (n, labels), h in self.histograms.items():
+                if n != name:
+                    continue
+                total = 0
+                for bound, count in zip(h.bounds, h.counts):
+                    total += count
+                    le = '+Inf' if bound == float('inf') else bound
+                    lines.append(f'{name}_bucket{fmt(labels, le=le)} {total}')
+                lines.append(f'{name}_sum{fmt(labels)} {h.sum}')
+                lines.append(f'{name}_count{fmt(labels)} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """
+        Writes a snapshot, replacing the file atomically.  Paths ending in .json get JSON, anything else Prometheus text
+        (e.g. for the node_exporter textfile collector).
+
+        Args:
+            path (str): The file to write.
+        """
+        text = json.dumps(self.snapshot(), indent=1) if path.endswith('.json') else self.to_prometheus()
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    async def report(self, sample=None, path=None, interval=30):
+        """
+        Takes a snapshot every `interval` seconds until cancelled, writing it to path and passing it to the hooks.
+
+        Args:
+            sample (callable, optional): Called before each snapshot to update gauges. Defaults to None.
+            path (str, optional): File to write each snapshot to. Defaults to None.
+            interval (float, optional): Seconds between snapshots. Defaults to 30.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            self.publish(sample, path)
+
+    def publish(self, sample=None, path=None):
+        """
+        Takes one snapshot, writing it to path and passing it to the hooks.
+
+        Args:
+            sample (callable, optional): Called first to update gauges. Defaults to None.
+            path (str, optional): File to write the snapshot to. Defaults to None.
+        """
+        if sample is not None:
+            sample()
+        if path is not None:
+            try:
+                self.write(path)
+            except OSError as e:
+                logging.warning(f'Could not write metrics to {path}: {e}')
+        if self.hooks:
+            self.emit('snapshot', **self.snapshot())
@@ -1,33 +1,153 @@
-
+import asyncio
+import atexit
+import functools
+import json
+from collections import namedtuple
 from .endpoints import USGSEndpoints
-import geopandas as gpd
-import pandas as pd
+import shapely
+from shapely.geometry import shape
+
+# geopandas and pandas are imported where DataFrames are built, so that importing the package for the JSON
+# results alone does not load them
+
+# Flattened flow statistic result fields kept for the statistics table
+_STATISTIC_FIELDS = ('name', 'code', 'value', 'units', 'equivalentYears', 'intervalBounds.lower', 'intervalBounds.upper')
+
+# NSS statistic groups computed when none are given: peak-flow statistics
+DEFAULT_STAT_GROUPS = ('2',)
+
+# The parts of a finished point that output tables are built from (see Point.results)
+PointResults = namedtuple('PointResults', ['id', 'members', 'unique_id_label', 'rcode', 'wshed_features',
+                                           'pt_features', 'characteristics', 'statistics'])
+
+# Client shared by points created without one (see default_client)
+_default_client = None
+
+
+def default_client():
+    """
+    Returns the API client shared by points created without one, creating it on first use.  Its session is
+    replaced whenever it is used from a new event loop, and released when the interpreter exits.
+
+    Returns:
+        USGSEndpoints: The shared client.
+    """
+    global _default_client
+    if _default_client is None:
+        _default_client = USGSEndpoints()
+        atexit.register(_default_client.discard_session)
+    return _default_client
+
+
+def _feature_rows(features, reduce=None):
+    """
+    Converts GeoJSON features to compact (properties, WKB geometry) pairs, optionally reducing each geometry first.
+    """
+    if reduce is None:
+        return [(f.get('properties') or {}, shape(f['geometry']).wkb) for f in features]
+    return [(f.get('properties') or {}, reduce(shape(f['geometry'])).wkb) for f in features]
+
+
+def _parse_watershed(body, decoder, keep_raw=False, payload=None):
+    """
+    Decodes a delineation response body and extracts it with _extract_watershed.  Defined at module level so it
+    can run in a worker process.
+    """
+    return _extract_watershed(decoder(body), keep_raw, payload)
+
+
+def _extract_watershed(wshed_json, keep_raw=False, payload=None):
+    """
+    Extracts the workspace ID, compact outlet and watershed features and, with keep_raw, the response itself.
+    The watershed geometry is rounded and simplified as set by the payload mode.
+    """
+    reduce = payload.reduce if payload is not None and payload.reduces_geometry else None
+    return (wshed_json["workspaceID"], _feature_rows(wshed_json["featurecollection"][0]["feature"]["features"]),
+            _feature_rows(wshed_json["featurecollection"][1]["feature"]["features"], reduce),
+            wshed_json if keep_raw else None)
+
+
+def _statistic_row(result, stat_group=None):
+    """
+    Flattens one flow statistic result to the fields kept for the statistics table, in their original order,
+    after the ID of the statistic group it belongs to.
+    """
+    row = {'statisticGroupID': stat_group}
+    for k, v in result.items():
+        if isinstance(v, dict):
+            row.update({f'{k}.{k2}': v2 for k2, v2 in v.items() if f'{k}.{k2}' in _STATISTIC_FIELDS})
+        elif k in _STATISTIC_FIELDS:
+            row[k] = v
+    return row
+
+
+def features_gdf(features):
+    """
+    Builds a GeoDataFrame from compact (properties, WKB geometry) pairs, laid out as
+    GeoDataFrame.from_features would lay out the original features.
+
+    Args:
+        features (list): (properties, WKB) pairs.
+
+    Returns:
+        geopandas.GeoDataFrame: Geometry column first, then the properties.
+    """
+    import geopandas as gpd
+    import pandas as pd
+    properties = [p for p, _ in features]
+    geometry = gpd.GeoSeries.from_wkb([g for _, g in features])
+    df = pd.DataFrame.from_records(properties, index=pd.RangeIndex(len(features)))
+    df.insert(0, 'geometry', geometry.values)
+    return gpd.GeoDataFrame(df, geometry='geometry')
+
 
 class Point:
     """
     Point represents a geographical point with associated watershed and hydrological data.
 
+    To keep memory low on large batches, each stage extracts only what later stages and the export need
+    (watershed and outlet geometry as WKB, the workspace ID, characteristic and statistic rows) and
+    releases the raw JSON responses.  Pass keep_raw=True to keep them.
+
     Attributes:
         rcode (str): The region code.
         id (str): The unique identifier for the point.
+        members (list): IDs of nearby input points that share this point's results (see utils.cluster_points).
         unique_id_label (str): The label for the unique identifier field.
         x (float): The x-coordinate (longitude) of the point.
         y (float): The y-coordinate (latitude) of the point.
         crs (str): The coordinate reference system.
-        api_client (USGSEndpoints): The API client for interacting with USGS endpoints.
+        api_client (USGSEndpoints): The API client for interacting with USGS endpoints.  May be shared by many points.
         attempts (int): The number of attempts made for API calls.
-        wshed_json (dict): The JSON data for the delineated watershed.
+        stage (int): Index of the next batch pipeline stage to run, so retries resume where they failed.
+        last_error (str): Description of the most recent failure.
+        failed (bool): Whether a batch run gave up on the point after running out of retries.
+        polls (int): The number of times incomplete basin characteristics have been re-polled in the current stage.
+        keep_raw (bool): Whether raw JSON responses are kept after they have been extracted.
+        payload (PayloadMode): How much of the delineation is requested and kept, or None for everything.
+        stat_groups (tuple): IDs of the NSS statistic groups to compute, e.g. ('2', '4') for peak and low flows.
         server_name (str): The name of the server handling the request.
-        reg_json (dict): The JSON data for the regression regions.
+        workspace_id (str): The StreamStats workspace ID of the delineated watershed.
+        wshed_features (list): (properties, WKB geometry) pairs for the watershed polygon(s).
+        pt_features (list): (properties, WKB geometry) pairs for the outlet point(s).
         reg_regions (str): The regression regions codes as a comma-separated string.
-        scenario_json (dict): The JSON data for the scenarios.
-        scenarios (dict): The scenarios data.
-        param_codes (str): The parameter codes as a comma-separated string.
-        basin_char_json (dict): The JSON data for the basin characteristics.
-        flow_stats (dict): The JSON data for the flow statistics.
+        scenarios (list): The scenario of each statistic group, kept until flow statistics are computed.
+        param_codes (str): The parameter codes needed by any of the scenarios, as a comma-separated string.
+        characteristics (list): Basin characteristic rows (code, description, unit, value).
+        statistics (list): Flow statistic rows.
+        wshed_json (dict): The JSON data for the delineated watershed (only with keep_raw).
+        basin_char_json (dict): The JSON data for the basin characteristics (only with keep_raw).
+        flow_stats (list): The JSON data for the flow statistics of every group (only with keep_raw).
     """
 
-    def __init__(self, rcode, x, y, crs, uid=None, field_name='Name'):
+    __slots__ = ('rcode', 'id', 'members', 'unique_id_label', 'x', 'y', 'crs', 'api_client', 'attempts', 'stage',
+                 'last_error', 'failed', 'polls', 'keep_raw', 'payload', 'stat_groups', 'server_name', 'workspace_id',
+                 'wshed_features', 'pt_features',
+                 'reg_regions', 'scenarios', 'param_codes', 'characteristics', 'statistics', 'wshed_json',
+                 'basin_char_json', 'flow_stats')
+
+    def __init__(self, rcode, x, y, crs, uid=None, field_name='Name', api_client=None, keep_raw=False, payload=None,
+                 stat_groups=None):
         """
         Initializes a Point object.
 
@@ -38,25 +158,43 @@ class Point:
             crs (str): The coordinate reference system.
             uid (str, optional): The unique identifier for the point. Defaults to None.
             field_name (str, optional): The label for the unique identifier field. Defaults to 'Name'.
+            api_client (USGSEndpoints, optional): A shared API client. Defaults to the client shared by every point
+                created without one (see default_client).
+            keep_raw (bool, optional): Whether to keep raw JSON responses after extracting them. Defaults to False.
+            payload (PayloadMode, optional): How much of the delineation to request and keep. Defaults to None
+                (everything).
+            stat_groups (iterable, optional): IDs of the NSS statistic groups to compute. Defaults to
+                DEFAULT_STAT_GROUPS (peak flows).
         """
         # User parameters
         self.rcode = rcode
         self.id = uid
+        self.members = ()
         self.unique_id_label = field_name
         self.x = x
         self.y = y
         self.crs = crs
-        self.api_client = USGSEndpoints()
+        self.api_client = api_client if api_client is not None else default_client()
         self.attempts = 0
+        self.stage = 0
+        self.last_error = None
+        self.failed = False
+        self.polls = 0
+        self.keep_raw = keep_raw
+        self.payload = payload
+        self.stat_groups = DEFAULT_STAT_GROUPS if stat_groups is None else tuple(str(g) for g in stat_groups)
 
         # Derived parameters
-        self.wshed_json = None
         self.server_name = None
-        self.reg_json = None
+        self.workspace_id = None
+        self.wshed_features = None
+        self.pt_features = None
         self.reg_regions = None
-        self.scenario_json = None
         self.scenarios = None
         self.param_codes = None
+        self.characteristics = None
+        self.statistics = None
+        self.wshed_json = None
         self.basin_char_json = None
         self.flow_stats = None
 
@@ -68,16 +206,72 @@ class Point:
             str: String representation of the Point.
         """
         return f"Point {self.id}: {self.x}, {self.y}"
-    
+
+    def results(self):
+        """
+        Returns the parts of the point that output tables are built from.  They pickle several times faster than the
+        point, so they are what is sent to worker processes converting finished points.
+
+        Returns:
+            PointResults: The point's IDs, region and extracted rows, accepted wherever utils.build_tables and the
+                writers take points.
+        """
+        return PointResults(self.id, self.members, self.unique_id_label, self.rcode, self.wshed_features,
+                            self.pt_features, self.characteristics, self.statistics)
+
+    def __getstate__(self):
+        """
+        Returns the point's state for pickling, e.g. to convert finished points in a worker process.  The API
+        client holds open connections and is left out.
+
+        Returns:
+            dict: The point's attributes, without api_client.
+        """
+        return {name: getattr(self, name) for name in self.__slots__ if name != 'api_client'}
+
+    def __setstate__(self, state):
+        """
+        Restores a pickled point.  Its api_client is None.
+
+        Args:
+            state (dict): The point's attributes, as returned by __getstate__.
+        """
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.api_client = None
+
     def set_server_name(self, server_name):
         """
-        Sets the server name for the API client.
+        Sets the server name used for this point's StreamStats requests.
 
         Args:
             server_name (str): The name of the server.
         """
-        self.api_client = USGSEndpoints(server_name)
+        self.server_name = server_name
     
+    @property
+    def wshed_geojson(self):
+        """
+        Returns the watershed geometry as GeoJSON text, written from the stored WKB.
+
+        Returns:
+            str: The geometry, or None before delineation.
+        """
+        if not self.wshed_features:
+            return None
+        return shapely.to_geojson(shapely.from_wkb(self.wshed_features[0][1]))
+
+    @property
+    def wshed_geom(self):
+        """
+        Returns the watershed GeoJSON geometry, rebuilt from the stored WKB.
+
+        Returns:
+            dict: The geometry, or None before delineation.
+        """
+        geojson = self.wshed_geojson
+        return None if geojson is None else json.loads(geojson)
+
     async def _delineate_watershed_async(self):
         """
         Asynchronously delineates the watershed for the point.
@@ -85,9 +279,29 @@ class Point:
         Returns:
             None
         """
-        self.wshed_json, delin_headers = await self.api_client.get_watershed(self.rcode, self.x, self.y, self.crs)
-        self.wshed_geom = self.wshed_json["featurecollection"][1]["feature"]["features"][0]["geometry"]
+        # Retries skip any cached delineation in case its server-side workspace has expired
+        include_parameters = self.payload is None or self.payload.include_parameters
+        body, delin_headers = await self.api_client.get_watershed(self.rcode, self.x, self.y, self.crs, self.server_name,
+                                                               refresh=self.attempts > 0, raw=True,
+                                                               include_parameters=include_parameters)
+        # Large watersheds are decoded and converted to WKB off the event loop
+        parsed = await self.api_client.decode(body, functools.partial(_parse_watershed, keep_raw=self.keep_raw,
+                                                                      payload=self.payload))
+        self.workspace_id, self.pt_features, self.wshed_features, self.wshed_json = parsed
         self.server_name = delin_headers['USGSWiM-HostName'].lower()
+
+    def _set_watershed(self, wshed_json):
+        """
+        Extracts the workspace ID and watershed/outlet features from a delineation response.
+
+        Args:
+            wshed_json (dict): The JSON response from the watershed endpoint.
+
+        Returns:
+            None
+        """
+        parsed = _extract_watershed(wshed_json, self.keep_raw, self.payload)
+        self.workspace_id, self.pt_features, self.wshed_features, self.wshed_json = parsed
     
     async def _get_regression_regions_async(self):
         """
@@ -96,22 +310,29 @@ class Point:
         Returns:
             None
         """
-        reg_json, _ = await self.api_client.get_regression_regions(self.wshed_geom)
+        reg_json, _ = await self.api_client.get_regression_regions(self.wshed_geojson)
         self.reg_regions = ', '.join([sub['code'] for sub in reg_json])
+        if self.payload is not None and self.payload.stats_only:
+            # Later stages only need the workspace, so the polygon is released as soon as possible
+            self.wshed_features = None
 
-    async def _get_scenarios_async(self, stat_group='2'):
+    async def _get_scenarios_async(self):
         """
-        Asynchronously retrieves the scenarios for the point.
-
-        Args:
-            stat_group (str, optional): The statistical group. Defaults to '2'.
+        Asynchronously retrieves the scenario of each of the point's statistic groups.  Scenario lookups depend
+        only on the region, group and regression regions, so they are shared by the points that have them in
+        common.
 
         Returns:
             None
         """
-        scenario_json, _ = await self.api_client.get_scenarios(self.rcode, stat_group, self.reg_regions)
-        self.scenarios = scenario_json[0]
-        self.param_codes = ','.join([sub['code'] for sub in scenario_json[0]["regressionRegions"][0]["parameters"]])
+        responses = await asyncio.gather(*[self.api_client.get_scenarios(self.rcode, group, self.reg_regions)
+                                           for group in self.stat_groups])
+        scenarios = [scenario_json[0] for scenario_json, _ in responses]
+        self.scenarios = scenarios
+        # One basin characteristics request covers the parameters of every group
+        codes = dict.fromkeys(sub['code'] for scenario in scenarios
+                              for sub in scenario["regressionRegions"][0]["parameters"])
+        self.param_codes = ','.join(codes)
 
     async def _get_basin_characteristics_async(self, all_params=False):
         """
@@ -127,49 +348,112 @@ class Point:
             param_codes = 'true'
         else:
             param_codes = self.param_codes
-        basin_char_json, _ = await self.api_client._get_basin_characteristics_async(self.rcode, self.wshed_json["workspaceID"], param_codes)
-        self.basin_char_json = basin_char_json
+        basin_char_json, _ = await self.api_client._get_basin_characteristics_async(self.rcode, self.workspace_id, param_codes, self.server_name)
+        self._set_basin_characteristics(basin_char_json)
+
+    def _set_basin_characteristics(self, basin_char_json):
+        """
+        Extracts the characteristic rows from a basin characteristics response.
+
+        Args:
+            basin_char_json (dict): The JSON response from the basin characteristics endpoint.
+
+        Returns:
+            None
+        """
+        self.characteristics = [{k: v for k, v in p.items() if k not in ('name', 'ID')} for p in basin_char_json['parameters']]
+        if self.keep_raw:
+            self.basin_char_json = basin_char_json
+
+    def _fill_scenario_parameters(self):
+        """
+        Copies basin characteristic values into the parameters of every scenario.
+
+        Returns:
+            None
+        """
+        for scenario in self.scenarios:
+            for ind, x in enumerate(scenario['regressionRegions'][0]['parameters']):
+                for p in self.characteristics:
+                    if x['code'].lower() == p['code'].lower():
+                        scenario['regressionRegions'][0]['parameters'][ind]['value'] = p['value']
+
+    async def _get_scenario_statistics_async(self, scenario):
+        """
+        Asynchronously retrieves the flow statistics of one scenario.
+
+        Args:
+            scenario (dict): One of the point's scenarios, with its parameter values filled.
+
+        Returns:
+            list: The JSON response from the flow statistics endpoint.
+        """
+        flow_stats, _ = await self.api_client.get_flow_statistics({'regions': self.rcode}, [scenario])
+        return flow_stats
 
     async def _get_flow_statistics_async(self):
         """
-        Asynchronously retrieves the flow statistics for the point.
+        Asynchronously retrieves the flow statistics for the point, with one request per statistic group.
+
+        Returns:
+            list: The results of every group, shaped like a flow statistics response.
+        """
+        self._fill_scenario_parameters()
+        responses = await asyncio.gather(*[self._get_scenario_statistics_async(s) for s in self.scenarios])
+        flow_stats = [scenario for response in responses for scenario in response]
+        self._set_flow_statistics(flow_stats)
+        return flow_stats
+
+    def _set_flow_statistics(self, flow_stats):
+        """
+        Extracts the statistic rows of every group from a flow statistics response and releases the scenarios.
+        Rows are labelled with the group that was requested, whatever ID the service echoes back.
+
+        Args:
+            flow_stats (list): The JSON response from the flow statistics endpoint, with a scenario per group in the
+                order of stat_groups.
 
         Returns:
             None
+
+        Raises:
+            ValueError: If there is not one scenario per statistic group.
         """
-        for ind, x in enumerate(self.scenarios['regressionRegions'][0]['parameters']):
-            for p in self.basin_char_json['parameters']:
-                if x['code'].lower() == p['code'].lower():
-                    self.scenarios['regressionRegions'][0]['parameters'][ind]['value'] = p['value']
-        post_body = [self.scenarios]
-        self.flow_stats, _ = await self.api_client.get_flow_statistics({'regions': self.rcode}, post_body)
+        if len(flow_stats) != len(self.stat_groups):
+            raise ValueError(f'Expected flow statistics for {len(self.stat_groups)} statistic groups, '
+                             f'got {len(flow_stats)}')
+        self.statistics = [_statistic_row(r, int(group) if group.isdigit() else group)
+                           for group, scenario in zip(self.stat_groups, flow_stats)
+                           for r in scenario['regressionRegions'][0]['results']]
+        if self.keep_raw:
+            self.flow_stats = flow_stats
+        else:
+            self.scenarios = None
 
     def wshed_gdf(self):
         """
-        Converts the watershed JSON data to a GeoDataFrame.
+        Converts the watershed data to a GeoDataFrame.
 
         Returns:
             geopandas.GeoDataFrame: The GeoDataFrame containing the watershed data.
         """
-        try:
-            gdf = gpd.GeoDataFrame.from_features(self.wshed_json['featurecollection'][1]['feature']['features'])
-        except (KeyError, IndexError, TypeError):
+        if self.wshed_features is None:
             return None
+        gdf = features_gdf(self.wshed_features)
         gdf[self.unique_id_label] = self.id
         gdf = gdf.set_index(self.unique_id_label)
         return gdf
     
     def pt_gdf(self):
         """
-        Converts the outlet point JSON data to a GeoDataFrame.
+        Converts the outlet point data to a GeoDataFrame.
 
         Returns:
             geopandas.GeoDataFrame: The GeoDataFrame containing the outlet point data.
         """
-        try:
-            gdf = gpd.GeoDataFrame.from_features(self.wshed_json['featurecollection'][0]['feature']['features'])
-        except (KeyError, IndexError, TypeError):
+        if self.pt_features is None:
             return None
+        gdf = features_gdf(self.pt_features)
         gdf = gdf.drop(columns=['FID'])
         gdf[self.unique_id_label] = self.id
         gdf = gdf.set_index(self.unique_id_label)
@@ -177,16 +461,15 @@ class Point:
     
     def characteristics_df(self):
         """
-        Converts the basin characteristics JSON data to a DataFrame.
+        Converts the basin characteristics data to a DataFrame.
 
         Returns:
             pandas.DataFrame: The DataFrame containing the basin characteristics data.
         """
-        try:
-            df = pd.json_normalize(self.basin_char_json['parameters'])
-        except (KeyError, IndexError, TypeError):
+        if self.characteristics is None:
             return None
-        df = df.drop(columns=['name', 'ID'])
+        import pandas as pd
+        df = pd.DataFrame.from_records(self.characteristics)
         df = df.rename(columns={'description': 'StatName', 'code': 'StatLabel', 'value': 'Value', 'units': 'Units'})
         df[self.unique_id_label] = self.id
         df = df.set_index(self.unique_id_label)
@@ -194,19 +477,17 @@ class Point:
     
     def statistics_df(self):
         """
-        Converts the flow statistics JSON data to a DataFrame.
+        Converts the flow statistics data to a DataFrame.
 
         Returns:
             pandas.DataFrame: The DataFrame containing the flow statistics data.
         """
-        try:
-            df = pd.json_normalize(self.flow_stats[0]['regressionRegions'][0]['results'])
-        except (KeyError, IndexError, TypeError):
+        if self.statistics is None:
             return None
-        df = df.drop(columns=['id'])
-        rename_dict = {'name': 'StatName', 'code': 'StatLabel', 'value': 'Value', 'units': 'Units', 'equivalentYears': 'Years', 'intervalBounds.lower': 'Pll', 'intervalBounds.upper': 'Plu'}
+        import pandas as pd
+        df = pd.DataFrame.from_records(self.statistics)
+        rename_dict = {'statisticGroupID': 'StatGroup', 'name': 'StatName', 'code': 'StatLabel', 'value': 'Value', 'units': 'Units', 'equivalentYears': 'Years', 'intervalBounds.lower': 'Pll', 'intervalBounds.upper': 'Plu'}
         df = df.rename(columns=rename_dict)
-        df = df.drop(columns=[c for c in df.columns if c not in list(rename_dict.values())])
         df[self.unique_id_label] = self.id
         df = df.set_index(self.unique_id_label)
-        return df
\ No newline at end of file
+        return df
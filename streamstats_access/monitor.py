@@ -0,0 +1,46 @@
+"""
+Monitor Module
+
+This module contains the LoopMonitor class, which measures how long the event loop is blocked by
+synchronous work such as decoding large responses.
+"""
+
+import asyncio
+
+
+class LoopMonitor:
+    """
+    LoopMonitor wakes up every `interval` seconds and records how late each wake-up was.  Lateness beyond
+    `threshold` means the loop was blocked and every in-flight request was stalled for that long.
+
+    Attributes:
+        interval (float): Seconds between wake-ups.
+        threshold (float): Lateness in seconds counted as a stall.
+        stats (dict): 'stalls' (count), 'total' (seconds stalled) and 'max' (longest stall in seconds).
+    """
+
+    def __init__(self, interval=0.05, threshold=0.05):
+        """
+        Initializes the monitor.
+
+        Args:
+            interval (float, optional): Seconds between wake-ups. Defaults to 0.05.
+            threshold (float, optional): Lateness in seconds counted as a stall. Defaults to 0.05.
+        """
+        self.interval = interval
+        self.threshold = threshold
+        self.stats = {'stalls': 0, 'total': 0.0, 'max': 0.0}
+
+    async def run(self):
+        """
+        Measures wake-up lateness until cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - start - self.interval
+            if lag > self.threshold:
+                self.stats['stalls'] += 1
+                self.stats['total'] += lag
+            self.stats['max'] = max(self.stats['max'], lag)
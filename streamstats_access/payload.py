@@ -0,0 +1,97 @@
+"""
+Payload Module
+
+This module contains the PayloadMode class, which selects how much of each delineation a run requests, keeps in
+memory, sends back to the services and exports.
+"""
+
+import numpy as np
+import shapely
+
+
+class PayloadMode:
+    """
+    PayloadMode trims the data a run moves around when not all of it is needed.
+
+    - Stats only: the watershed polygon is kept only until its regression regions have been looked up, and the
+      export has no globalwatershed layer; one written to the same output by an earlier run is removed, unless
+      resuming.  The outlet point is still exported.
+    - Geometry: the watershed polygon is rounded to a number of decimal places and/or simplified as soon as it is
+      delineated, so the smaller polygon is what is re-posted for regression regions, kept and exported.
+    - Parameters: delineations are requested without includeparameters.  The basin characteristics stage fetches
+      the parameters the regression equations need anyway; the globalwatershed layer then has no characteristic
+      columns.
+
+    Attributes:
+        stats_only (bool): Whether the watershed polygon is dropped after the regression region lookup.
+        precision (int): Decimal places watershed coordinates are rounded to, or None.
+        simplify (float): Simplification tolerance in the units of the delineation's coordinates (degrees for
+            EPSG:4326), or None.
+        include_parameters (bool): Whether delineations are requested with basin characteristics.
+    """
+
+    def __init__(self, stats_only=False, precision=None, simplify=None, include_parameters=True):
+        """
+        Initializes the mode.  The defaults request, keep and export everything.
+
+        Args:
+            stats_only (bool, optional): Drop the watershed polygon once regression regions have been looked up.
+                Defaults to False.
+            precision (int, optional): Decimal places to round watershed coordinates to. Defaults to None.
+            simplify (float, optional): Topology-preserving simplification tolerance for the watershed polygon, in
+                the units of its coordinates. Defaults to None.
+            include_parameters (bool, optional): Request basin characteristics with each delineation. Defaults to
+                True.
+        """
+        self.stats_only = stats_only
+        self.precision = precision
+        self.simplify = simplify
+        self.include_parameters = include_parameters
+
+    @classmethod
+    def from_options(cls, options):
+        """
+        Builds a mode from a PayloadMode, a dict of its arguments, or None.
+
+        Args:
+            options (PayloadMode, dict or None): The mode or its arguments.
+
+        Returns:
+            PayloadMode: The mode, or None for the defaults.
+        """
+        if options is None or isinstance(options, cls):
+            return options
+        return cls(**options)
+
+    @property
+    def reduces_geometry(self):
+        """
+        Returns whether watershed polygons are rounded or simplified.
+
+        Returns:
+            bool: True if precision or simplify is set.
+        """
+        return self.precision is not None or self.simplify is not None
+
+    def reduce(self, geometry):
+        """
+        Simplifies and rounds a watershed geometry.
+
+        Args:
+            geometry (shapely.Geometry): The geometry.
+
+        Returns:
+            shapely.Geometry: The reduced geometry.
+        """
+        if self.simplify:
+            geometry = shapely.simplify(geometry, self.simplify, preserve_topology=True)
+        if self.precision is not None:
+            # Rounding rather than shapely.set_precision, which fails on the slightly invalid polygons delineations
+            # sometimes return; vertices that round to the same place are merged
+            geometry = shapely.transform(geometry, lambda coords: np.round(coords, self.precision))
+            geometry = shapely.remove_repeated_points(geometry)
+        return geometry
+
+    def __repr__(self):
+        return (f'PayloadMode(stats_only={self.stats_only}, precision={self.precision}, simplify={self.simplify}, '
+                f'include_parameters={self.include_parameters})')
@@ -0,0 +1,156 @@
+"""
+Pool Module
+
+This module contains the ServerPool class, which spreads delineation requests over a pool of StreamStats
+servers according to their observed health and ejects servers that keep failing.
+"""
+
+import logging
+import random
+import time
+from .config import config
+
+
+class _Host:
+    """
+    Health statistics and circuit breaker state for one server.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.requests = 0
+        self.failures = 0
+        self.latency = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.trips = 0
+        self.open_until = None
+        self.probe_started = None
+
+
+class ServerPool:
+    """
+    ServerPool chooses a StreamStats server for each new delineation.
+
+    Servers are picked at random, weighted by (1 - error rate)^2 / latency using exponentially smoothed
+    latency and error rate, so slower or failing servers receive proportionally less work.  A circuit breaker
+    ejects a server after `failure_threshold` consecutive failures.  Once its cooldown has passed a single probe
+    request is sent to it: success re-admits the server, failure ejects it again with twice the cooldown (up
+    to `max_cooldown`).  If every server is ejected, the one due back soonest is used.
+
+    Attributes:
+        hosts (dict): Per-server statistics keyed by server name.
+        failure_threshold (int): Consecutive failures that eject a server.
+        cooldown (float): Seconds an ejected server waits before its first probe.
+        max_cooldown (float): Longest wait before a probe, in seconds.
+        smoothing (float): Weight of the newest sample in the latency and error rate averages.
+    """
+
+    def __init__(self, servers=None, failure_threshold=None, cooldown=None, max_cooldown=None, smoothing=None):
+        """
+        Initializes the pool.
+
+        Args:
+            servers (list, optional): Server names, e.g. ['prodweba', 'prodwebb']. Defaults to the servers in the
+                ServerPool section of config.json.
+            failure_threshold (int, optional): Consecutive failures that eject a server.
+            cooldown (float, optional): Seconds an ejected server waits before its first probe.
+            max_cooldown (float, optional): Longest wait before a probe, in seconds.
+            smoothing (float, optional): Weight of the newest sample in the averages.
+
+        Unset options default to the ServerPool section of config.json.
+        """
+        settings = config['ServerPool']
+        self.hosts = {name: _Host(name) for name in (servers or settings['servers'])}
+        self.failure_threshold = failure_threshold or settings['failure_threshold']
+        self.cooldown = cooldown or settings['cooldown']
+        self.max_cooldown = max_cooldown or settings['max_cooldown']
+        self.smoothing = smoothing or settings['smoothing']
+
+    def _probe_due(self, host, now):
+        # Half-open: one probe at a time once the cooldown has passed, retried if it never reports back
+        return (host.open_until is not None and now >= host.open_until
+                and (host.probe_started is None or now - host.probe_started > self.cooldown))
+
+    def _weight(self, host, baseline):
+        latency = host.latency if host.latency is not None else baseline
+        return (1.0 - host.error_rate) ** 2 / max(latency, 1e-3) + 1e-9
+
+    def choose(self):
+        """
+        Picks a server for a new delineation.
+
+        Returns:
+            str: The server name.
+        """
+        now = time.monotonic()
+        for h in self.hosts.values():
+            if self._probe_due(h, now):
+                h.probe_started = now
+                return h.name
+        hosts = [h for h in self.hosts.values() if h.open_until is None]
+        if not hosts:
+            return min(self.hosts.values(), key=lambda h: h.open_until).name
+        # Servers with no samples yet are treated as being as fast as the fastest one seen
+        observed = [h.latency for h in hosts if h.latency is not None]
+        baseline = min(observed) if observed else 1.0
+        weights = [self._weight(h, baseline) for h in hosts]
+        return random.choices(hosts, weights)[0].name
+
+    def record(self, server, latency, ok):
+        """
+        Records the outcome of a request to a server.
+
+        Args:
+            server (str): The server name.  Servers outside the pool are ignored.
+            latency (float): Seconds the request took.
+            ok (bool): Whether the server handled the request.  Errors caused by the request itself (4xx) should
+                be recorded as ok.
+        """
+        host = self.hosts.get(server)
+        if host is None:
+            return
+        host.requests += 1
+        a = self.smoothing
+        host.error_rate = (1 - a) * host.error_rate + a * (0.0 if ok else 1.0)
+        now = time.monotonic()
+        # Requests that were already in flight when a server was ejected do not change its breaker
+        cooling_down = host.open_until is not None and now < host.open_until
+        if ok:
+            host.latency = latency if host.latency is None else (1 - a) * host.latency + a * latency
+            host.consecutive_failures = 0
+            if host.open_until is not None and not cooling_down:
+                logging.info(f'{server}: probe succeeded, re-admitting server')
+                host.open_until = host.probe_started = None
+                host.trips = 0
+            return
+
+        host.failures += 1
+        host.consecutive_failures += 1
+        if cooling_down:
+            return
+        probing = host.open_until is not None
+        if probing or host.consecutive_failures >= self.failure_threshold:
+            cooldown = min(self.max_cooldown, self.cooldown * 2 ** host.trips)
+            host.trips += 1
+            host.ejections += 1
+            host.open_until = now + cooldown
+            host.probe_started = None
+            reason = 'probe failed' if probing else f'{host.consecutive_failures} consecutive failures'
+            logging.warning(f'{server}: {reason}, ejecting server for {cooldown:g}s')
+
+    def summary(self):
+        """
+        Describes each server's statistics.
+
+        Returns:
+            list: One line per server.
+        """
+        lines = []
+        for h in self.hosts.values():
+            latency = 'n/a' if h.latency is None else f'{h.latency:.2f}s'
+            state = 'ejected' if h.open_until is not None else 'healthy'
+            lines.append(f'{h.name}: {h.requests} requests | {h.failures} failures | smoothed latency {latency} | '
+                         f'{h.ejections} ejections | {state}')
+        return lines
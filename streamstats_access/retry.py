@@ -0,0 +1,66 @@
+"""
+Retry Module
+
+This module classifies request failures and computes jittered exponential backoff delays for
+retrying them.
+"""
+
+import asyncio
+import json
+import random
+import aiohttp
+from .config import config
+
+
+def classify_error(error):
+    """
+    Sorts an exception raised by a request into a retry class.
+
+    Args:
+        error (Exception): The exception raised.
+
+    Returns:
+        str: One of 'timeout', 'rate_limited', 'server_error', 'client_error', 'decode' or 'other'.
+    """
+    if isinstance(error, (asyncio.TimeoutError, aiohttp.ServerTimeoutError)):
+        return 'timeout'
+    if isinstance(error, aiohttp.ContentTypeError):
+        return 'decode'
+    if isinstance(error, aiohttp.ClientResponseError):
+        if error.status == 429:
+            return 'rate_limited'
+        if error.status >= 500:
+            return 'server_error'
+        return 'client_error'
+    if isinstance(error, json.JSONDecodeError):
+        return 'decode'
+    return 'other'
+
+
+def retry_delay(error, attempt, settings=None):
+    """
+    Computes how long to wait before retrying a failed request.
+
+    The delay grows as base * 2 ** (attempt - 1), capped at max_delay, with "equal jitter": half of
+    the delay is fixed and the other half is random so that retries from many points spread out.  A
+    Retry-After header on a 429 response is honored if it asks for longer.
+
+    Args:
+        error (Exception): The exception raised.
+        attempt (int): The number of failed attempts so far (1 for the first failure).
+        settings (dict, optional): Backoff settings with 'base' (seconds per error class) and 'max_delay'.
+            Defaults to the RetrySettings section of config.json.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    settings = settings or config['RetrySettings']
+    error_class = classify_error(error)
+    delay = min(settings['max_delay'], settings['base'][error_class] * 2 ** (attempt - 1))
+    delay = delay / 2 + random.uniform(0, delay / 2)
+    if error_class == 'rate_limited' and error.headers is not None:
+        try:
+            delay = max(delay, float(error.headers.get('Retry-After', 0)))
+        except ValueError:
+            pass
+    return delay
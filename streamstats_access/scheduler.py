@@ -0,0 +1,82 @@
+"""
+Scheduler Module
+
+This module contains the PollScheduler class, which holds points whose basin characteristics are
+still being computed server-side and returns them to the pipeline when their next poll is due.
+"""
+
+import asyncio
+import heapq
+
+
+class PollScheduler:
+    """
+    PollScheduler is a timer heap of points waiting to re-poll basin characteristics.  Deferring a point
+    frees the worker that fetched the incomplete result, and the point is put back on `queue` once its
+    delay has passed.
+
+    Attributes:
+        queue (asyncio.Queue): The queue points are returned to when due.
+        schedule (list): Delays in seconds before each successive re-poll.  Its length is the poll limit.
+    """
+
+    def __init__(self, queue, schedule=(3, 9, 27, 81)):
+        """
+        Initializes the scheduler.
+
+        Args:
+            queue (asyncio.Queue): The queue points are returned to when due.
+            schedule (iterable, optional): Delays in seconds before each successive re-poll. Defaults to
+                (3, 9, 27, 81).
+        """
+        self.queue = queue
+        self.schedule = list(schedule)
+        self._heap = []
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+
+    @property
+    def pending(self):
+        """
+        Returns the number of points waiting for their next poll.
+
+        Returns:
+            int: Points in the heap.
+        """
+        return len(self._heap)
+
+    def defer(self, pt):
+        """
+        Schedules the next poll for a point.
+
+        Args:
+            pt (Point): The point with incomplete basin characteristics.
+
+        Returns:
+            bool: False if the point has used up its poll schedule, otherwise True.
+        """
+        if pt.polls >= len(self.schedule):
+            return False
+        due = asyncio.get_running_loop().time() + self.schedule[pt.polls]
+        pt.polls += 1
+        heapq.heappush(self._heap, (due, self._seq, pt))
+        self._seq += 1
+        self._wakeup.set()
+        return True
+
+    async def run(self):
+        """
+        Moves points back onto the queue as their polls come due.  Runs until cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            now = loop.time()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, pt = heapq.heappop(self._heap)
+                self.queue.put_nowait(pt)
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,32 @@
+"""
+Stages Module
+
+This module contains the ordered stages that take a point from delineation to flow statistics.  They are shared
+by the batch pipeline and the synchronous client.
+"""
+
+
+async def _get_basin_characteristics(pt):
+    """
+    Fetches basin characteristics for a point.
+
+    Args:
+        pt (Point): The point to query.
+
+    Returns:
+        bool: Whether every parameter has a value.  If not, the server is still computing them and the
+            point should be polled again later.
+    """
+    await pt._get_basin_characteristics_async()
+    return all(['value' in j for j in pt.characteristics])
+
+
+# Ordered pipeline stages: (name, coroutine function run on a point).  A stage returning False is not
+# finished yet and the point should be polled again later.
+STAGES = [
+    ('delineation', lambda pt: pt._delineate_watershed_async()),
+    ('regression_regions', lambda pt: pt._get_regression_regions_async()),
+    ('scenarios', lambda pt: pt._get_scenarios_async()),
+    ('basin_characteristics', _get_basin_characteristics),
+    ('flow_statistics', lambda pt: pt._get_flow_statistics_async()),
+]
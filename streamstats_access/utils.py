@@ -1,78 +1,412 @@
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 import sqlite3
-from .models import Point
+from .models import DEFAULT_STAT_GROUPS, Point, features_gdf
 import logging
+import os
 
 
-def load_datasource(in_path, rcode, unique_field):
+def load_regions(rcode):
     """
-    Exports data from the output queue to a GeoPackage file.
+    Opens a region polygon layer given as a file path, and brings region polygons to geographic coordinates.
 
     Args:
-        out_path (str): The path to the output GeoPackage file.
-        out_q (queue.Queue): The output queue containing the data to export.
+        rcode (str or geopandas.GeoDataFrame): A region code, input column name, region layer path or region layer.
 
     Returns:
-        None
+        str or geopandas.GeoDataFrame: rcode unchanged, or the region polygons in EPSG:4326.
+    """
+    if isinstance(rcode, (str, os.PathLike)) and os.path.isfile(rcode):
+        rcode = gpd.read_file(rcode)
+    if isinstance(rcode, gpd.GeoDataFrame):
+        rcode = rcode.to_crs(epsg=4326)
+    return rcode
+
+def _assign_regions(in_file, rcode, region_field='rcode'):
+    """
+    Finds the region code of every input feature.
+
+    Args:
+        in_file (geopandas.GeoDataFrame): The input features, with a unique index.
+        rcode (str or geopandas.GeoDataFrame): A region code for every feature, the name of a column holding each
+            feature's code, or region polygons (in the CRS of in_file) to spatially join the features to.
+        region_field (str, optional): The column of the region polygons holding their codes. Defaults to 'rcode'.
+
+    Returns:
+        pandas.Series: The region code of each feature, or NaN where a feature is in no region.
+    """
+    if isinstance(rcode, gpd.GeoDataFrame):
+        joined = gpd.sjoin(in_file[['geometry']], rcode[[region_field, 'geometry']], how='left', predicate='intersects')
+        # Features on a shared boundary take the first region
+        joined = joined[~joined.index.duplicated(keep='first')]
+        return joined[region_field]
+    if rcode in in_file.columns:
+        return in_file[rcode]
+    return pd.Series(rcode, index=in_file.index)
+
+def _to_points(in_file, rcode, unique_field, api_client=None, seen=None, region_field='rcode'):
+    """
+    Converts a GeoDataFrame of point geometries to Point objects.
+
+    Coordinates are pulled out in one vectorized step.  Multipart geometries are exploded and only the first
+    occurrence of each ID is kept.  Features that fall in no region are skipped.
+
+    Args:
+        in_file (geopandas.GeoDataFrame): The input features.
+        rcode (str or geopandas.GeoDataFrame): The region code, the name of a column holding each feature's
+            region code, or region polygons in EPSG:4326 (see load_regions).
+        unique_field (str): The field containing unique identifiers for each point.
+        api_client (USGSEndpoints, optional): A client shared by every Point. Defaults to None.
+        seen (set, optional): IDs already loaded, e.g. from earlier chunks.  Updated in place. Defaults to None.
+        region_field (str, optional): The column of the region polygons holding their codes. Defaults to 'rcode'.
+
+    Returns:
+        list: A list of Point objects.
     """
-    logging.info('Importing data')
-    in_file = gpd.read_file(in_path)
     in_file = in_file.to_crs(epsg=4326)
     crs = in_file.crs.srs.split(':')[1]
     in_file = in_file.set_index(unique_field)
     in_file = in_file.explode(index_parts=False)
-    in_file = in_file[~in_file.index.duplicated(keep='first')]
-    point_list = [Point(rcode, in_file.loc[i].geometry.x, in_file.loc[i].geometry.y, crs, i, unique_field) for i in in_file.index]
-    return point_list
+    keep = ~in_file.index.duplicated(keep='first')
+    if seen is not None:
+        keep &= ~np.fromiter((i in seen for i in in_file.index), dtype=bool, count=len(in_file))
+        seen.update(in_file.index[keep])
+    in_file = in_file[keep]
+    codes = _assign_regions(in_file, rcode, region_field)
+    if codes.isna().any():
+        logging.warning(f'Skipping {codes.isna().sum()} points outside every region')
+        in_file = in_file[codes.notna()]
+        codes = codes[codes.notna()]
+    xs = in_file.geometry.x.to_numpy()
+    ys = in_file.geometry.y.to_numpy()
+    return [Point(str(code), x, y, crs, i, unique_field, api_client)
+            for i, code, x, y in zip(in_file.index, codes, xs, ys)]
 
-def export_data(out_path, out_q):
+def cluster_points(points, tolerance):
     """
-    Exports data from the output queue to a GeoPackage file.
+    Groups points lying within a tolerance of each other so that each group is only queried once.
+
+    Points are projected to the UTM zone of the group and hashed into a grid of tolerance-sized cells.  In input
+    order, each point joins the first representative within tolerance in its own or a neighbouring cell, or else
+    becomes a representative itself.  Joining points are added to the representative's members and receive its
+    results under their own IDs in the output.  Points in different regions are never grouped.
 
     Args:
-        out_path (str): The path to the output GeoPackage file.
-        out_q (queue.Queue): The output queue containing the data to export.
+        points (list): Point objects in geographic coordinates.
+        tolerance (float): The clustering distance in meters.
 
     Returns:
-        None
+        list: The representative points.
     """
-    logging.info('Exporting data')
-    # convert q to list
-    q = list()
-    while not out_q.empty():
-        q.append(out_q.get_nowait())
+    if not tolerance or len(points) < 2:
+        return points
+    geoms = gpd.GeoSeries.from_xy([pt.x for pt in points], [pt.y for pt in points], crs=f'EPSG:{points[0].crs}')
+    geoms = geoms.to_crs(geoms.estimate_utm_crs())
+    xs = geoms.x.tolist()
+    ys = geoms.y.tolist()
+    cells = {}
+    representatives = []
+    for i, pt in enumerate(points):
+        cx, cy = int(xs[i] // tolerance), int(ys[i] // tolerance)
+        near = (j for dx in (-1, 0, 1) for dy in (-1, 0, 1) for j in cells.get((pt.rcode, cx + dx, cy + dy), ())
+                if (xs[i] - xs[j]) ** 2 + (ys[i] - ys[j]) ** 2 <= tolerance ** 2)
+        j = next(near, None)
+        if j is None:
+            cells.setdefault((pt.rcode, cx, cy), []).append(i)
+            representatives.append(pt)
+        else:
+            rep = points[j]
+            if not rep.members:
+                rep.members = []
+            rep.members.append(pt.id)
+    return representatives
+
+def _read_chunks(in_path, chunk_size, bbox=None):
+    """
+    Reads a geospatial file chunk_size features at a time.  With pyarrow installed, the file is opened once and its
+    features streamed in record batches.  Without it, each chunk is a read of its own that skips the features already
+    read, which for most formats means stepping over them again.
+    """
+    try:
+        import pyarrow  # noqa: F401 (open_arrow needs it to return batches)
+        from pyogrio import open_arrow
+    except ImportError:
+        open_arrow = None
+
+    if open_arrow is None:
+        start = 0
+        while True:
+            chunk = gpd.read_file(in_path, bbox=bbox, rows=slice(start, start + chunk_size))
+            if len(chunk):
+                yield chunk
+            if len(chunk) < chunk_size:
+                return
+            start += chunk_size
+
+    with open_arrow(in_path, bbox=bbox, batch_size=chunk_size, use_pyarrow=True) as (meta, reader):
+        geometry_name = meta['geometry_name'] or 'wkb_geometry'
+        for batch in reader:
+            if batch.num_rows == 0:
+                continue
+            df = batch.to_pandas()
+            geometry = gpd.GeoSeries.from_wkb(df.pop(geometry_name), crs=meta['crs'])
+            yield gpd.GeoDataFrame(df, geometry=geometry.values, crs=meta['crs'])
+
+def iter_datasource(in_path, rcode, unique_field, api_client=None, chunk_size=None, bbox=None, region_field='rcode'):
+    """
+    Loads points from a geospatial file in chunks of rows, so processing can start before the whole file is read.
+    The file is read in one pass (see _read_chunks).
+
+    Args:
+        in_path (str): The path to the input geospatial file.
+        rcode (str or geopandas.GeoDataFrame): The region code, the name of an input column holding each point's
+            region code, or a region polygon layer (GeoDataFrame or file path) to assign points to regions.
+        unique_field (str): The field containing unique identifiers for each point.
+        api_client (USGSEndpoints, optional): A client shared by every Point. Defaults to None.
+        chunk_size (int, optional): The number of rows read at a time.  None reads the whole file at once.
+            Defaults to None.
+        bbox (tuple, optional): Only read features intersecting (minx, miny, maxx, maxy), in the CRS of the file.
+            Defaults to None.
+        region_field (str, optional): The column of the region layer holding region codes. Defaults to 'rcode'.
+
+    Yields:
+        list: A list of Point objects per chunk.  IDs seen in earlier chunks are skipped.
+    """
+    rcode = load_regions(rcode)
+    seen = set()
+    if chunk_size is None:
+        chunks = [gpd.read_file(in_path, bbox=bbox)]
+    else:
+        chunks = _read_chunks(in_path, chunk_size, bbox)
+    for in_file in chunks:
+        if len(in_file):
+            yield _to_points(in_file, rcode, unique_field, api_client, seen, region_field)
+
+def iter_points(points, rcode=None, unique_field=None, api_client=None, chunk_size=None, bbox=None, region_field='rcode'):
+    """
+    Loads points in chunks from a geospatial file, an in-memory GeoDataFrame or an iterable of Point objects.
+
+    Args:
+        points (str, geopandas.GeoDataFrame or iterable): A path to a geospatial file, a GeoDataFrame of points, or
+            Point objects.
+        rcode (str or geopandas.GeoDataFrame, optional): The region code, the name of an input column holding each
+            point's region code, or a region polygon layer.  Required unless points are Point objects.
+        unique_field (str, optional): The field containing unique identifiers for each point.  Required unless
+            points are Point objects.
+        api_client (USGSEndpoints, optional): A client shared by every Point, including Point objects passed in.
+            Defaults to None.
+        chunk_size (int, optional): The number of points per chunk.  None yields everything as one chunk.
+            Defaults to None.
+        bbox (tuple, optional): Only load features intersecting (minx, miny, maxx, maxy), in the CRS of the file or
+            GeoDataFrame.  Ignored for Point objects. Defaults to None.
+        region_field (str, optional): The column of the region layer holding region codes. Defaults to 'rcode'.
+
+    Yields:
+        list: A list of Point objects per chunk.
+    """
+    if isinstance(points, (str, os.PathLike)):
+        yield from iter_datasource(points, rcode, unique_field, api_client, chunk_size, bbox, region_field)
+        return
+
+    if isinstance(points, gpd.GeoDataFrame):
+        if bbox is not None:
+            points = points.cx[bbox[0]:bbox[2], bbox[1]:bbox[3]]
+        rcode = load_regions(rcode)
+        seen = set()
+        step = chunk_size or max(len(points), 1)
+        for start in range(0, len(points), step):
+            yield _to_points(points.iloc[start:start + step], rcode, unique_field, api_client, seen, region_field)
+        return
+
+    chunk = []
+    for pt in points:
+        if api_client is not None:
+            pt.api_client = api_client
+        chunk.append(pt)
+        if chunk_size and len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def load_datasource(in_path, rcode, unique_field, api_client=None, region_field='rcode'):
+    """
+    Loads points from a geospatial file.
+
+    Args:
+        in_path (str): The path to the input geospatial file.
+        rcode (str or geopandas.GeoDataFrame): The region code, the name of an input column holding each point's
+            region code, or a region polygon layer (GeoDataFrame or file path) to assign points to regions.
+        unique_field (str): The field containing unique identifiers for each point.
+        api_client (USGSEndpoints, optional): A client shared by every Point. Defaults to None.
+        region_field (str, optional): The column of the region layer holding region codes. Defaults to 'rcode'.
+
+    Returns:
+        list: A list of Point objects.
+    """
+    logging.info('Importing data')
+    in_file = gpd.read_file(in_path)
+    return _to_points(in_file, load_regions(rcode), unique_field, api_client, region_field=region_field)
+
+def _collect(points, get_records):
+    """
+    Gathers records from every point into one list, alongside a matching list of point IDs.
+
+    Args:
+        points (list): Processed Point objects.
+        get_records (callable): Returns a point's list of records, or None if the point has none.
+
+    Returns:
+        tuple: The records and their point IDs.
+    """
+    records, ids = [], []
+    for pt in points:
+        rows = get_records(pt)
+        if rows is None:
+            continue
+        # Points clustered with this one share its results
+        for uid in (pt.id, *pt.members):
+            records.extend(rows)
+            ids.extend([uid] * len(rows))
+    return records, ids
+
+def build_tables(points):
+    """
+    Combines the results of a list of points into the four output tables.
+
+    Fields are collected column-wise from every point's extracted rows and each table is built with a single
+    constructor call, rather than building a frame per point and concatenating them.  The layers and
+    columns match those produced by the per-point Point.wshed_gdf/pt_gdf/characteristics_df/statistics_df.
+
+    Args:
+        points (list): Processed Point objects.
+
+    Returns:
+        dict: Output layer names mapped to (Geo)DataFrames.  Layers with no rows are omitted.
+    """
+    tables = dict()
+    if not points:
+        return tables
+    unique_field = points[0].unique_id_label
 
     # put all watersheds into a geodataframe
     keep_fields = set()
-    for i in q:
-        if i.basin_char_json is not None:
-            keep_fields.update([j['code'] for j in i.basin_char_json['parameters']])
+    for i in points:
+        if i.characteristics is not None:
+            keep_fields.update([j['code'] for j in i.characteristics])
     keep_fields = list(keep_fields)
     keep_fields.extend(['OBJECTID', 'WarningMsg', 'HUCID', 'Edited', 'geometry'])
-    wshed = [i.wshed_gdf() for i in q]
-    wshed = gpd.GeoDataFrame(pd.concat(wshed, ignore_index=False))
-    wshed = wshed[keep_fields]
-    
+    features, ids = _collect(points, lambda pt: pt.wshed_features)
+    if features:
+        wshed = features_gdf(features)
+        wshed.index = pd.Index(ids, name=unique_field)
+        tables['globalwatershed'] = wshed[[c for c in keep_fields if c in wshed.columns]]
+
     # put all outlet points into a geodataframe
-    pts = [i.pt_gdf() for i in q]
-    pts = gpd.GeoDataFrame(pd.concat(pts, ignore_index=False))
+    features, ids = _collect(points, lambda pt: pt.pt_features)
+    if features:
+        pts = features_gdf(features)
+        pts = pts.drop(columns=['FID'], errors='ignore')
+        pts.index = pd.Index(ids, name=unique_field)
+        tables['globalwatershedpoint'] = pts
 
     # put all characteristics into a dataframe
-    characteristics = [i.characteristics_df() for i in q]
-    characteristics = pd.concat(characteristics, ignore_index=False)
-    characteristics = gpd.GeoDataFrame(characteristics)
+    records, ids = _collect(points, lambda pt: pt.characteristics)
+    if records:
+        df = pd.DataFrame.from_records(records)
+        df = df.rename(columns={'description': 'StatName', 'code': 'StatLabel', 'value': 'Value', 'units': 'Units'})
+        df.index = pd.Index(ids, name=unique_field)
+        tables['characteristics'] = df
 
     # put all statistics into a dataframe
-    statistics = [i.statistics_df() for i in q]
-    statistics = pd.concat(statistics, ignore_index=False)
-    statistics = gpd.GeoDataFrame(statistics)
+    records, ids = _collect(points, lambda pt: pt.statistics)
+    if records:
+        df = pd.DataFrame.from_records(records)
+        rename_dict = {'statisticGroupID': 'StatGroup', 'name': 'StatName', 'code': 'StatLabel', 'value': 'Value', 'units': 'Units', 'equivalentYears': 'Years', 'intervalBounds.lower': 'Pll', 'intervalBounds.upper': 'Plu'}
+        df = df.rename(columns=rename_dict)
+        df = df[[c for c in df.columns if c in rename_dict.values()]]
+        df.index = pd.Index(ids, name=unique_field)
+        tables['statistics'] = df
+    return tables
 
-    # Export to a geopackage
-    wshed.to_file(out_path, layer='globalwatershed', driver='GPKG')
-    pts.to_file(out_path, layer='globalwatershedpoint', driver='GPKG')
+def read_finished_ids(out_path, unique_field, stat_groups=None):
+    """
+    Reads the IDs of points that already have flow statistics for every requested statistic group in an existing
+    output file.  A point that only has some of the groups, e.g. because a group was added to a resumed run, is not
+    finished.  Files written before the StatGroup column existed hold peak flows (group 2) only.
+
+    Args:
+        out_path (str): The path to the output GeoPackage file.
+        unique_field (str): The field containing unique identifiers for each point.
+        stat_groups (iterable, optional): IDs of the statistic groups of the run. Defaults to DEFAULT_STAT_GROUPS.
+
+    Returns:
+        set: The finished IDs as strings.  Empty if the file or table does not exist.
+    """
+    stat_groups = set(DEFAULT_STAT_GROUPS if stat_groups is None else (str(g) for g in stat_groups))
+    if not os.path.exists(out_path):
+        return set()
     con = sqlite3.connect(out_path)
-    characteristics.to_sql('characteristics', con, if_exists='replace')
-    statistics.to_sql('statistics', con, if_exists='replace')
-    con.close()
-    
\ No newline at end of file
+    try:
+        if 'statistics' not in {r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}:
+            return set()
+        if 'StatGroup' not in {r[1] for r in con.execute('PRAGMA table_info("statistics")')}:
+            if not stat_groups <= set(DEFAULT_STAT_GROUPS):
+                return set()
+            return {str(r[0]) for r in con.execute(f'SELECT DISTINCT "{unique_field}" FROM statistics')}
+        groups = {}
+        for point_id, group in con.execute(f'SELECT DISTINCT "{unique_field}", StatGroup FROM statistics'):
+            groups.setdefault(str(point_id), set()).add(str(group))
+        return {point_id for point_id, done in groups.items() if stat_groups <= done}
+    finally:
+        con.close()
+
+def discard_unfinished(out_path, unique_field, finished_ids):
+    """
+    Deletes rows for points that are not finished from an existing output file so they can be rerun, including the
+    statistics of points that only have some of the run's statistic groups.
+
+    Args:
+        out_path (str): The path to the output GeoPackage file.
+        unique_field (str): The field containing unique identifiers for each point.
+        finished_ids (set): IDs (as strings) to keep.
+
+    Returns:
+        None
+    """
+    if not os.path.exists(out_path):
+        return
+    con = sqlite3.connect(out_path)
+    try:
+        existing = {r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        with con:
+            for table in ['globalwatershed', 'globalwatershedpoint', 'characteristics', 'statistics']:
+                if table not in existing:
+                    continue
+                rows = con.execute(f'SELECT rowid, "{unique_field}" FROM "{table}"').fetchall()
+                stale = [(r[0],) for r in rows if str(r[1]) not in finished_ids]
+                con.executemany(f'DELETE FROM "{table}" WHERE rowid = ?', stale)
+    finally:
+        con.close()
+
+def export_data(out_path, out_q):
+    """
+    Exports data from the output queue to a GeoPackage file, writing every layer in one transaction.
+
+    Args:
+        out_path (str): The path to the output GeoPackage file.
+        out_q (queue.Queue): The output queue containing the data to export.
+
+    Returns:
+        None
+    """
+    logging.info('Exporting data')
+    # convert q to list
+    q = list()
+    while not out_q.empty():
+        q.append(out_q.get_nowait())
+    # Imported here as the writers module builds on this one
+    from .writers import GeoPackageWriter
+    with GeoPackageWriter(out_path) as writer:
+        writer.write(q)
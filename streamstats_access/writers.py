@@ -0,0 +1,541 @@
+"""
+Writers Module
+
+This module contains the output writers used by batch runs: a GeoPackage writer that writes all four output
+layers in one SQLite transaction per batch, and GeoParquet writers for analytics workflows.
+"""
+
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import struct
+import numpy as np
+import pandas as pd
+import shapely
+from .utils import build_tables
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+LAYERS = ['globalwatershed', 'globalwatershedpoint', 'characteristics', 'statistics']
+GEOMETRY_LAYERS = ['globalwatershed', 'globalwatershedpoint']
+
+# Pragmas for bulk loading.  WAL with synchronous=NORMAL keeps committed batches safe if the process dies.
+_PRAGMAS = ['PRAGMA journal_mode=WAL', 'PRAGMA synchronous=NORMAL', 'PRAGMA cache_size=-65536',
+            'PRAGMA temp_store=MEMORY']
+
+
+# Multi-part types that single-part geometries are promoted to, so both kinds can share a layer
+_MULTI = {'LineString': 'MultiLineString', 'Polygon': 'MultiPolygon'}
+_PROMOTE = {'LineString': shapely.multilinestrings, 'Polygon': shapely.multipolygons}
+
+
+def _layer_type(types):
+    """
+    Returns the geometry type to declare for a layer created from geometries of the given types: the multi-part
+    type for lines and polygons, since a delineation may return either part type, or 'Unknown' (GEOMETRY) if the
+    types differ.
+    """
+    types = {_MULTI.get(t, t) for t in types}
+    return types.pop() if len(types) == 1 else 'Unknown'
+
+
+def _fit_geometries(geometries, declared):
+    """
+    Promotes single-part geometries to the layer's multi-part type, and returns them with whether every geometry
+    now matches the declared type (a GeoPackage geometry type name).
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    declared = declared.upper()
+    promote = {t: f for t, f in _PROMOTE.items() if _MULTI[t].upper() == declared}
+    if promote:
+        geometries = np.array([promote[g.geom_type]([g]) if g is not None and g.geom_type in promote else g
+                               for g in geometries], dtype=object)
+    fits = declared == 'GEOMETRY' or all(g is None or g.geom_type.upper() == declared for g in geometries)
+    return geometries, fits
+
+
+def _gpkg_blobs(geometries, srs_id):
+    """
+    Encodes geometries as GeoPackage geometry blobs (a header with the envelope, then little-endian WKB).
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    wkb = shapely.to_wkb(geometries, byte_order=1)
+    bounds = shapely.bounds(geometries)
+    header = struct.pack('<2sBBi', b'GP', 0, 0b00000011, srs_id)
+    empty = struct.pack('<2sBBi', b'GP', 0, 0b00010001, srs_id)
+    blobs = []
+    for g, w, (minx, miny, maxx, maxy) in zip(geometries, wkb, bounds):
+        if g is None:
+            blobs.append(None)
+        elif shapely.is_empty(g):
+            blobs.append(empty + w)
+        else:
+            blobs.append(header + struct.pack('<4d', minx, maxx, miny, maxy) + w)
+    return blobs
+
+
+def _blob_envelope(blob):
+    """
+    Reads (minx, maxx, miny, maxy) from a GeoPackage geometry blob.
+    """
+    flags = blob[3]
+    indicator = (flags >> 1) & 0b111
+    if indicator:
+        return struct.unpack_from('<4d' if flags & 1 else '>4d', blob, 8)
+    minx, miny, maxx, maxy = shapely.from_wkb(bytes(blob[8:])).bounds
+    return minx, maxx, miny, maxy
+
+
+def _blob_is_empty(blob):
+    return None if blob is None else int(bool(blob[3] & 0b00010000))
+
+
+def _register_functions(con):
+    """
+    Registers the SQL functions that GDAL's spatial index triggers call, so rows inserted through sqlite3 keep the
+    layer's R-tree up to date.
+    """
+    con.create_function('ST_IsEmpty', 1, _blob_is_empty, deterministic=True)
+    for i, name in enumerate(['ST_MinX', 'ST_MaxX', 'ST_MinY', 'ST_MaxY']):
+        con.create_function(name, 1, lambda blob, i=i: None if blob is None else _blob_envelope(blob)[i],
+                            deterministic=True)
+
+
+def _sql_values(series):
+    """
+    Converts a column to Python values sqlite3 can bind, with missing values as None.
+    """
+    values = series.tolist()
+    if series.dtype.kind not in 'biuf' and series.hasnans:
+        values = [None if missing else v for v, missing in zip(values, series.isna().to_numpy())]
+    return values
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _sql_type(series):
+    """
+    Returns the GeoPackage column type for a column.
+    """
+    kind = series.dtype.kind
+    return {'b': 'BOOLEAN', 'i': 'INTEGER', 'u': 'INTEGER', 'f': 'REAL', 'M': 'DATETIME'}.get(kind, 'TEXT')
+
+
+class Writer:
+    """
+    Writer is the interface of the output writers.
+
+    Writing a batch has two steps so that the CPU-bound one can run elsewhere: prepare() turns finished points into
+    output rows and touches no state, so it can run in a worker process, and write_prepared() writes them.  Batches
+    must be written in order from one thread at a time.
+
+    Attributes:
+        out_path (str): The output file or directory.
+        supports_resume (bool): Whether a run writing here can be resumed.
+    """
+
+    supports_resume = False
+
+    @staticmethod
+    def prepare(points):
+        """
+        Converts a batch of finished points to output rows.
+
+        Args:
+            points (list): Finished Point objects.
+
+        Returns:
+            The rows, as taken by write_prepared.
+        """
+        raise NotImplementedError
+
+    def write_prepared(self, prepared):
+        """
+        Writes the rows of a batch returned by prepare().
+
+        Args:
+            prepared: The rows.
+        """
+        raise NotImplementedError
+
+    def write(self, points):
+        """
+        Writes the results of a batch of points.
+
+        Args:
+            points (list): Finished Point objects.
+
+        Returns:
+            int: The number of points written.
+        """
+        self.write_prepared(self.prepare(points))
+        return len(points)
+
+    def close(self):
+        """
+        Finishes the output.
+        """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class GeoPackageWriter(Writer):
+    """
+    GeoPackageWriter writes batches of finished points to a GeoPackage.
+
+    Layer schemas are created with GDAL, so the file is a standard GeoPackage with spatial indexes.  Rows for all
+    four layers are then inserted through one sqlite3 connection in a single transaction per batch, with geometries
+    encoded directly as GeoPackage blobs, instead of one GDAL write per geometry layer plus a separate connection
+    for the tables.
+
+    Geometry layers are declared with the multi-part type of their first batch (e.g. MULTIPOLYGON), and single-part
+    geometries are promoted to it.  If a later batch holds another geometry type, the layer is widened to GEOMETRY.
+
+    Unless resuming, an existing GeoPackage at out_path is deleted when the writer is created, so no layer of an
+    earlier run is left behind, e.g. the globalwatershed layer when rerunning with PayloadMode(stats_only=True).
+    Layers are created the first time they are written and appended to after that.  Fields that first appear in a
+    later batch (a basin characteristic or statistic only some regions report) are added to the
+    layer, and earlier rows are left NULL in them.
+
+    Attributes:
+        out_path (str): The GeoPackage file.
+        supports_resume (bool): Whether a run writing here can be resumed.
+    """
+
+    supports_resume = True
+
+    def __init__(self, out_path, resume=False):
+        """
+        Initializes the writer.
+
+        Args:
+            out_path (str): The GeoPackage file.
+            resume (bool, optional): Whether to append to the layers already in out_path.  Otherwise out_path is
+                deleted if it exists. Defaults to False.
+        """
+        self.out_path = out_path
+        if not resume:
+            for path in (out_path, f'{out_path}-wal', f'{out_path}-shm', f'{out_path}-journal'):
+                if os.path.exists(path):
+                    os.remove(path)
+        self._con = None
+
+    def _connect(self):
+        if self._con is None:
+            # Batches may be written from a worker thread and the writer closed from another
+            self._con = sqlite3.connect(self.out_path, isolation_level=None, check_same_thread=False)
+            _register_functions(self._con)
+            for pragma in _PRAGMAS:
+                self._con.execute(pragma)
+        return self._con
+
+    def _columns(self, table):
+        return [r[1] for r in self._connect().execute(f'PRAGMA table_info({_quote(table)})')]
+
+    def _create_geometry_layer(self, layer, gdf):
+        geometry_type = _layer_type(gdf.geom_type.dropna().unique())
+        # GDAL writes the schema, metadata and spatial index; rows are inserted afterwards
+        gdf.iloc[:0].to_file(self.out_path, layer=layer, driver='GPKG', geometry_type=geometry_type)
+
+    @staticmethod
+    def prepare(points):
+        """
+        Builds the output tables of a batch of points with utils.build_tables.
+
+        Args:
+            points (list): Finished Point objects.
+
+        Returns:
+            dict: Output layer names mapped to (Geo)DataFrames.
+        """
+        return build_tables(points)
+
+    def write_prepared(self, tables):
+        """
+        Writes output tables, as returned by prepare() or utils.build_tables, in one transaction.
+
+        Args:
+            tables (dict): Output layer names mapped to (Geo)DataFrames.
+        """
+        if not tables:
+            return
+        # Schemas are created outside the transaction, as GDAL writes them through its own connection
+        for layer in GEOMETRY_LAYERS:
+            # Connecting first would create an empty SQLite file that GDAL does not recognise as a GeoPackage
+            if layer in tables and (not os.path.exists(self.out_path) or not self._columns(layer)):
+                self._create_geometry_layer(layer, tables[layer])
+        con = self._connect()
+        con.execute('BEGIN')
+        try:
+            for layer in LAYERS:
+                if layer in tables:
+                    self._insert(con, layer, tables[layer])
+            con.execute('COMMIT')
+        except BaseException:
+            con.execute('ROLLBACK')
+            raise
+
+    def _insert(self, con, layer, df):
+        index = df.index.name
+        columns = [c for c in df.columns if layer not in GEOMETRY_LAYERS or c != df.geometry.name]
+        if layer in GEOMETRY_LAYERS:
+            geometry_column, srs_id, declared = con.execute(
+                'SELECT column_name, srs_id, geometry_type_name FROM gpkg_geometry_columns WHERE table_name = ?',
+                (layer,)).fetchone()
+            geometries, fits = _fit_geometries(df.geometry.values, declared)
+            if not fits:
+                logging.info(f'Widening the geometry type of the {layer} layer from {declared} to GEOMETRY')
+                con.execute("UPDATE gpkg_geometry_columns SET geometry_type_name = 'GEOMETRY' WHERE table_name = ?",
+                            (layer,))
+        existing = self._columns(layer)
+        if not existing:
+            con.execute(pd.io.sql.get_schema(df.iloc[:0].reset_index(), layer, con=con))
+            con.execute(f'CREATE INDEX {_quote(f"ix_{layer}_{index}")} ON {_quote(layer)} ({_quote(index)})')
+            existing = [index] + columns
+        for c in columns:
+            if c not in existing:
+                con.execute(f'ALTER TABLE {_quote(layer)} ADD COLUMN {_quote(c)} {_sql_type(df[c])}')
+        names = [index] + columns
+        values = [_sql_values(df.index.to_series())] + [_sql_values(df[c]) for c in columns]
+        if layer in GEOMETRY_LAYERS:
+            names = [geometry_column] + names
+            values = [_gpkg_blobs(geometries, srs_id)] + values
+        placeholders = ', '.join('?' * len(names))
+        con.executemany(f'INSERT INTO {_quote(layer)} ({", ".join(map(_quote, names))}) VALUES ({placeholders})',
+                        zip(*values))
+        if layer in GEOMETRY_LAYERS:
+            con.execute(f'UPDATE gpkg_contents SET (min_x, max_x, min_y, max_y) = (SELECT min(minx), max(maxx), '
+                        f'min(miny), max(maxy) FROM {_quote(f"rtree_{layer}_{geometry_column}")}), '
+                        f"last_change = strftime('%Y-%m-%dT%H:%M:%fZ', 'now') WHERE table_name = ?", (layer,))
+
+    def close(self):
+        """
+        Checkpoints the write-ahead log back into the GeoPackage and closes the connection.
+        """
+        if self._con is not None:
+            self._con.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            self._con.execute('PRAGMA journal_mode=DELETE')
+            self._con.close()
+            self._con = None
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError('pyarrow is required for Parquet output; pip install streamstats_access[parquet]')
+
+
+def _to_arrow(df):
+    """
+    Converts an output table to an Arrow table, with GeoParquet metadata for geometry layers.
+    """
+    if not hasattr(df, 'geometry'):
+        return pa.Table.from_pandas(df)
+    name = df.geometry.name
+    data = pd.DataFrame(df.drop(columns=name))
+    data[name] = shapely.to_wkb(df.geometry.values, byte_order=1)
+    table = pa.Table.from_pandas(data)
+    crs = df.crs.to_json_dict() if df.crs is not None else None
+    geo = {'version': '1.0.0', 'primary_column': name, 'columns': {name: {
+        'encoding': 'WKB', 'geometry_types': sorted(df.geom_type.dropna().unique()), 'crs': crs}}}
+    return table.replace_schema_metadata({**(table.schema.metadata or {}), b'geo': json.dumps(geo).encode()})
+
+
+def _conform(table, schema, layer):
+    """
+    Aligns a batch's columns to the schema of the file it is appended to.
+    """
+    dropped = set(table.column_names) - set(schema.names)
+    if dropped:
+        logging.warning(f'Dropping fields not in existing {layer} layer: {sorted(dropped)}')
+    columns = [table.column(f.name) if f.name in table.column_names else pa.nulls(len(table), f.type)
+               for f in schema]
+    return pa.Table.from_arrays(columns, schema=schema.remove_metadata()).replace_schema_metadata(schema.metadata)
+
+
+class GeoParquetWriter(Writer):
+    """
+    GeoParquetWriter writes each output layer to its own GeoParquet file in the out_path directory, e.g.
+    out_path/globalwatershed.parquet, adding a row group per batch.  Geometries are WKB with GeoParquet metadata,
+    so geopandas.read_parquet reads the layers back directly.
+
+    Existing layer files in out_path are deleted when the writer is created, so no layer of an earlier run is left
+    behind.  The columns of each file are fixed by its first batch; later batches are aligned to them.  The GeoParquet
+    geometry_types of a layer are those of every batch, so its metadata is written when the writer is closed, and
+    files are only readable after that.  With a pyarrow too old to add metadata then, geometry_types is left empty
+    (any type).
+
+    Attributes:
+        out_path (str): The output directory.
+        supports_resume (bool): Whether a run writing here can be resumed.
+    """
+
+    def __init__(self, out_path, resume=False):
+        """
+        Initializes the writer.
+
+        Args:
+            out_path (str): The output directory, created if needed.
+            resume (bool, optional): Not supported. Defaults to False.
+        """
+        _require_pyarrow()
+        self.out_path = out_path
+        self._writers = {}
+        self._geo = {}
+        os.makedirs(out_path, exist_ok=True)
+        for layer in LAYERS:
+            path = os.path.join(out_path, f'{layer}.parquet')
+            if os.path.exists(path):
+                os.remove(path)
+
+    @staticmethod
+    def prepare(points):
+        """
+        Builds the output tables of a batch of points as Arrow tables.
+
+        Args:
+            points (list): Finished Point objects.
+
+        Returns:
+            dict: Output layer names mapped to pyarrow.Tables.
+        """
+        return {layer: _to_arrow(df) for layer, df in build_tables(points).items()}
+
+    def write_prepared(self, tables):
+        """
+        Appends a row group per layer.
+
+        Args:
+            tables (dict): Output layer names mapped to pyarrow.Tables, as returned by prepare().
+        """
+        for layer, table in tables.items():
+            metadata = table.schema.metadata or {}
+            if b'geo' in metadata:
+                geo = json.loads(metadata[b'geo'])
+                column = geo['columns'][geo['primary_column']]
+                if layer in self._geo:
+                    known = self._geo[layer]['columns'][geo['primary_column']]
+                    known['geometry_types'] = sorted(set(known['geometry_types']) | set(column['geometry_types']))
+                else:
+                    self._geo[layer] = geo
+                if hasattr(pq.ParquetWriter, 'add_key_value_metadata'):
+                    # Written when the writer is closed, with the geometry types of every batch
+                    metadata = {k: v for k, v in metadata.items() if k != b'geo'}
+                else:
+                    column['geometry_types'] = []
+                    metadata = {**metadata, b'geo': json.dumps(geo).encode()}
+                table = table.replace_schema_metadata(metadata)
+            if layer not in self._writers:
+                self._writers[layer] = pq.ParquetWriter(os.path.join(self.out_path, f'{layer}.parquet'), table.schema)
+            writer = self._writers[layer]
+            writer.write_table(_conform(table, writer.schema, layer))
+
+    def close(self):
+        """
+        Adds the GeoParquet metadata and finishes every file.
+        """
+        for layer, writer in self._writers.items():
+            if layer in self._geo and hasattr(writer, 'add_key_value_metadata'):
+                writer.add_key_value_metadata({'geo': json.dumps(self._geo[layer])})
+            writer.close()
+        self._writers = {}
+        self._geo = {}
+
+
+class PartitionedParquetWriter(Writer):
+    """
+    PartitionedParquetWriter writes a GeoParquet file per batch, region and layer in a hive-partitioned directory
+    tree, e.g. out_path/globalwatershed/rcode=VT/part-00000.parquet.  Every batch is readable as soon as it is
+    written, and each region keeps its own columns.  Layer directories left by a previous run are replaced.  Read a
+    layer back with geopandas.read_parquet or pandas.read_parquet on its directory; the region comes back as the
+    rcode column.
+
+    Attributes:
+        out_path (str): The output directory.
+        supports_resume (bool): Whether a run writing here can be resumed.
+    """
+
+    def __init__(self, out_path, resume=False):
+        """
+        Initializes the writer.
+
+        Args:
+            out_path (str): The output directory, created if needed.
+            resume (bool, optional): Not supported. Defaults to False.
+        """
+        _require_pyarrow()
+        self.out_path = out_path
+        self._parts = 0
+        for layer in LAYERS:
+            shutil.rmtree(os.path.join(out_path, layer), ignore_errors=True)
+        os.makedirs(out_path, exist_ok=True)
+
+    @staticmethod
+    def prepare(points):
+        """
+        Builds the output tables of a batch of points as Arrow tables, per region.
+
+        Args:
+            points (list): Finished Point objects.
+
+        Returns:
+            dict: Region codes mapped to dicts of output layer names and pyarrow.Tables.
+        """
+        regions = {}
+        for pt in points:
+            regions.setdefault(pt.rcode, []).append(pt)
+        return {region: {layer: _to_arrow(df) for layer, df in build_tables(group).items()}
+                for region, group in regions.items()}
+
+    def write_prepared(self, regions):
+        """
+        Writes a file per region and layer.
+
+        Args:
+            regions (dict): Region codes mapped to dicts of output layer names and pyarrow.Tables, as returned by
+                prepare().
+        """
+        for region, tables in regions.items():
+            for layer, table in tables.items():
+                directory = os.path.join(self.out_path, layer, f'rcode={region}')
+                os.makedirs(directory, exist_ok=True)
+                pq.write_table(table, os.path.join(directory, f'part-{self._parts:05d}.parquet'))
+        self._parts += 1
+
+
+WRITERS = {'gpkg': GeoPackageWriter, 'parquet': GeoParquetWriter, 'partitioned': PartitionedParquetWriter}
+
+
+def get_writer(out_path, output_format='gpkg', resume=False):
+    """
+    Creates the writer for an output format.
+
+    Args:
+        out_path (str): The output file (GeoPackage) or directory (Parquet formats).
+        output_format (str, optional): 'gpkg', 'parquet' (a GeoParquet file per layer) or 'partitioned' (GeoParquet
+            files partitioned by layer and region). Defaults to 'gpkg'.
+        resume (bool, optional): Whether to append to results already in out_path. Defaults to False.
+
+    Returns:
+        The writer.
+
+    Raises:
+        ValueError: If the format is unknown or cannot be resumed.
+    """
+    if output_format not in WRITERS:
+        raise ValueError(f'Unknown output format {output_format!r}; expected one of {sorted(WRITERS)}')
+    writer = WRITERS[output_format]
+    if resume and not writer.supports_resume:
+        raise ValueError(f'Resuming is only supported for GeoPackage output, not {output_format!r}')
+    return writer(out_path, resume)
@@ -0,0 +1,65 @@
+import asyncio
+import gc
+import warnings
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from benchmarks.mock_server import MockStreamStats, override_config
+from streamstats_access.background import BackgroundLoop, shared_loop
+from streamstats_access.endpoints import USGSEndpoints
+from streamstats_access.models import Point, default_client
+
+
+async def _ping(request):
+    return web.json_response({'ok': True})
+
+
+async def _get_once(client):
+    app = web.Application()
+    app.router.add_get('/ping', _ping)
+    async with TestServer(app) as server:
+        body, _ = await client.get(str(server.make_url('/ping')))
+    return body
+
+
+def test_client_is_reusable_across_event_loops():
+    client = USGSEndpoints()
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        assert asyncio.run(_get_once(client)) == {'ok': True}
+        first = client._session
+        assert asyncio.run(_get_once(client)) == {'ok': True}
+        assert client._session is not first and first.closed
+        asyncio.run(client.close())
+        del first
+        gc.collect()
+    assert not [w for w in caught if issubclass(w.category, ResourceWarning)]
+
+
+def test_points_without_a_client_share_one():
+    points = [Point('VT', -72.5, 44.5 + i / 100, 4326, uid=i) for i in range(3)]
+    assert all(pt.api_client is default_client() for pt in points)
+    assert asyncio.run(_get_once(points[0].api_client)) == {'ok': True}
+    assert asyncio.run(_get_once(points[1].api_client)) == {'ok': True}
+
+
+def test_sync_helper_clients_are_closed_with_their_owner():
+    server_loop = BackgroundLoop('mock-server')
+    server = MockStreamStats(latency_scale=0)
+    closers = shared_loop()._closers
+    try:
+        url = server_loop.run(server.start())
+        with override_config(url):
+            owners = [USGSEndpoints() for _ in range(3)]
+            for owner in owners:
+                body, _ = owner.get_basin_characteristics('VT', 'VT000000000001', 'DRNAREA')
+                assert [p['code'] for p in body['parameters']] == ['DRNAREA']
+            helpers = [owner._sync_client for owner in owners]
+            assert all(helper.close in closers for helper in helpers)
+
+            for owner in owners:
+                asyncio.run(owner.close())
+            assert not any(helper.close in closers for helper in helpers)
+            assert all(helper._session is None for helper in helpers)
+    finally:
+        server_loop.run(server.close())
+        server_loop.stop()
@@ -0,0 +1,111 @@
+import asyncio
+import sqlite3
+import pytest
+from aiohttp import web
+from benchmarks.bench_batch import make_input
+from benchmarks.mock_server import MockStreamStats, override_config
+from streamstats_access import batch_query
+from streamstats_access.batch_query import iter_batch, process_batch_async
+
+# Output layers are written without a CRS, as the mock's delineations have none
+pytestmark = pytest.mark.filterwarnings("ignore:'crs' was not provided")
+
+
+@pytest.fixture
+def in_path(tmp_path):
+    path = str(tmp_path / 'in.gpkg')
+    make_input(path, 6)
+    return path
+
+
+def _run(in_path, out_path, mock=None, **kwargs):
+    async def run():
+        async with MockStreamStats(latency_scale=0, **(mock or {})) as server:
+            with override_config(server.url):
+                await process_batch_async(in_path, out_path, 'VT', 'UID', concurrency=3, poll_schedule=(0, 0, 0),
+                                          **kwargs)
+        return server
+
+    return asyncio.run(run())
+
+
+def _count(out_path, table):
+    con = sqlite3.connect(out_path)
+    try:
+        if not con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+            return 0
+        return con.execute(f'SELECT count(*) FROM {table}').fetchone()[0]
+    finally:
+        con.close()
+
+
+def test_stats_only_rerun_leaves_no_watershed_rows(in_path, tmp_path):
+    out_path = str(tmp_path / 'out.gpkg')
+    _run(in_path, out_path)
+    assert _count(out_path, 'globalwatershed') == 6
+
+    _run(in_path, out_path, payload={'stats_only': True})
+    assert _count(out_path, 'globalwatershed') == 0
+    assert _count(out_path, 'globalwatershedpoint') == 6
+    assert _count(out_path, 'statistics') > 0
+
+
+def _iter(in_path, server, **kwargs):
+    async def run():
+        async with server:
+            with override_config(server.url):
+                return [pt async for pt in iter_batch(in_path, 'VT', 'UID', concurrency=3, **kwargs)]
+
+    return asyncio.run(run())
+
+
+def _served(server, endpoint, status=200):
+    return server.stats.get(f'{endpoint} {status}', 0)
+
+
+def test_retry_resumes_at_the_stage_that_failed(in_path, monkeypatch):
+    monkeypatch.setattr(batch_query, 'retry_delay', lambda error, attempt: 0)
+    server = MockStreamStats(latency_scale=0)
+    regression_regions = server.regression_regions
+    failed = []
+
+    async def fail_once(request):
+        if not failed:
+            failed.append(request)
+            return web.Response(status=503)
+        return await regression_regions(request)
+
+    server.regression_regions = fail_once
+    points = _iter(in_path, server, poll_schedule=(0,))
+
+    assert len(points) == 6 and not any(pt.failed for pt in points)
+    retried = [pt for pt in points if pt.attempts]
+    assert len(retried) == 1 and retried[0].last_error.startswith('regression_regions: server_error')
+    # Only the failed stage was repeated
+    assert _served(server, 'watershed') == 6
+    assert _served(server, 'regressionRegions', 503) == 1 and _served(server, 'regressionRegions') == 6
+    assert _served(server, 'basinCharacteristics') == 6 and _served(server, 'computeFlowStats') == 6
+    assert all(pt.statistics for pt in points)
+
+
+def test_incomplete_characteristics_are_polled_until_complete(in_path):
+    server = MockStreamStats(latency_scale=0, incomplete_rate=1.0, max_incomplete_polls=2, seed=0)
+    points = _iter(in_path, server, poll_schedule=(0, 0.01, 0.01))
+
+    assert len(points) == 6 and not any(pt.failed for pt in points)
+    assert all(pt.attempts == 0 for pt in points)
+    assert all('value' in row for pt in points for row in pt.characteristics)
+    assert all(pt.statistics for pt in points)
+    polls = _served(server, 'basinCharacteristics')
+    assert 6 < polls <= 6 * 3
+    assert _served(server, 'watershed') == 6
+
+
+def test_points_still_incomplete_after_the_schedule_are_retried(in_path, monkeypatch):
+    monkeypatch.setattr(batch_query, 'retry_delay', lambda error, attempt: 0)
+    server = MockStreamStats(latency_scale=0, incomplete_rate=1.0, max_incomplete_polls=1, seed=0)
+    points = _iter(in_path, server, poll_schedule=())
+
+    assert not any(pt.failed for pt in points)
+    assert all(pt.attempts == 1 and pt.last_error.startswith('basin_characteristics') for pt in points)
+    assert _served(server, 'watershed') == 6 and _served(server, 'basinCharacteristics') == 12
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import types
+from multidict import CIMultiDict
+from streamstats_access import cache as cache_module
+from streamstats_access.cache import ResponseCache
+from streamstats_access.endpoints import USGSEndpoints
+from streamstats_access.models import Point
+
+PAYLOADS = os.path.join(os.path.dirname(__file__), os.pardir, 'benchmarks', 'payloads')
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def _cache(tmp_path, monkeypatch, **kwargs):
+    clock = _Clock()
+    monkeypatch.setattr(cache_module, 'time', types.SimpleNamespace(time=clock.time))
+    return ResponseCache(str(tmp_path / 'cache.sqlite'), **kwargs), clock
+
+
+def test_entries_expire_after_ttl(tmp_path, monkeypatch):
+    cache, clock = _cache(tmp_path, monkeypatch, ttl=60)
+    cache.set('scenarios', {'rcode': 'VT'}, {'a': 1})
+    clock.now += 59
+    assert cache.get('scenarios', {'rcode': 'VT'})[0] == {'a': 1}
+    clock.now += 2
+    assert cache.get('scenarios', {'rcode': 'VT'}) is None
+    assert cache.stats == {'scenarios': {'hits': 1, 'misses': 1}}
+    assert cache.con.execute('SELECT COUNT(*) FROM responses').fetchone()[0] == 0
+
+
+def test_least_recently_used_entry_is_evicted_at_the_cap(tmp_path, monkeypatch):
+    cache, clock = _cache(tmp_path, monkeypatch, max_entries=3)
+    for key in 'abc':
+        clock.now += 1
+        cache.set('scenarios', key, {'key': key})
+    clock.now += 1
+    assert cache.get('scenarios', 'a') is not None
+    clock.now += 1
+    cache.set('scenarios', 'd', {'key': 'd'})
+
+    assert cache.get('scenarios', 'b') is None
+    assert [cache.get('scenarios', key)[0]['key'] for key in 'acd'] == ['a', 'c', 'd']
+    assert cache._entries == 3
+
+
+def test_refresh_skips_the_lookup_and_stores_the_fresh_response(tmp_path, monkeypatch):
+    cache, _ = _cache(tmp_path, monkeypatch)
+    client = USGSEndpoints(cache=cache)
+    cache.set('watershed', {'x': 1}, {'workspaceID': 'old'})
+
+    async def request(workspace_id):
+        return {'workspaceID': workspace_id}, {}
+
+    async def run():
+        cached = await client._cached('watershed', {'x': 1}, request('new'))
+        refreshed = await client._cached('watershed', {'x': 1}, request('new'), refresh=True)
+        return cached, refreshed
+
+    cached, refreshed = asyncio.run(run())
+    assert cached[0] == {'workspaceID': 'old'}
+    assert refreshed[0] == {'workspaceID': 'new'}
+    assert cache.get('watershed', {'x': 1})[0] == {'workspaceID': 'new'}
+
+
+def test_retried_delineation_bypasses_the_cache(tmp_path, monkeypatch):
+    cache, _ = _cache(tmp_path, monkeypatch)
+    client = USGSEndpoints(cache=cache, offload_bytes=0)
+    with open(os.path.join(PAYLOADS, 'watershed.json'), 'rb') as f:
+        body = f.read()
+    sent = []
+
+    async def get(url, params=None, headers=None, raw=False):
+        sent.append(params)
+        return body, CIMultiDict({'USGSWiM-HostName': 'PRODWEBA'})
+
+    client.get = get
+    first, again, retried = (Point('VT', -72.5, 44.5, 4326, uid=i, api_client=client) for i in range(3))
+    retried.attempts = 1
+
+    async def run():
+        for pt in (first, again, retried):
+            await pt._delineate_watershed_async()
+
+    asyncio.run(run())
+    assert len(sent) == 2
+    assert cache.stats['watershed'] == {'hits': 1, 'misses': 1}
+    assert retried.workspace_id == first.workspace_id and retried.server_name == 'prodweba'
@@ -0,0 +1,68 @@
+import asyncio
+from streamstats_access.coalesce import SingleFlight
+
+
+class _Request:
+    def __init__(self):
+        self.calls = 0
+        self.release = None
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        return {'regions': [{'code': 'GC1'}]}, {'Content-Type': 'application/json'}
+
+
+def _run(test):
+    async def run():
+        request = _Request()
+        request.release = asyncio.Event()
+        return await test(SingleFlight(), request)
+
+    return asyncio.run(run())
+
+
+def test_concurrent_identical_calls_send_one_request():
+    async def test(flight, request):
+        callers = [asyncio.ensure_future(flight.do('key', request)) for _ in range(5)]
+        await asyncio.sleep(0)
+        request.release.set()
+        results = await asyncio.gather(*callers)
+        assert request.calls == 1
+        assert flight.stats == {'hits': 0, 'coalesced': 4, 'misses': 1}
+        assert all(r == results[0] for r in results)
+
+        await flight.do('key', request)
+        assert request.calls == 1 and flight.stats['hits'] == 1
+
+    _run(test)
+
+
+def test_each_caller_gets_an_independent_copy():
+    async def test(flight, request):
+        request.release.set()
+        first, second = await asyncio.gather(flight.do('key', request), flight.do('key', request))
+        first[0]['regions'].append({'code': 'GC2'})
+        memoized = await flight.do('key', request)
+        assert second[0] == memoized[0] == {'regions': [{'code': 'GC1'}]}
+        assert first[0] is not second[0] and second[0] is not memoized[0]
+
+    _run(test)
+
+
+def test_cancelling_a_waiter_does_not_cancel_the_shared_request():
+    async def test(flight, request):
+        sender = asyncio.ensure_future(flight.do('key', request))
+        joiners = [asyncio.ensure_future(flight.do('key', request)) for _ in range(2)]
+        await asyncio.sleep(0)
+        sender.cancel()
+        joiners[0].cancel()
+        await asyncio.sleep(0)
+        request.release.set()
+
+        result = await joiners[1]
+        assert result[0] == {'regions': [{'code': 'GC1'}]}
+        assert sender.cancelled() and joiners[0].cancelled()
+        assert request.calls == 1
+
+    _run(test)
@@ -0,0 +1,74 @@
+import asyncio
+import copy
+import json
+import os
+import numpy as np
+from streamstats_access.estimator import RegressionEstimator
+
+PAYLOADS = os.path.join(os.path.dirname(__file__), os.pardir, 'benchmarks', 'payloads')
+
+
+def _recorded():
+    with open(os.path.join(PAYLOADS, 'estimate.json')) as f:
+        return json.load(f)
+
+
+def test_local_estimate_matches_recorded_response():
+    recorded = _recorded()
+    scenario = copy.deepcopy(recorded[0])
+    scenario['regressionRegions'][0].pop('results')
+    definitions = RegressionEstimator.parse_definitions(recorded)
+    local = RegressionEstimator().evaluate(definitions, [scenario])[0]
+
+    expected = recorded[0]['regressionRegions'][0]['results']
+    results = local[0]['regressionRegions'][0]['results']
+    assert np.allclose([r['value'] for r in results], [r['value'] for r in expected], rtol=1e-5)
+    assert np.allclose([r['intervalBounds']['lower'] for r in results],
+                       [r['intervalBounds']['lower'] for r in expected], rtol=1e-5)
+    for result, template in zip(results, expected):
+        assert result['equivalentYears'] == template['equivalentYears']
+        assert result['errors'] == template['errors']
+        assert 'predictionInterval' not in result
+
+
+class _Point:
+    """
+    Stands in for a Point whose scenario and basin characteristics are the recorded ones.
+    """
+    in_flight = 0
+    most_in_flight = 0
+
+    def __init__(self, fail=False):
+        scenario = copy.deepcopy(_recorded()[0])
+        scenario['regressionRegions'][0].pop('results')
+        self.rcode = 'VT'
+        self.scenarios = [scenario]
+        self.statistics = None
+        self.fail = fail
+
+    def _fill_scenario_parameters(self):
+        pass
+
+    async def _get_scenario_statistics_async(self, scenario):
+        _Point.in_flight += 1
+        _Point.most_in_flight = max(_Point.most_in_flight, _Point.in_flight)
+        await asyncio.sleep(0.01)
+        _Point.in_flight -= 1
+        return _recorded()
+
+    def _set_flow_statistics(self, flow_stats):
+        if self.fail:
+            raise ValueError('bad response')
+        self.statistics = flow_stats[0]['regressionRegions'][0]['results']
+
+
+def test_verification_is_concurrent_and_errors_stay_with_their_point():
+    points = [_Point() for _ in range(5)] + [_Point(fail=True)]
+    estimator = RegressionEstimator(verify_fraction=1.0)
+    errors = asyncio.run(estimator.estimate(points))
+
+    assert [e is None for e in errors] == [True] * 5 + [False]
+    assert isinstance(errors[-1], ValueError)
+    assert estimator.stats == {'local': 5, 'remote': 1, 'verified': 5, 'mismatched': 0}
+    assert _Point.most_in_flight > 1
+    assert all(pt.statistics[0]['equivalentYears'] == 2.4 for pt in points[:5])
@@ -0,0 +1,113 @@
+import asyncio
+import pytest
+from streamstats_access.hedging import HedgePolicy
+from streamstats_access.pool import ServerPool
+
+SERVERS = ['prodweba', 'prodwebb', 'prodwebc']
+
+
+class _Send:
+    """
+    Stands in for a request: the servers in `slow` answer only after `slow_for` seconds (or never), the rest at
+    once.  Records the servers sent to and the requests that were cancelled.
+    """
+
+    def __init__(self, slow=('prodweba',), slow_for=None, fail=()):
+        self.slow = slow
+        self.slow_for = slow_for
+        self.fail = fail
+        self.sent = []
+        self.cancelled = []
+
+    async def __call__(self, server):
+        self.sent.append(server)
+        try:
+            if server in self.slow:
+                await asyncio.sleep(3600 if self.slow_for is None else self.slow_for)
+        except asyncio.CancelledError:
+            self.cancelled.append(server)
+            raise
+        if server in self.fail:
+            raise ConnectionError(server)
+        return server
+
+
+def _policy(**kwargs):
+    policy = HedgePolicy(**{'percentile': 90, 'max_ratio': 1.0, 'min_samples': 10, 'window': 100,
+                            'endpoints': ['watershed', 'scenarios'], 'servers': SERVERS, **kwargs})
+    for latency in range(1, 11):
+        policy.record('watershed', latency / 1000)
+    return policy
+
+
+def test_delay_is_the_latency_percentile_once_there_are_enough_samples():
+    policy = _policy()
+    assert policy.delay('watershed') == 0.01
+    policy.record('watershed', 0.5)
+    assert policy.delay('watershed') == 0.01
+    policy.record('watershed', 0.6)
+    assert policy.delay('watershed') == 0.5
+    assert policy.delay('scenarios') is None
+
+
+def test_slow_request_is_hedged_to_the_alternate_and_the_loser_cancelled():
+    policy = _policy()
+    send = _Send()
+
+    async def run():
+        result = await policy.run('watershed', send, 'prodweba', policy.alternate('prodweba'))
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == 'prodwebb'
+    assert send.sent == ['prodweba', 'prodwebb']
+    assert send.cancelled == ['prodweba']
+    assert policy.hedged == 1 and policy._stats['watershed'].won == 1
+
+
+def test_requests_are_not_hedged_before_min_samples_or_for_other_endpoints():
+    policy = _policy()
+    send = _Send(slow_for=0.05)
+
+    async def run():
+        await policy.run('scenarios', send, 'prodweba')
+        await policy.run('basinCharacteristics', send, 'prodweba', 'prodwebb')
+
+    asyncio.run(run())
+    assert send.sent == ['prodweba', 'prodweba']
+    assert policy.hedged == 0 and policy.requests == 1
+
+
+def test_hedges_are_capped_at_max_ratio():
+    policy = _policy(max_ratio=0.5)
+    # Enough fast samples that the unhedged requests' latencies do not move the percentile
+    for _ in range(40):
+        policy.record('watershed', 0.01)
+    send = _Send(slow_for=0.05)
+
+    async def run():
+        return [await policy.run('watershed', send, 'prodweba', 'prodwebb') for _ in range(4)]
+
+    assert asyncio.run(run()) == ['prodweba', 'prodwebb', 'prodweba', 'prodwebb']
+    assert policy.requests == 4 and policy.hedged == 2
+
+
+def test_failed_copy_falls_back_to_the_other_and_both_failing_raises_the_original_error():
+    policy = _policy()
+
+    async def run(send):
+        return await policy.run('watershed', send, 'prodweba', 'prodwebb')
+
+    assert asyncio.run(run(_Send(slow_for=0.05, fail=('prodwebb',)))) == 'prodweba'
+    with pytest.raises(ConnectionError, match='prodweba'):
+        asyncio.run(run(_Send(slow_for=0.05, fail=('prodweba', 'prodwebb'))))
+
+
+def test_alternate_skips_ejected_servers():
+    pool = ServerPool(SERVERS)
+    policy = _policy(pool=pool)
+    assert policy.alternate('prodweba') == 'prodwebb'
+    pool.hosts['prodwebb'].open_until = 1e12
+    assert policy.alternate('prodweba') == 'prodwebc'
+    pool.hosts['prodwebc'].open_until = 1e12
+    assert policy.alternate('prodweba') == 'prodweba'
@@ -0,0 +1,46 @@
+import asyncio
+import random
+from streamstats_access.limiter import AIMDLimiter
+
+
+async def _serve(limiter, endpoint, latency):
+    await limiter.acquire()
+    await limiter.release(latency, endpoint=endpoint)
+
+
+def test_fast_and_slow_endpoints_on_one_host_do_not_collapse_the_limit():
+    limiter = AIMDLimiter(initial_limit=4, max_limit=32)
+    rng = random.Random(0)
+
+    async def run():
+        for _ in range(500):
+            # A parameter lookup answers in ~50 ms, a delineation on the same host in ~2 s
+            await _serve(limiter, '/nss/parameters.json', 0.05 * rng.lognormvariate(0, 0.5))
+            await _serve(limiter, '/ss/watershed.geojson', 2.0 * rng.lognormvariate(0, 0.5))
+
+    asyncio.run(run())
+    assert limiter.limit == 32
+
+
+def test_latency_rise_on_an_endpoint_backs_off():
+    limiter = AIMDLimiter(initial_limit=16, max_limit=16)
+
+    async def run():
+        for _ in range(100):
+            await _serve(limiter, '/ss/watershed.geojson', 1.0)
+        for _ in range(10):
+            await _serve(limiter, '/ss/watershed.geojson', 10.0)
+
+    asyncio.run(run())
+    assert limiter.limit < 16
+
+
+def test_overload_backs_off():
+    limiter = AIMDLimiter(initial_limit=8, max_limit=16)
+
+    async def run():
+        await limiter.acquire()
+        await limiter.release(0.1, overloaded=True, endpoint='/ss/watershed.geojson')
+
+    asyncio.run(run())
+    assert limiter.limit == 4
@@ -0,0 +1,44 @@
+import asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from benchmarks.mock_server import override_config
+from streamstats_access import metrics as metrics_module
+from streamstats_access.api_client import APIClient
+from streamstats_access.metrics import BatchMetrics
+
+BODY = b'{"parameters": [{"code": "DRNAREA", "value": 1.5}]}'
+
+
+async def _parameters(request):
+    await request.read()
+    return web.Response(body=BODY, content_type='application/json')
+
+
+def test_endpoint_is_resolved_once_per_request(monkeypatch):
+    resolved = []
+    original = metrics_module.endpoint_name
+
+    def endpoint_name(url):
+        resolved.append(url)
+        return original(url)
+
+    monkeypatch.setattr(metrics_module, 'endpoint_name', endpoint_name)
+    metrics = BatchMetrics()
+
+    async def run():
+        app = web.Application()
+        app.router.add_post('/{server}/streamstatsservices/parameters.json', _parameters)
+        async with TestServer(app) as server:
+            with override_config(str(server.make_url('')).rstrip('/')):
+                async with APIClient(trace_configs=[metrics.trace_config()]) as client:
+                    url = str(server.make_url('/prodweba/streamstatsservices/parameters.json'))
+                    for _ in range(2):
+                        await client.post(url, params={'rcode': 'VT'}, data=b'{"workspaceID": "VT1"}')
+
+    asyncio.run(run())
+    assert len(resolved) == 2
+    labels = {name: dict(labels) for name, labels in metrics.counters}
+    assert labels['ssa_requests_total']['endpoint'] == 'basinCharacteristics'
+    assert labels['ssa_response_bytes_total'] == {'endpoint': 'basinCharacteristics'}
+    assert metrics.total('ssa_response_bytes_total') == 2 * len(BODY)
+    assert metrics.total('ssa_request_bytes_total') == 2 * len(b'{"workspaceID": "VT1"}')
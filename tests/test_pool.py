@@ -0,0 +1,121 @@
+import types
+import pytest
+from streamstats_access import pool as pool_module
+from streamstats_access.pool import ServerPool
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+class _Random:
+    """
+    Records the weights of every draw and picks the first candidate.
+    """
+
+    def __init__(self):
+        self.draws = []
+
+    def choices(self, hosts, weights):
+        self.draws.append({h.name: w for h, w in zip(hosts, weights)})
+        return [hosts[0]]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(pool_module, 'time', types.SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+@pytest.fixture
+def draws(monkeypatch):
+    draws = _Random()
+    monkeypatch.setattr(pool_module, 'random', draws)
+    return draws
+
+
+def _pool():
+    return ServerPool(['prodweba', 'prodwebb'], failure_threshold=3, cooldown=10, max_cooldown=25, smoothing=0.5)
+
+
+def test_weights_follow_error_rate_and_latency(clock, draws):
+    pool = _pool()
+    pool.record('prodweba', 2.0, True)
+    pool.record('prodwebb', 0.5, True)
+    pool.record('prodwebb', 0.5, False)
+    pool.choose()
+    a, b = pool.hosts['prodweba'], pool.hosts['prodwebb']
+    assert b.error_rate == 0.5 and b.latency == 0.5
+    assert draws.draws[-1]['prodweba'] == pytest.approx(1 / 2.0)
+    assert draws.draws[-1]['prodwebb'] == pytest.approx((1 - 0.5) ** 2 / 0.5)
+
+    # A server with no samples is weighted as if it were as fast as the fastest one
+    pool = ServerPool(['prodweba', 'prodwebb', 'prodwebc'], smoothing=0.5)
+    pool.record('prodweba', 2.0, True)
+    pool.record('prodwebb', 0.5, True)
+    pool.choose()
+    assert draws.draws[-1]['prodwebc'] == pytest.approx(draws.draws[-1]['prodwebb'])
+
+
+def test_server_is_ejected_after_consecutive_failures(clock, draws):
+    pool = _pool()
+    pool.record('prodweba', 1.0, False)
+    pool.record('prodweba', 1.0, False)
+    pool.record('prodweba', 1.0, True)
+    pool.record('prodweba', 1.0, False)
+    pool.record('prodweba', 1.0, False)
+    assert pool.hosts['prodweba'].open_until is None
+
+    pool.record('prodweba', 1.0, False)
+    host = pool.hosts['prodweba']
+    assert host.open_until == clock.now + 10 and host.ejections == 1
+    assert {pool.choose() for _ in range(5)} == {'prodwebb'}
+    assert all(set(d) == {'prodwebb'} for d in draws.draws)
+
+
+def test_half_open_probe_re_ejects_then_readmits(clock, draws):
+    pool = _pool()
+    for _ in range(3):
+        pool.record('prodweba', 1.0, False)
+    host = pool.hosts['prodweba']
+
+    clock.now += 9
+    assert pool.choose() == 'prodwebb'
+    # Requests already in flight when it was ejected do not change the breaker
+    pool.record('prodweba', 1.0, False)
+    assert host.open_until == 110 and host.trips == 1
+
+    clock.now += 1
+    assert pool.choose() == 'prodweba'
+    # Only one probe at a time
+    assert pool.choose() == 'prodwebb'
+    pool.record('prodweba', 1.0, False)
+    assert host.open_until == clock.now + 20 and host.ejections == 2
+
+    clock.now += 20
+    assert pool.choose() == 'prodweba'
+    pool.record('prodweba', 1.0, True)
+    assert host.open_until is None and host.trips == 0
+    assert pool.choose() == 'prodweba'
+    assert set(draws.draws[-1]) == {'prodweba', 'prodwebb'}
+
+
+def test_cooldown_is_capped_and_soonest_server_is_used_when_all_are_ejected(clock, draws):
+    pool = _pool()
+    for name in ('prodwebb', 'prodweba'):
+        for _ in range(3):
+            pool.record(name, 1.0, False)
+        clock.now += 1
+    assert pool.choose() == 'prodwebb'
+
+    host = pool.hosts['prodweba']
+    for cooldown in (20, 25, 25):
+        clock.now = host.open_until
+        assert pool.choose() == 'prodweba'
+        pool.record('prodweba', 1.0, False)
+        assert host.open_until == clock.now + cooldown
@@ -0,0 +1,38 @@
+import sqlite3
+import pandas as pd
+from streamstats_access.models import Point
+from streamstats_access.utils import discard_unfinished, read_finished_ids
+from streamstats_access.writers import GeoPackageWriter
+
+
+def _response(group_id, code):
+    return {'statisticGroupID': group_id,
+            'regressionRegions': [{'results': [{'name': code, 'code': code, 'value': 1.0}]}]}
+
+
+def test_statistics_are_labelled_with_the_requested_group():
+    pt = Point('VT', -72.5, 44.5, 4326, uid=1, api_client=object(), stat_groups=[2, 4])
+    # The service echoes another ID than the one requested for the second group
+    pt._set_flow_statistics([_response(2, 'PK2'), _response(31, 'M7D10Y')])
+    assert [(row['statisticGroupID'], row['code']) for row in pt.statistics] == [(2, 'PK2'), (4, 'M7D10Y')]
+
+
+def test_resume_reruns_points_missing_a_group(tmp_path):
+    out_path = str(tmp_path / 'out.gpkg')
+    statistics = pd.DataFrame({'StatGroup': [2, 4, 2], 'StatLabel': ['PK2', 'M7D10Y', 'PK2']},
+                              index=pd.Index([1, 1, 2], name='UID'))
+    characteristics = pd.DataFrame({'StatLabel': ['DRNAREA', 'DRNAREA']}, index=pd.Index([1, 2], name='UID'))
+    with GeoPackageWriter(out_path) as writer:
+        writer.write_prepared({'characteristics': characteristics, 'statistics': statistics})
+
+    assert read_finished_ids(out_path, 'UID') == {'1', '2'}
+    finished = read_finished_ids(out_path, 'UID', [2, 4])
+    assert finished == {'1'}
+
+    discard_unfinished(out_path, 'UID', finished)
+    con = sqlite3.connect(out_path)
+    try:
+        assert {r[0] for r in con.execute('SELECT UID FROM statistics')} == {1}
+        assert {r[0] for r in con.execute('SELECT UID FROM characteristics')} == {1}
+    finally:
+        con.close()
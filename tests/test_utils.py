@@ -0,0 +1,88 @@
+import sys
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from benchmarks.bench_export import build_tables_per_point, make_point
+from shapely.geometry import Point as ShapelyPoint, Polygon
+from streamstats_access.models import Point
+from streamstats_access.utils import _read_chunks, build_tables, cluster_points, iter_datasource
+
+
+@pytest.fixture
+def in_path(tmp_path):
+    n = 1050
+    gdf = gpd.GeoDataFrame({'UID': np.arange(n), 'rcode': ['VT'] * n},
+                           geometry=gpd.points_from_xy(np.linspace(-73, -72, n), np.linspace(44, 45, n)), crs=4326)
+    path = str(tmp_path / 'in.gpkg')
+    gdf.to_file(path)
+    return path
+
+
+@pytest.mark.parametrize('streamed', [True, False])
+def test_chunks_cover_the_file_once(in_path, streamed, monkeypatch):
+    if streamed:
+        pytest.importorskip('pyarrow')
+    else:
+        monkeypatch.setitem(sys.modules, 'pyarrow', None)
+    chunks = list(_read_chunks(in_path, 100))
+    assert [len(c) for c in chunks] == [100] * 10 + [50]
+    combined = pd.concat(chunks, ignore_index=True)
+    full = gpd.read_file(in_path)
+    assert combined['UID'].tolist() == full['UID'].tolist()
+    assert combined.crs == full.crs
+    assert combined.geometry.geom_equals(full.geometry).all()
+
+
+def test_iter_datasource_reads_points_in_chunks(in_path):
+    chunks = list(iter_datasource(in_path, 'VT', 'UID', api_client=object(), chunk_size=500, bbox=(-73, 44, -72.5, 45)))
+    assert [len(c) for c in chunks] == [500, 25]
+    assert chunks[0][0].id == 0
+
+
+def _finish(pt, i):
+    """
+    Gives a point the results a finished delineation and flow statistics computation would.
+    """
+    pt.wshed_features = [({'DRNAREA': float(i)}, Polygon([(i, 0), (i + 1, 0), (i + 1, 1)]).wkb)]
+    pt.pt_features = [({}, ShapelyPoint(i, 0).wkb)]
+    pt.characteristics = [{'code': 'DRNAREA', 'description': 'Drainage area', 'units': 'mi2', 'value': float(i)}]
+    pt.statistics = [{'statisticGroupID': 2, 'name': 'PK2', 'code': 'PK2', 'value': 10.0 * i, 'units': 'cfs'}]
+
+
+def test_cluster_points_merges_across_grid_cells_and_outputs_every_member():
+    tolerance = 10.0
+    # Two points 2 m apart on either side of a grid line, plus one in another region at the same spot
+    utm = gpd.GeoSeries.from_xy([-72.5], [44.5], crs=4326).estimate_utm_crs()
+    line = (gpd.GeoSeries.from_xy([-72.5], [44.5], crs=4326).to_crs(utm).x[0] // tolerance) * tolerance
+    geoms = gpd.GeoSeries.from_xy([line - 1, line + 1, line + 1, line + 500], [4930000] * 4, crs=utm).to_crs(4326)
+    rcodes = ['VT', 'VT', 'NH', 'VT']
+    points = [Point(rcode, g.x, g.y, 4326, uid=f'p{i}', field_name='UID', api_client=object())
+              for i, (rcode, g) in enumerate(zip(rcodes, geoms))]
+
+    representatives = cluster_points(points, tolerance)
+    assert [pt.id for pt in representatives] == ['p0', 'p2', 'p3']
+    assert representatives[0].members == ['p1']
+    assert [pt.members for pt in representatives[1:]] == [(), ()]
+
+    for i, pt in enumerate(representatives):
+        _finish(pt, i)
+    tables = build_tables(representatives)
+    for layer in ('globalwatershed', 'globalwatershedpoint', 'characteristics', 'statistics'):
+        assert sorted(tables[layer].index) == ['p0', 'p1', 'p2', 'p3'], layer
+    stats = tables['statistics']
+    assert stats.loc['p1', 'Value'] == stats.loc['p0', 'Value'] == 0.0
+    assert tables['globalwatershed'].loc['p3', 'DRNAREA'] == 2.0
+
+
+def test_build_tables_matches_the_original_export():
+    points = [make_point(i, n_vertices=20, keep_raw=True) for i in range(5)]
+    expected = build_tables_per_point(points)
+    actual = build_tables(points)
+
+    assert list(actual) == list(expected)
+    # StatGroup is the only column the original export did not have
+    assert actual['statistics']['StatGroup'].tolist() == [2] * len(actual['statistics'])
+    actual['statistics'] = actual['statistics'].drop(columns=['StatGroup'])
+    for layer in expected:
+        pd.testing.assert_frame_equal(pd.DataFrame(actual[layer]), pd.DataFrame(expected[layer]))
@@ -0,0 +1,103 @@
+import json
+import sqlite3
+import geopandas as gpd
+import pandas as pd
+import pytest
+from shapely.geometry import MultiPolygon, Point, Polygon
+from streamstats_access.writers import GeoPackageWriter, GeoParquetWriter, _to_arrow
+
+
+def _polygon(i):
+    return Polygon([(i, 0), (i + 1, 0), (i + 1, 1)])
+
+
+def _watersheds(ids, geometries=None, **fields):
+    geometries = geometries or [_polygon(i) for i in range(len(ids))]
+    gdf = gpd.GeoDataFrame(fields, geometry=geometries, crs=4326)
+    gdf.index = pd.Index(ids, name='UID')
+    return gdf
+
+
+def _statistics(ids, **fields):
+    return pd.DataFrame(fields, index=pd.Index(ids, name='UID'))
+
+
+def test_geopackage_adds_fields_first_seen_in_a_later_batch(tmp_path):
+    out_path = str(tmp_path / 'out.gpkg')
+    with GeoPackageWriter(out_path) as writer:
+        writer.write_prepared({'globalwatershed': _watersheds([1, 2], DRNAREA=[1.5, 2.5]),
+                               'statistics': _statistics([1, 2], StatLabel=['PK2', 'PK2'], Value=[10.0, 20.0])})
+        writer.write_prepared({'globalwatershed': _watersheds([3], DRNAREA=[3.5], ELEV=[120.0]),
+                               'statistics': _statistics([3], StatLabel=['PK2'], Value=[30.0], Years=[4.2])})
+
+    wshed = gpd.read_file(out_path, layer='globalwatershed')
+    assert wshed['ELEV'].isna().tolist() == [True, True, False]
+    assert wshed['ELEV'].iloc[2] == 120.0
+    assert len(wshed) == 3 and wshed.geometry.notna().all()
+
+    con = sqlite3.connect(out_path)
+    try:
+        rows = con.execute('SELECT UID, Value, Years FROM statistics ORDER BY UID').fetchall()
+    finally:
+        con.close()
+    assert rows == [(1, 10.0, None), (2, 20.0, None), (3, 30.0, 4.2)]
+
+
+@pytest.mark.filterwarnings('ignore:geometry column type')
+def test_geopackage_geometry_type_covers_every_batch(tmp_path):
+    out_path = str(tmp_path / 'out.gpkg')
+    with GeoPackageWriter(out_path) as writer:
+        writer.write_prepared({'globalwatershed': _watersheds([1, 2])})
+        writer.write_prepared({'globalwatershed': _watersheds([3], [MultiPolygon([_polygon(3), _polygon(5)])])})
+        con = sqlite3.connect(out_path)
+        declared = con.execute('SELECT geometry_type_name FROM gpkg_geometry_columns').fetchone()[0]
+        con.close()
+        assert declared == 'MULTIPOLYGON'
+        assert set(gpd.read_file(out_path, layer='globalwatershed').geom_type) == {'MultiPolygon'}
+
+        writer.write_prepared({'globalwatershed': _watersheds([4], [Point(0, 0)])})
+    con = sqlite3.connect(out_path)
+    declared = con.execute('SELECT geometry_type_name FROM gpkg_geometry_columns').fetchone()[0]
+    con.close()
+    assert declared == 'GEOMETRY'
+    assert len(gpd.read_file(out_path, layer='globalwatershed')) == 4
+
+
+def test_geoparquet_geometry_types_cover_every_batch(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    out_path = str(tmp_path / 'out')
+    with GeoParquetWriter(out_path) as writer:
+        writer.write_prepared({'globalwatershed': _to_arrow(_watersheds([1, 2]))})
+        writer.write_prepared({'globalwatershed': _to_arrow(_watersheds([3], [MultiPolygon([_polygon(3)])]))})
+    path = str(tmp_path / 'out' / 'globalwatershed.parquet')
+    geo = json.loads(pq.ParquetFile(path).metadata.metadata[b'geo'])
+    assert geo['columns']['geometry']['geometry_types'] == ['MultiPolygon', 'Polygon']
+    assert len(gpd.read_parquet(path)) == 3
+
+
+def _tables(con):
+    return {r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def test_rerun_into_the_same_geopackage_leaves_no_stale_layers(tmp_path):
+    out_path = str(tmp_path / 'out.gpkg')
+    with GeoPackageWriter(out_path) as writer:
+        writer.write_prepared({'globalwatershed': _watersheds([1, 2], DRNAREA=[1.5, 2.5]),
+                               'globalwatershedpoint': _watersheds([1, 2], [Point(0, 0), Point(1, 0)]),
+                               'characteristics': _statistics([1, 2], Code=['DRNAREA'] * 2, Value=[1.5, 2.5]),
+                               'statistics': _statistics([1, 2], StatLabel=['PK2', 'PK2'], Value=[10.0, 20.0])})
+    with GeoPackageWriter(out_path) as writer:
+        writer.write_prepared({'globalwatershedpoint': _watersheds([3], [Point(2, 0)]),
+                               'statistics': _statistics([3], StatLabel=['PK2'], Value=[30.0])})
+
+    con = sqlite3.connect(out_path)
+    try:
+        tables = _tables(con)
+        layers = {r[0] for r in con.execute('SELECT table_name FROM gpkg_contents')}
+        rows = con.execute('SELECT UID, Value FROM statistics').fetchall()
+    finally:
+        con.close()
+    assert 'globalwatershed' not in tables and 'characteristics' not in tables
+    assert layers == {'globalwatershedpoint'}
+    assert rows == [(3, 30.0)]
+    assert gpd.read_file(out_path, layer='globalwatershedpoint').index.size == 1